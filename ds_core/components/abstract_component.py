@@ -15,17 +15,124 @@ You will find a copy of this licenseIn the root directory of the project
 or you can visit <https://www.gnu.org/licenses/> For further information.
 """
 
+import asyncio
 import os
 import platform
+import threading
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, wait, ALL_COMPLETED
 from typing import Any
+import pyarrow as pa
 from ds_core.components.core_commons import CoreCommons
 from ds_core.intent.abstract_intent import AbstractIntentModel
 from ds_core.properties.abstract_properties import AbstractPropertyManager
-from ds_core.handlers.abstract_handlers import ConnectorContract, HandlerFactory
+from ds_core.handlers.abstract_handlers import ConnectorContract, HandlerFactory, HandlerRegistry
 from ds_core.handlers.abstract_handlers import AbstractPersistHandler, AbstractSourceHandler
 
 
+class CanonicalCache(object):
+    """ A thread safe, in process, least recently used cache of loaded canonicals bounded by their total size in
+    bytes. Each entry keeps the handler that loaded it and the ``source_state()`` of the source when it was
+    loaded, and is invalidated once the source state differs or the source no longer exists. Sources without a
+    state are not cached.
+
+    The maximum size can be set with the environment variable HADRON_CANONICAL_CACHE_SIZE (bytes).
+    """
+
+    def __init__(self, max_bytes: int=None):
+        self._max_bytes = max_bytes if isinstance(max_bytes, int) else int(os.environ.get(
+            'HADRON_CANONICAL_CACHE_SIZE', 1024 ** 3))
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.RLock()
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def stats(self) -> dict:
+        """ returns the cache counters """
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'entries': len(self._entries),
+                    'nbytes': self._nbytes, 'max_bytes': self._max_bytes}
+
+    def get(self, key: tuple) -> Any:
+        """ returns the cached canonical or None if not cached or the source has changed. The source state is
+        taken outside the lock so a slow source doesn't hold up other lookups """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+        handler, state, canonical, _ = entry
+        valid = handler.source_state() == state
+        with self._lock:
+            # the entry may have been replaced or evicted while the state was taken
+            current = self._entries.get(key) is entry
+            if valid:
+                if current:
+                    self._entries.move_to_end(key)
+                self._hits += 1
+                return canonical
+            if current:
+                self._pop(key)
+            self._misses += 1
+            return None
+
+    def put(self, key: tuple, handler: Any, canonical: Any, state: Any):
+        """ caches the canonical loaded by the handler, evicting the least recently used beyond the maximum size.
+        Canonicals without an nbytes size, larger than the maximum or without a source state are not cached.
+
+        :param key: the cache key
+        :param handler: the handler that loaded the canonical
+        :param canonical: the loaded canonical
+        :param state: the handler's source_state() taken before the load, so a change while loading is seen
+        """
+        nbytes = getattr(canonical, 'nbytes', None)
+        if not isinstance(nbytes, int) or nbytes > self._max_bytes or state is None:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (handler, state, canonical, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self._max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def invalidate(self, contract_key: str=None):
+        """ removes the entries of the connector contract key, or all entries if None """
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if contract_key is None or key[0] == contract_key:
+                    self._pop(key)
+
+    def clear(self):
+        """ removes all entries and resets the counters """
+        with self._lock:
+            self.invalidate()
+            self._hits = 0
+            self._misses = 0
+
+    def _pop(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry[3]
+
+
 class AbstractComponent(ABC):
     """ Abstract AI Single Task Application Component (AI-STAC) component class provides all the basic building blocks
     of a components build including property management, augmented knowledge notes and parameterised intent pipeline.
@@ -77,6 +184,14 @@ class AbstractComponent(ABC):
     DEFAULT_MODULE = 'ds_core.handlers.base_handlers'
     DEFAULT_SOURCE_HANDLER = 'BaseSourceHandler'
     DEFAULT_PERSIST_HANDLER = 'BasePersistHandler'
+    # asynchronous persist writer pool shared by all components
+    PERSIST_WORKERS = 2
+    PERSIST_QUEUE_SIZE = 8
+    _persist_pool: ThreadPoolExecutor = None
+    _persist_slots: threading.BoundedSemaphore = None
+    _persist_lock = threading.Lock()
+    # in process canonical cache shared by all components
+    _canonical_cache: CanonicalCache = None
 
     def __init__(self, property_manager: Any, intent_model: Any, default_save: bool=None, reset_templates: bool=None,
                  template_path: str = None, template_module: str = None, template_source_handler: str = None,
@@ -108,6 +223,7 @@ class AbstractComponent(ABC):
             raise ValueError("The intent_model must be a concrete implementation of the AbstractIntent")
         # set instance references
         self._component_pm = property_manager
+        self._pending_persist = {}
         self._intent_model = intent_model
         self._default_save = default_save if isinstance(default_save, bool) else True
         # align templates and connectors
@@ -333,8 +449,13 @@ class AbstractComponent(ABC):
 
     @classmethod
     def _from_handler(cls, schema: str) -> (str, str, str):
-        """ Class Factory Method that builds the connector handlers for the schema."""
+        """ Class Factory Method that builds the connector handlers for the schema. Registered schemes are
+        resolved by the HandlerRegistry without importing their module, otherwise the handlers are found by naming
+        convention in ds_core and the package root."""
         schema = schema if isinstance(schema, str) else ""
+        registered = HandlerRegistry.lookup(schema)
+        if registered is not None:
+            return registered
         for _package in ['ds_core', cls.get_pkg_root()]:
             _module_name = f'{_package}.handlers.{schema.lower()}_handlers'
             _source_handler = f'{schema.title()}SourceHandler'
@@ -414,6 +535,17 @@ class AbstractComponent(ABC):
             self.pm.persist_properties(only_branch=True)
         return
 
+    def pm_batch(self):
+        """ a context manager grouping the changes of many mutators into one property manager transaction. The
+        contract is persisted once on exit, or rolled back if an exception is raised.
+
+        Example:
+            with component.pm_batch():
+                component.set_source_uri(...)
+                component.set_persist_uri(...)
+        """
+        return self.pm.transaction()
+
     @property
     def pm_name(self) -> str:
         """The contract name of this transition instance"""
@@ -833,57 +965,308 @@ class AbstractComponent(ABC):
         CANONICAL SECTION
     """
     def load_canonical(self, connector_name: str, reset_changed: bool=None, has_changed: bool=None,
-                       return_empty: bool=None, **kwargs) -> Any:
+                       return_empty: bool=None, stream: bool=None, columns: list=None, filter: Any=None,
+                       cache: bool=None, reuse_schema: bool=None, **kwargs) -> Any:
         """returns the canonical of the referenced connector
 
+        With cache set, the canonical is held in the process wide ``canonical_cache()`` keyed on the connector
+        contract and load arguments, and returned from there until the handler's source state changes.
+
+        With reuse_schema set, or the Connector Contract kwarg 'reuse_schema', the schema of the first load is
+        recorded as the connector's canonical schema in the property manager and passed to later loads as
+        'column_types' so csv sources are read without type inference. It is persisted with the contract's next
+        persist. The recorded schema can be replaced, for
+        example with that of a cast canonical, using ``pm.set_canonical_schema(connector_name, schema)`` and is
+        dropped and re-recorded should the source no longer convert to it.
+
         :param connector_name: the name or label to identify and reference the connector
         :param reset_changed: (optional) resets the has_changed boolean to True
         :param has_changed: (optional) tests if the underline canonical has changed since last load else error returned
         :param return_empty: (optional) if has_changed is set, returns an empty canonical if set to True
+        :param stream: (optional) if True the handler returns an iterable reader of record batches, not a table
+        :param columns: (optional) a list of column names to project, pushed down to the handler's reader
+        :param filter: (optional) a row filter expression or DNF list of tuples, pushed down to the handler's reader
+        :param cache: (optional) if True the canonical is cached in process. Default False
+        :param reuse_schema: (optional) if True records and reuses the canonical schema. Default False
         :param kwargs: arguments to be passed to the handler on load
         """
         if self.pm.has_connector(connector_name):
-            has_changed = has_changed if isinstance(has_changed, bool) else False
-            reset_changed = reset_changed if isinstance(reset_changed, bool) else False
             handler = self.pm.get_connector_handler(connector_name)
-            if has_changed and handler.exists() == False:
-                if isinstance(return_empty, bool) and return_empty:
-                    return {}
-                raise ConnectionAbortedError("The connector name {} has been aborted as the canonical to load "
-                                             "does not exist".format(connector_name))
-            if has_changed and handler.has_changed() == False:
-                if isinstance(return_empty, bool) and return_empty:
-                    return {}
-                raise ConnectionAbortedError("The connector name {} has been aborted as the canonical to load "
-                                             "has not changed".format(connector_name))
-            canonical = handler.load_canonical(**kwargs)
-            handler.reset_changed(changed=reset_changed)
-            return canonical
+            # read your own writes
+            self._wait_persist(connector_name)
+            answer, reuse_schema, cache_key, state = self._load_prepare(
+                connector_name, handler, has_changed=has_changed, return_empty=return_empty, stream=stream,
+                columns=columns, filter=filter, cache=cache, reuse_schema=reuse_schema, kwargs=kwargs)
+            if answer is not None:
+                return answer
+            try:
+                canonical = handler.load_canonical(**kwargs)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, ValueError):
+                if not self._reset_schema(connector_name, reuse_schema, kwargs):
+                    raise
+                canonical = handler.load_canonical(**kwargs)
+            return self._load_complete(connector_name, handler, canonical, reuse_schema=reuse_schema,
+                                       reset_changed=reset_changed, cache_key=cache_key, state=state)
         raise ConnectionError("The connector name {} can't be found.".format(connector_name))
 
-    def persist_canonical(self, connector_name: str, canonical: Any, **kwargs):
+    def persist_canonical(self, connector_name: str, canonical: Any, asynchronous: bool=None, **kwargs) -> Any:
         """persists the canonical to the referenced connector. same as save_canonical
 
+        With asynchronous set, the persist is queued on a background writer pool shared by all components and a
+        Future is returned so compute can overlap I/O. Persists to the same connector are written in the order they
+        were made and when PERSIST_QUEUE_SIZE persists are outstanding the call blocks until one completes. Use
+        ``flush()`` as a barrier to wait for, and raise any errors from, outstanding persists.
+
         :param connector_name: the name or label to identify and reference the connector
         :param canonical: the canonical data to persist
+        :param asynchronous: (optional) if True persists in the background returning a Future. Default False
         :param kwargs: arguments to be passed to the handler on persist
+        :return: a Future of the handler result if asynchronous else None
         """
         if self.pm.has_connector(connector_name):
             handler = self.pm.get_connector_handler(connector_name)
+            self._canonical_cache_invalidate(connector_name)
+            if isinstance(asynchronous, bool) and asynchronous:
+                return self._submit_persist(connector_name, handler, canonical, **kwargs)
+            self._wait_persist(connector_name)
             handler.persist_canonical(canonical, **kwargs)
             return
         raise ConnectionError("The connector name {} can't be found.".format(connector_name))
 
-    def save_canonical(self, connector_name: str, canonical: Any, **kwargs):
+    def save_canonical(self, connector_name: str, canonical: Any, asynchronous: bool=None, **kwargs) -> Any:
         """saves the canonical to the referenced connector. Same as persist_canonical
 
         :param connector_name: the name or label to identify and reference the connector
         :param canonical: the canonical data to persist
+        :param asynchronous: (optional) if True persists in the background returning a Future. Default False
         :param kwargs: arguments to be passed to the handler on persist
+        :return: a Future of the handler result if asynchronous else None
+        """
+        return self.persist_canonical(connector_name=connector_name, canonical=canonical, asynchronous=asynchronous,
+                                      **kwargs)
+
+    def flush(self, timeout: float=None):
+        """ a barrier that waits for all outstanding asynchronous persists of this component, and any pending
+        write-behind of its contract, to complete, raising the first error should any have failed.
+
+        :param timeout: (optional) the maximum seconds to wait
         """
-        self.persist_canonical(connector_name=connector_name, canonical=canonical, **kwargs)
+        self.pm.flush()
+        pending = list(self._pending_persist.items())
+        done, not_done = wait([f for _, f in pending], timeout=timeout, return_when=ALL_COMPLETED)
+        for connector_name, future in pending:
+            if future in done and self._pending_persist.get(connector_name) is future:
+                self._pending_persist.pop(connector_name, None)
+        for _, future in pending:
+            if future in done and future.exception() is not None:
+                raise future.exception()
+        if len(not_done) > 0:
+            raise TimeoutError(f"{len(not_done)} persists did not complete within {timeout} seconds")
         return
 
+    async def aload_canonical(self, connector_name: str, reset_changed: bool=None, has_changed: bool=None,
+                              return_empty: bool=None, stream: bool=None, columns: list=None, filter: Any=None,
+                              cache: bool=None, reuse_schema: bool=None, **kwargs) -> Any:
+        """asyncio counterpart of load_canonical, awaiting the handler's aload_canonical
+
+        :param connector_name: the name or label to identify and reference the connector
+        :param reset_changed: (optional) resets the has_changed boolean to True
+        :param has_changed: (optional) tests if the underline canonical has changed since last load else error returned
+        :param return_empty: (optional) if has_changed is set, returns an empty canonical if set to True
+        :param stream: (optional) if True the handler returns an iterable reader of record batches, not a table
+        :param columns: (optional) a list of column names to project, pushed down to the handler's reader
+        :param filter: (optional) a row filter expression or DNF list of tuples, pushed down to the handler's reader
+        :param cache: (optional) if True the canonical is cached in process. Default False
+        :param reuse_schema: (optional) if True records and reuses the canonical schema. Default False
+        :param kwargs: arguments to be passed to the handler on load
+        """
+        if self.pm.has_connector(connector_name):
+            handler = self.pm.get_connector_handler(connector_name)
+            # read your own writes
+            future = self._pending_persist.get(connector_name)
+            if future is not None:
+                await asyncio.wait([asyncio.wrap_future(future)])
+            # the checks can be blocking network requests so are run off the event loop
+            answer, reuse_schema, cache_key, state = await handler._run_in_executor(
+                self._load_prepare, connector_name, handler, has_changed=has_changed, return_empty=return_empty,
+                stream=stream, columns=columns, filter=filter, cache=cache, reuse_schema=reuse_schema, kwargs=kwargs)
+            if answer is not None:
+                return answer
+            try:
+                canonical = await handler.aload_canonical(**kwargs)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, ValueError):
+                if not self._reset_schema(connector_name, reuse_schema, kwargs):
+                    raise
+                canonical = await handler.aload_canonical(**kwargs)
+            return self._load_complete(connector_name, handler, canonical, reuse_schema=reuse_schema,
+                                       reset_changed=reset_changed, cache_key=cache_key, state=state)
+        raise ConnectionError("The connector name {} can't be found.".format(connector_name))
+
+    async def apersist_canonical(self, connector_name: str, canonical: Any, **kwargs):
+        """asyncio counterpart of persist_canonical, awaiting the handler's apersist_canonical
+
+        :param connector_name: the name or label to identify and reference the connector
+        :param canonical: the canonical data to persist
+        :param kwargs: arguments to be passed to the handler on persist
+        """
+        if self.pm.has_connector(connector_name):
+            handler = self.pm.get_connector_handler(connector_name)
+            future = self._pending_persist.get(connector_name)
+            if future is not None:
+                await asyncio.wait([asyncio.wrap_future(future)])
+            self._canonical_cache_invalidate(connector_name)
+            await handler.apersist_canonical(canonical, **kwargs)
+            return
+        raise ConnectionError("The connector name {} can't be found.".format(connector_name))
+
+    async def aexists(self, connector_name: str) -> bool:
+        """asyncio test of whether the canonical of the referenced connector exists
+
+        :param connector_name: the name or label to identify and reference the connector
+        """
+        if self.pm.has_connector(connector_name):
+            return await self.pm.get_connector_handler(connector_name).aexists()
+        raise ConnectionError("The connector name {} can't be found.".format(connector_name))
+
+    async def ahas_changed(self, connector_name: str) -> bool:
+        """asyncio test of whether the canonical of the referenced connector has changed since last loaded
+
+        :param connector_name: the name or label to identify and reference the connector
+        """
+        if self.pm.has_connector(connector_name):
+            return await self.pm.get_connector_handler(connector_name).ahas_changed()
+        raise ConnectionError("The connector name {} can't be found.".format(connector_name))
+
+    @classmethod
+    def canonical_cache(cls) -> CanonicalCache:
+        """ returns the process wide canonical cache used by load_canonical when cache is set """
+        if AbstractComponent._canonical_cache is None:
+            with AbstractComponent._persist_lock:
+                if AbstractComponent._canonical_cache is None:
+                    AbstractComponent._canonical_cache = CanonicalCache()
+        return AbstractComponent._canonical_cache
+
+    def _canonical_cache_key(self, connector_name: str, cache: bool, **kwargs) -> [tuple, None]:
+        """ returns the canonical cache key or None if the load is not to be cached. Streams and dropped
+        events are single use so are never cached """
+        if not isinstance(cache, bool) or not cache or kwargs.get('stream', False) or kwargs.get('drop', False):
+            return None
+        contract_key = repr(self.pm.get_connector_contract(connector_name))
+        return contract_key, repr(sorted(kwargs.items()))
+
+    def _canonical_cache_invalidate(self, connector_name: str):
+        """ removes any cached canonicals of the connector """
+        if AbstractComponent._canonical_cache is not None:
+            self.canonical_cache().invalidate(repr(self.pm.get_connector_contract(connector_name)))
+
+    def _load_prepare(self, connector_name: str, handler: Any, has_changed: bool, return_empty: bool, stream: bool,
+                      columns: list, filter: Any, cache: bool, reuse_schema: bool, kwargs: dict) -> tuple:
+        """ runs the checks of load_canonical before the source is read, adding the load arguments to kwargs.
+        Returns the canonical should the load be answered without reading the source, else None, with whether
+        the schema is reused, the cache key and the source state taken for the cache.
+        """
+        has_changed = has_changed if isinstance(has_changed, bool) else False
+        if has_changed and handler.exists() == False:
+            if isinstance(return_empty, bool) and return_empty:
+                return {}, False, None, None
+            raise ConnectionAbortedError("The connector name {} has been aborted as the canonical to load "
+                                         "does not exist".format(connector_name))
+        if has_changed and handler.has_changed() == False:
+            if isinstance(return_empty, bool) and return_empty:
+                return {}, False, None, None
+            raise ConnectionAbortedError("The connector name {} has been aborted as the canonical to load "
+                                         "has not changed".format(connector_name))
+        if isinstance(stream, bool) and stream:
+            kwargs.update({'stream': True})
+        if isinstance(columns, list):
+            kwargs.update({'columns': columns})
+        if filter is not None:
+            kwargs.update({'filter': filter})
+        reuse_schema = self._reuse_schema(connector_name, reuse_schema, kwargs)
+        cache_key = self._canonical_cache_key(connector_name, cache, **kwargs)
+        state = None
+        if cache_key is not None:
+            canonical = self.canonical_cache().get(cache_key)
+            if canonical is not None:
+                return canonical, reuse_schema, cache_key, None
+            # capture the source state before the load so a change while loading is seen
+            state = handler.source_state()
+        return None, reuse_schema, cache_key, state
+
+    def _load_complete(self, connector_name: str, handler: Any, canonical: Any, reuse_schema: bool,
+                       reset_changed: bool, cache_key: tuple, state: Any) -> Any:
+        """ records the schema, resets the change flag and caches the canonical once the source is read """
+        reset_changed = reset_changed if isinstance(reset_changed, bool) else False
+        self._record_schema(connector_name, reuse_schema, canonical)
+        handler.reset_changed(changed=reset_changed)
+        if cache_key is not None:
+            self.canonical_cache().put(cache_key, handler, canonical, state)
+        return canonical
+
+    def _reuse_schema(self, connector_name: str, reuse_schema: bool, kwargs: dict) -> bool:
+        """ returns if the connector reuses its schema, adding any recorded schema to the load kwargs """
+        if not isinstance(reuse_schema, bool):
+            _cc = self.pm.get_connector_contract(connector_name)
+            reuse_schema = str(_cc.kwargs.get('reuse_schema', False)).lower() == 'true'
+        if reuse_schema and 'column_types' not in kwargs and self.pm.has_canonical_schema(connector_name):
+            kwargs.update({'column_types': self.pm.get_canonical_schema(connector_name)})
+        return reuse_schema
+
+    def _reset_schema(self, connector_name: str, reuse_schema: bool, kwargs: dict) -> bool:
+        """ drops a recorded schema the source no longer converts to, returning True if there was one """
+        if not reuse_schema or not self.pm.has_canonical_schema(connector_name) or 'column_types' not in kwargs:
+            return False
+        kwargs.pop('column_types')
+        self.pm.remove_canonical_schema(connector_name)
+        return True
+
+    def _record_schema(self, connector_name: str, reuse_schema: bool, canonical: Any):
+        """ records the schema of the first load of the connector, persisted with the next persist of the
+        contract. Types schema_to_dict leaves out are left to inference """
+        schema = getattr(canonical, 'schema', None)
+        if reuse_schema and isinstance(schema, pa.Schema) and not self.pm.has_canonical_schema(connector_name):
+            self.pm.set_canonical_schema(connector_name, CoreCommons.schema_to_dict(schema))
+
+    def _submit_persist(self, connector_name: str, handler: Any, canonical: Any, **kwargs) -> Future:
+        """ queues the persist on the shared writer pool, blocking while the queue is full """
+        with AbstractComponent._persist_lock:
+            if AbstractComponent._persist_pool is None:
+                AbstractComponent._persist_pool = ThreadPoolExecutor(max_workers=self.PERSIST_WORKERS,
+                                                                     thread_name_prefix='hadron_persist')
+                AbstractComponent._persist_slots = threading.BoundedSemaphore(self.PERSIST_QUEUE_SIZE)
+        slots = AbstractComponent._persist_slots
+        previous = self._pending_persist.get(connector_name)
+
+        def _persist():
+            try:
+                # keep the order of persists to the same connector
+                if previous is not None:
+                    wait([previous])
+                return handler.persist_canonical(canonical, **kwargs)
+            finally:
+                slots.release()
+
+        slots.acquire()
+        try:
+            future = AbstractComponent._persist_pool.submit(_persist)
+        except BaseException:
+            slots.release()
+            raise
+        self._pending_persist[connector_name] = future
+
+        def _done(f: Future):
+            # keep failures until they are raised by a flush
+            if f.exception() is None and self._pending_persist.get(connector_name) is f:
+                self._pending_persist.pop(connector_name, None)
+        future.add_done_callback(_done)
+        return future
+
+    def _wait_persist(self, connector_name: str):
+        """ waits for any outstanding asynchronous persist to the connector """
+        future = self._pending_persist.get(connector_name)
+        if future is not None:
+            wait([future])
+
     def backup_canonical(self, connector_name: str, canonical: Any, uri: str, **kwargs):
         """persists the canonical to the referenced connector as a backup using the URI to
         replace the current Connector Contract URI.
@@ -910,6 +1293,7 @@ class AbstractComponent(ABC):
         """
         if self.pm.has_connector(connector_name):
             handler = self.pm.get_connector_handler(connector_name)
+            self._canonical_cache_invalidate(connector_name)
             handler.remove_canonical(**kwargs)
             return
         raise ConnectionError("The connector name {} was not found.".format(connector_name))
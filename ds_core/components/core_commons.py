@@ -556,6 +556,43 @@ class CoreCommons(object):
             rtn_tbl = CoreCommons.table_append(rtn_tbl, pa.table([c], names=[n]))
         return rtn_tbl
 
+    @staticmethod
+    def schema_to_dict(schema: pa.Schema) -> dict:
+        """ returns a dictionary of column names to type strings that can be stored as a property and returned to
+        an Arrow type with 'type_from_str'. Null columns and types 'type_from_str' can't return, such as nested
+        types, are left out """
+        rtn_dict = {}
+        for field in schema:
+            if pa.types.is_null(field.type) or pa.types.is_nested(field.type):
+                continue
+            try:
+                if CoreCommons.type_from_str(str(field.type)) == field.type:
+                    rtn_dict[field.name] = str(field.type)
+            except ValueError:
+                pass
+        return rtn_dict
+
+    @staticmethod
+    def type_from_str(type_str: str) -> pa.DataType:
+        """ returns the Arrow data type of a type string as given by str(pa.DataType). Supports the primitive,
+        temporal, decimal and dictionary types """
+        type_str = type_str.strip()
+        match = re.fullmatch(r'timestamp\[(\w+)(?:, tz=(.+))?\]', type_str)
+        if match:
+            return pa.timestamp(match.group(1), tz=match.group(2))
+        match = re.fullmatch(r'decimal(128|256)\((\d+), (\d+)\)', type_str)
+        if match:
+            _decimal = pa.decimal128 if match.group(1) == '128' else pa.decimal256
+            return _decimal(int(match.group(2)), int(match.group(3)))
+        match = re.fullmatch(r'dictionary<values=(.+), indices=(\w+), ordered=(\d)>', type_str)
+        if match:
+            return pa.dictionary(CoreCommons.type_from_str(match.group(2)), CoreCommons.type_from_str(match.group(1)),
+                                 ordered=match.group(3) == '1')
+        try:
+            return pa.type_for_alias(type_str)
+        except ValueError:
+            raise ValueError(f"The type string '{type_str}' is not a supported Arrow type")
+
 
 class AnalyticsSection(object):
     """A section  subset of the analytics"""
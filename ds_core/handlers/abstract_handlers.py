@@ -15,9 +15,17 @@ You will find a copy of this licenseIn the root directory of the project
 or you can visit <https://www.gnu.org/licenses/> For further information.
 """
 
+import asyncio
+import importlib
+import importlib.metadata
 import importlib.util
+import json
 import os
 import re
+import sys
+import threading
+import time
+from functools import partial
 from configparser import ConfigParser
 from datetime import datetime
 from pathlib import Path
@@ -340,6 +348,31 @@ class AbstractSourceHandler(ABC):
     def load_canonical(self, **kwargs) -> Any:
         pass
 
+    def source_state(self) -> Any:
+        """ returns a comparable fingerprint of the source, such as its modified time and size or ETag, that
+        differs once the source has changed. Unlike has_changed it is not consumed by a load or reset. Returns
+        None if the source doesn't exist or the handler can't tell, the default.
+        """
+        return None
+
+    """
+        ASYNCIO counterparts, by default the synchronous method is run in the event loop's default executor.
+        Concrete handlers should override these where they can avoid, or better manage, the thread hop.
+    """
+    async def aexists(self) -> bool:
+        return await self._run_in_executor(self.exists)
+
+    async def ahas_changed(self) -> bool:
+        return await self._run_in_executor(self.has_changed)
+
+    async def aload_canonical(self, **kwargs) -> Any:
+        return await self._run_in_executor(self.load_canonical, **kwargs)
+
+    @staticmethod
+    async def _run_in_executor(func: Any, *args, executor: Any=None, **kwargs) -> Any:
+        """ runs the blocking function in the executor, or the event loop's default executor if None """
+        return await asyncio.get_running_loop().run_in_executor(executor, partial(func, *args, **kwargs))
+
 
 class AbstractPersistHandler(AbstractSourceHandler):
 
@@ -362,60 +395,269 @@ class AbstractPersistHandler(AbstractSourceHandler):
         """
         pass
 
+    async def apersist_canonical(self, canonical: Any, **kwargs) -> bool:
+        return await self._run_in_executor(self.persist_canonical, canonical, **kwargs)
+
 
 class HandlerFactory(object):
+    """ Resolves and instantiates the handler class of a connector contract. Modules are imported once through
+    sys.modules and each (module, handler) resolution, found or not, is cached so repeat lookups cost a dict
+    access. Use invalidate() after installing or reloading a handler module.
+    """
 
-    @staticmethod
-    def check_module(module_name: str) -> bool:
-        module_spec = importlib.util.find_spec(module_name)
-        if module_spec is None:
-            return False
-        return True
+    _handlers: dict = {}
+    _lock = threading.Lock()
 
     @staticmethod
-    def check_handler(module_name: str, handler: str):
+    def check_module(module_name: str) -> bool:
+        if module_name in sys.modules:
+            return True
         try:
             module_spec = importlib.util.find_spec(module_name)
         except ModuleNotFoundError:
             return False
         if module_spec is None:
             return False
-        module = importlib.util.module_from_spec(module_spec)
-        module_spec.loader.exec_module(module)
-        if handler not in dir(module):
-            return False
         return True
 
+    @classmethod
+    def check_handler(cls, module_name: str, handler: str):
+        return cls.get_handler(module_name, handler) is not None
+
     @staticmethod
     def get_module(module_name: str):
-        module_spec = importlib.util.find_spec(module_name)
-        if module_spec is None:
+        if not HandlerFactory.check_module(module_name):
             raise ModuleNotFoundError(f"The module '{module_name}' could not be found")
-        module = importlib.util.module_from_spec(module_spec)
-        module_spec.loader.exec_module(module)
-        return module
+        return importlib.import_module(module_name)
 
-    @staticmethod
-    def instantiate(connector_contract: ConnectorContract) -> [AbstractSourceHandler, AbstractPersistHandler]:
+    @classmethod
+    def get_handler(cls, module_name: str, handler: str) -> [type, None]:
+        """ returns the handler class from the module, or None if the module or handler can not be found. An
+        error importing a module that exists, such as a missing third party dependency, is raised and not cached
+
+        :param module_name: the fully qualified module name
+        :param handler: the name of the handler class in the module
+        :return: the handler class or None
+        """
+        key = (module_name, handler)
+        if key in cls._handlers:
+            return cls._handlers[key]
+        with cls._lock:
+            if key not in HandlerFactory._handlers:
+                try:
+                    module = cls.get_module(module_name)
+                    HandlerFactory._handlers[key] = getattr(module, handler, None)
+                except ModuleNotFoundError:
+                    # only a missing handler module is a miss, a dependency missing from the module is raised
+                    if cls.check_module(module_name):
+                        raise
+                    HandlerFactory._handlers[key] = None
+        return cls._handlers[key]
+
+    @classmethod
+    def invalidate(cls, module_name: str=None, handler: str=None):
+        """ removes cached resolutions so they are resolved again on next use. With no parameters all are removed
+
+        :param module_name: (optional) only resolutions of this module
+        :param handler: (optional) only resolutions of this handler
+        """
+        with cls._lock:
+            for key in list(HandlerFactory._handlers.keys()):
+                if module_name in [None, key[0]] and handler in [None, key[1]]:
+                    del HandlerFactory._handlers[key]
+        importlib.invalidate_caches()
+
+    @classmethod
+    def instantiate(cls, connector_contract: ConnectorContract) -> [AbstractSourceHandler, AbstractPersistHandler]:
         module_name = connector_contract.module_name
         handler = connector_contract.handler
 
         # check module
-        module_spec = importlib.util.find_spec(module_name)
-        if module_spec is None:
+        if not cls.check_module(module_name):
             raise ModuleNotFoundError(f"The module '{module_name}' could not be found")
 
         # check handler
-        module = importlib.util.module_from_spec(module_spec)
-        module_spec.loader.exec_module(module)
-        if handler not in dir(module):
+        handler_class = cls.get_handler(module_name, handler)
+        if handler_class is None:
             raise ImportError(f"The handler '{handler}' could not be found in the module '{module_name}'")
 
         # create instance of handler
-        local_kwargs = locals().get('kwargs') if 'kwargs' in locals() else dict()
-        local_kwargs['module'] = module
-        local_kwargs['connector_contract'] = connector_contract
-        instance = eval(f'module.{handler}(connector_contract)', globals(), local_kwargs)
+        instance = handler_class(connector_contract)
         if not isinstance(instance, (AbstractSourceHandler, AbstractPersistHandler)):
             raise TypeError(f"The handler '{handler}' in package {module_name} could not be instanciated as a handler")
         return instance
+
+
+class HandlerRegistry(object):
+    """ Maps URI schemes to their module, source handler and persist handler names. Schemes are registered
+    explicitly with register() or by installed packages through 'hadron.handlers' entry points, named by the
+    scheme with the persist handler as the value, for example in setup.py:
+
+        entry_points={'hadron.handlers': ['mongodb = my_package.handlers.mongo_handlers:MongoPersistHandler']}
+
+    The source handler is taken as the persist handler name with 'Persist' replaced by 'Source'. Only names are
+    held, the handler module is imported by the HandlerFactory on first use of the scheme. Entry points are read
+    once, on the first lookup, and explicit registration takes precedence.
+    """
+
+    ENTRY_POINT_GROUP = 'hadron.handlers'
+
+    _registry: dict = {
+        'file': ('ds_core.handlers.fs_handlers', 'FsSourceHandler', 'FsPersistHandler'),
+        's3': ('ds_core.handlers.fs_handlers', 'FsSourceHandler', 'FsPersistHandler'),
+        's3a': ('ds_core.handlers.fs_handlers', 'FsSourceHandler', 'FsPersistHandler'),
+        'sqlite': ('ds_core.handlers.sqlite_handlers', 'SqliteSourceHandler', 'SqlitePersistHandler'),
+        'event': ('ds_core.handlers.event_handlers', 'EventSourceHandler', 'EventPersistHandler'),
+    }
+    _entry_points = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def register(cls, scheme: str, module_name: str, persist_handler: str, source_handler: str=None):
+        """ registers the handlers of a URI scheme, replacing any existing registration
+
+        :param scheme: the URI scheme, e.g. 's3'
+        :param module_name: the fully qualified module name of the handlers
+        :param persist_handler: the name of the persist handler class
+        :param source_handler: (optional) the name of the source handler class. Default derived from persist
+        """
+        source_handler = source_handler if isinstance(source_handler, str) else \
+            persist_handler.replace('Persist', 'Source')
+        with cls._lock:
+            HandlerRegistry._registry[scheme.lower()] = (module_name, source_handler, persist_handler)
+
+    @classmethod
+    def unregister(cls, scheme: str):
+        """ removes an explicit registration of a URI scheme, any entry point of the scheme remains """
+        with cls._lock:
+            HandlerRegistry._registry.pop(scheme.lower(), None)
+
+    @classmethod
+    def lookup(cls, scheme: str) -> [tuple, None]:
+        """ returns the (module_name, source_handler, persist_handler) names of the scheme or None if the scheme
+        is not registered. No module is imported.
+
+        :param scheme: the URI scheme
+        :return: a tuple of names or None
+        """
+        scheme = scheme.lower() if isinstance(scheme, str) else ''
+        if scheme in cls._registry:
+            return cls._registry[scheme]
+        return cls.entry_points().get(scheme)
+
+    @classmethod
+    def schemes(cls) -> list:
+        """ returns the registered and entry point URI schemes """
+        return sorted(set(cls._registry.keys()).union(cls.entry_points().keys()))
+
+    @classmethod
+    def entry_points(cls) -> dict:
+        """ returns the handler names of the 'hadron.handlers' entry points by scheme, read once """
+        if HandlerRegistry._entry_points is None:
+            with cls._lock:
+                if HandlerRegistry._entry_points is None:
+                    _entry_points = importlib.metadata.entry_points()
+                    if hasattr(_entry_points, 'select'):
+                        _entry_points = _entry_points.select(group=cls.ENTRY_POINT_GROUP)
+                    else:
+                        _entry_points = _entry_points.get(cls.ENTRY_POINT_GROUP, [])
+                    handlers = {}
+                    for entry_point in _entry_points:
+                        module_name, _, persist_handler = entry_point.value.partition(':')
+                        persist_handler = persist_handler.strip()
+                        handlers[entry_point.name.lower()] = (module_name.strip(),
+                                                              persist_handler.replace('Persist', 'Source'),
+                                                              persist_handler)
+                    HandlerRegistry._entry_points = handlers
+        return HandlerRegistry._entry_points
+
+    @classmethod
+    def invalidate(cls):
+        """ rereads the entry points on next lookup, for example after a package is installed """
+        with cls._lock:
+            HandlerRegistry._entry_points = None
+
+
+class HandlerPool(object):
+    """ A process wide pool of connector handlers shared by property managers. Handlers are keyed by the
+    normalised connector contract so contracts to the same resource share one handler, with its connections and
+    change state. Each acquire is counted and matched by a release, a handler with no references is evicted once
+    it has been idle for IDLE_TIMEOUT seconds.
+    """
+
+    IDLE_TIMEOUT = 300.0
+
+    _handlers: dict = {}
+    _keys: dict = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def acquire(cls, connector_contract: ConnectorContract) -> [AbstractSourceHandler, AbstractPersistHandler]:
+        """ returns the pooled handler of the connector contract, instantiating it on first use
+
+        :param connector_contract: the connector contract of the handler
+        :return: the shared handler instance
+        """
+        key = cls.contract_key(connector_contract)
+        with cls._lock:
+            cls._evict()
+            entry = cls._handlers.get(key)
+            if entry is None:
+                entry = {'handler': HandlerFactory.instantiate(connector_contract), 'refs': 0, 'idle': None}
+                HandlerPool._handlers[key] = entry
+                HandlerPool._keys[id(entry['handler'])] = key
+            entry['refs'] += 1
+            entry['idle'] = None
+        return entry['handler']
+
+    @classmethod
+    def release(cls, handler: [AbstractSourceHandler, AbstractPersistHandler]):
+        """ releases a reference to a pooled handler. Handlers not from the pool are ignored
+
+        :param handler: the handler returned by acquire
+        """
+        with cls._lock:
+            entry = cls._handlers.get(cls._keys.get(id(handler)))
+            if entry is None or entry['handler'] is not handler:
+                return
+            entry['refs'] = max(entry['refs'] - 1, 0)
+            if entry['refs'] == 0:
+                entry['idle'] = time.monotonic()
+            cls._evict()
+
+    @classmethod
+    def clear(cls):
+        """ removes all handlers from the pool """
+        with cls._lock:
+            HandlerPool._handlers.clear()
+            HandlerPool._keys.clear()
+
+    @classmethod
+    def stats(cls) -> dict:
+        """ returns the number of pooled handlers, those in use and those idle """
+        with cls._lock:
+            in_use = sum(1 for entry in cls._handlers.values() if entry['refs'] > 0)
+            return {'handlers': len(cls._handlers), 'in_use': in_use, 'idle': len(cls._handlers) - in_use}
+
+    @staticmethod
+    def contract_key(connector_contract: ConnectorContract) -> tuple:
+        """ the normalised connector contract as a pool key. The scheme and host name are case insensitive, the
+        path normalised and the query and kwargs order independent """
+        _cc = connector_contract
+        schema, netloc, path = ConnectorContract.parse_address_elements(uri=_cc.uri, with_credentials=True,
+                                                                        with_port=True)
+        path = os.path.normpath(path) if isinstance(path, str) and len(path) > 0 else ''
+        query = tuple(sorted(_cc.query.items()))
+        kwargs = json.dumps(_cc.kwargs, sort_keys=True, default=str)
+        credentials, _, host = netloc.rpartition('@')
+        netloc = f"{credentials}@{host.lower()}" if credentials else host.lower()
+        return schema.lower(), netloc, path, query, _cc.module_name, _cc.handler, kwargs
+
+    @classmethod
+    def _evict(cls):
+        """ removes handlers that have had no references for IDLE_TIMEOUT seconds, the caller holds the lock """
+        now = time.monotonic()
+        for key, entry in list(cls._handlers.items()):
+            if entry['refs'] == 0 and entry['idle'] is not None and now - entry['idle'] >= cls.IDLE_TIMEOUT:
+                HandlerPool._keys.pop(id(entry['handler']), None)
+                del HandlerPool._handlers[key]
@@ -15,20 +15,147 @@ You will find a copy of this licenseIn the root directory of the project
 or you can visit <https://www.gnu.org/licenses/> For further information.
 """
 
-import io
+import glob
+import hashlib
+import json
+import re
 import requests
+import requests.adapters
 import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as fs
 import pyarrow.parquet as pq
+import pyarrow.compute as pc
+from typing import Any
+from urllib.parse import urlparse
 from pyarrow import csv
 from ds_core.components.core_commons import CoreCommons as Commons
 from ds_core.handlers.abstract_handlers import AbstractSourceHandler, AbstractPersistHandler
-from ds_core.handlers.abstract_handlers import ConnectorContract, HandlerFactory
+from ds_core.handlers.abstract_handlers import ConnectorContract
+
+
+class HttpCache(object):
+    """ A size bounded, least recently used, on disk cache of remote canonicals keyed on their URI. Entries are
+    revalidated with conditional requests using the ETag and Last-Modified validators of the cached response so
+    an unchanged source is loaded from local disk rather than the network.
+
+    The cache path and maximum size can be set with the environment variables HADRON_HTTP_CACHE_PATH and
+    HADRON_HTTP_CACHE_SIZE (bytes).
+    """
+
+    def __init__(self, path: str=None, max_size: int=None):
+        _default_path = os.path.join(tempfile.gettempdir(), 'hadron', 'http_cache')
+        self._path = path if isinstance(path, str) else os.environ.get('HADRON_HTTP_CACHE_PATH', _default_path)
+        self._max_size = max_size if isinstance(max_size, int) else int(os.environ.get('HADRON_HTTP_CACHE_SIZE',
+                                                                                        1024 ** 3))
+        self._lock = threading.Lock()
+        os.makedirs(self._path, exist_ok=True)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    def fetch(self, session: requests.Session, uri: str, timeout: Any=None) -> str:
+        """ returns the local path of the cached body for the uri, revalidating or downloading it as needed """
+        key = hashlib.sha256(uri.encode('utf8')).hexdigest()
+        _, ext = os.path.splitext(urlparse(uri).path)
+        body_path = os.path.join(self._path, f"{key}{ext}")
+        meta_path = os.path.join(self._path, f"{key}.json")
+        headers = {}
+        meta = self._read_meta(meta_path)
+        if meta is not None and os.path.exists(body_path):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta.get('etag')
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta.get('last_modified')
+        response = session.get(uri, headers=headers, stream=True, timeout=timeout)
+        with response:
+            if response.status_code == 304:
+                # touch to maintain the least recently used order
+                os.utime(body_path)
+                return body_path
+            response.raise_for_status()
+            fd, tmp_path = tempfile.mkstemp(dir=self._path, suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+            meta = {'uri': uri, 'etag': response.headers.get('etag'),
+                    'last_modified': response.headers.get('last-modified')}
+        with self._lock:
+            os.replace(tmp_path, body_path)
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+            self._evict(keep=body_path)
+        return body_path
+
+    def clear(self):
+        """ removes all cached entries """
+        with self._lock:
+            for name in os.listdir(self._path):
+                os.remove(os.path.join(self._path, name))
+
+    def _evict(self, keep: str=None):
+        """ removes the least recently used entries until the cache is within its maximum size """
+        entries = []
+        for name in os.listdir(self._path):
+            if name.endswith(('.json', '.part')):
+                continue
+            path = os.path.join(self._path, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if total <= self._max_size:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            meta_path = f"{os.path.splitext(path)[0]}.json"
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            total -= size
+
+    @staticmethod
+    def _read_meta(meta_path: str) -> [dict, None]:
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
 
 
 class BaseSourceHandler(AbstractSourceHandler):
     """ Base PyArrow read only Source Handler. """
 
+    # shared keep-alive connection pool for http(s) schemes
+    HTTP_POOL_SIZE = 16
+    HTTP_TIMEOUT = (10, 300)
+    HTTP_SPOOL_SIZE = 64 * 1024 * 1024
+    HTTP_HEAD_TTL = 5.0
+    # the maximum entries of the process wide HEAD request and file fingerprint caches
+    HTTP_HEAD_CACHE_SIZE = 1024
+    FINGERPRINT_CACHE_SIZE = 4096
+    ASYNC_WORKERS = 64
+    _http_session: requests.Session = None
+    _http_cache: HttpCache = None
+    _http_lock = threading.Lock()
+    _http_head_cache: OrderedDict = OrderedDict()
+    _fingerprints: OrderedDict = OrderedDict()
+    _memo_lock = threading.Lock()
+    _async_pool: ThreadPoolExecutor = None
+
     def __init__(self, connector_contract: ConnectorContract):
         """ initialise the Handler passing the connector_contract dictionary """
         super().__init__(connector_contract)
@@ -37,83 +164,489 @@ class BaseSourceHandler(AbstractSourceHandler):
 
     def supported_types(self) -> list:
         """ The source types supported with this module"""
-        return ['parquet', 'csv']
+        return ['parquet', 'csv', 'arrow', 'feather', 'ipc']
+
+    def load_canonical(self, stream: bool=None, batch_size: int=None, columns: list=None, filter: Any=None,
+                       **kwargs) -> [pa.Table, pa.RecordBatchReader]:
+        """ returns the canonical dataset based on the connector contract. If stream is True a RecordBatchReader
+        is returned that incrementally reads the source as record batches, allowing out of core processing.
+
+        If columns or filter are given the source is scanned as a pyarrow dataset, only decoding the projected
+        columns and, for parquet, skipping row groups whose statistics can not satisfy the filter. Both can also
+        be set in the Connector Contract kwargs.
 
-    def load_canonical(self, **kwargs) -> pa.Table:
-        """ returns the canonical dataset based on the connector contract. """
+        A local URI can be a glob pattern, e.g. 'data/shards/*.csv', or a directory. The matching files, or the
+        files of a directory without sub-directories, are read concurrently and concatenated with their schemas
+        unified. Per-file errors are collected in 'load_errors' and only raised once every file has been tried.
+        A directory with sub-directories is read as a hive partitioned dataset.
+
+        Extra Parameters in the ConnectorContract kwargs:
+            - max_workers: (optional) the maximum number of threads used to read multiple files
+            - ignore_errors: (optional) if True, files that fail to load are skipped. Default False
+            - http_cache: (optional) if True, http(s) sources are cached on local disk and revalidated with
+                    conditional requests. see HttpCache. Default False
+            - fingerprint: (optional) if True, has_changed compares a digest of the file content rather than its
+                    modified time. see has_changed. Default False
+            - column_types: (optional) a dictionary of column names to Arrow types, or their type strings, that csv
+                    columns are read as without type inference
+
+        :param stream: (optional) if True returns a pa.RecordBatchReader rather than a pa.Table. Default False
+        :param batch_size: (optional) the maximum number of rows per batch when streaming parquet. Default 65536
+        :param columns: (optional) a list of column names to project
+        :param filter: (optional) a pyarrow.compute.Expression or DNF list of tuples e.g. [('num', '>', 0)]
+        :param kwargs: additional load parameters
+        """
         if not isinstance(self.connector_contract, ConnectorContract):
             raise ValueError("The Connector Contract was not been set at initialisation or is corrupted")
+        stream = stream if isinstance(stream, bool) else False
         _cc = self.connector_contract
         load_params = kwargs
         load_params.update(_cc.kwargs)  # Update with any kwargs in the Connector Contract
+        _columns = load_params.pop('columns', None)
+        _filter = load_params.pop('filter', None)
+        columns = columns if isinstance(columns, list) else _columns
+        filter = filter if filter is not None else _filter
+        _ = load_params.pop('partition_cols', None)
+        max_workers = load_params.pop('max_workers', None)
+        ignore_errors = load_params.pop('ignore_errors', False)
+        http_cache = load_params.pop('http_cache', False)
+        load_params.pop('fingerprint', None)
+        load_params.pop('reuse_schema', None)
         if load_params.pop('use_full_uri', False):
             file_type = load_params.pop('file_type', 'csv')
             address = _cc.uri
+            paths = None
         else:
             load_params.update(_cc.query)  # Update kwargs with those in the uri query
-            _, _, _ext = _cc.address.rpartition('.')
             address = _cc.address
-            file_type = load_params.pop('file_type', _ext if len(_ext) > 0 else 'csv')
+            paths = None if _cc.schema.startswith('http') else self._expand_paths(address)
+            _ext = os.path.splitext(paths[0] if paths else address)[1].lstrip('.')
+            if len(_ext) == 0:
+                _ext = 'parquet' if os.path.isdir(address) else 'csv'
+            file_type = load_params.pop('file_type', _ext)
+        _kwargs = {**_cc.query, **_cc.kwargs, **load_params}
+        options = {'parse_options': _kwargs.get('parse_options'), 'read_options': _kwargs.get('read_options'),
+                   'convert_options': _kwargs.get('convert_options')}
+        for key in options.keys():
+            _ = load_params.pop(key, None)
+        options = self._column_types_options(options, load_params.pop('column_types', None))
         self.reset_changed()
+        # multiple files
+        if isinstance(paths, list):
+            return self._load_files(paths, file_type=file_type, columns=columns, filter=filter, stream=stream,
+                                    batch_size=batch_size, max_workers=max_workers, ignore_errors=ignore_errors,
+                                    options=options, **load_params)
+        # partitioned directory dataset
+        if not _cc.schema.startswith('http') and os.path.isdir(address):
+            file_format = self._file_format(file_type=file_type, **options)
+            return self._scan_dataset(address, file_format=file_format, columns=columns, filter=filter,
+                                      stream=stream, batch_size=batch_size, partitioning='hive')
+        if _cc.schema.startswith('http') and str(http_cache).lower() == 'true':
+            address = self.http_cache().fetch(self.http_session(), address, timeout=self.HTTP_TIMEOUT)
+        return self._load_source(address, file_type=file_type, columns=columns, filter=filter, stream=stream,
+                                 batch_size=batch_size, options=options, **load_params)
+
+    @property
+    def load_errors(self) -> dict:
+        """ the per-file errors, keyed on the file path, collected by the last multi-file load """
+        return getattr(self, '_load_errors', {}).copy()
+
+    def _load_source(self, address: str, file_type: str, columns: list=None, filter: Any=None, stream: bool=None,
+                     batch_size: int=None, options: dict=None, **load_params) -> [pa.Table, pa.RecordBatchReader]:
+        """ loads a single source file of the given file type """
+        options = options if isinstance(options, dict) else {}
+        if self.connector_contract.schema.startswith('http') and urlparse(address).scheme.startswith('http'):
+            # only an unfiltered csv can be read off the socket, other formats need random access
+            _sequential = file_type.lower() in ['csv', 'gz', 'bz2'] and columns is None and filter is None
+            address = self._open_remote(address, seekable=not _sequential)
         # parquet
         if file_type.lower() in ['parquet', 'pqt', 'pq']:
-            if _cc.schema.startswith('http'):
-                address = io.BytesIO(requests.get(address).content)
+            if columns is not None or filter is not None:
+                return self._scan_dataset(address, file_format=ds.ParquetFileFormat(), columns=columns,
+                                          filter=filter, stream=stream, batch_size=batch_size)
+            if stream:
+                return self._stream_parquet(address, batch_size=batch_size, **load_params)
             return pq.read_table(address, **load_params)
         # csv
         if file_type.lower() in ['csv', 'gz', 'bz2']:
-            _kwargs = {**_cc.query, **_cc.kwargs, **load_params}
-            parse_options = _kwargs.get('parse_options', {}).get('parse_options', {})
-            parse_options = self.parse_options(**parse_options)
-            read_options = _kwargs.get('read_options', {}).get('read_options', {})
-            read_options = self.read_options(**read_options)
-            if _cc.schema.startswith('http'):
-                address = io.BytesIO(requests.get(address).content)
-            return csv.read_csv(address, parse_options=parse_options, read_options=read_options)
+            parse_options = options.get('parse_options') if isinstance(options.get('parse_options'), dict) else {}
+            parse_options = self.parse_options(**parse_options.get('parse_options', {}))
+            read_options = options.get('read_options') if isinstance(options.get('read_options'), dict) else {}
+            read_options = self.read_options(**read_options.get('read_options', {}))
+            convert_options = options.get('convert_options') if isinstance(options.get('convert_options'), dict) \
+                else {}
+            convert_options = self.convert_options(**convert_options.get('convert_options', {}))
+            if columns is not None or filter is not None:
+                file_format = ds.CsvFileFormat(parse_options=parse_options, read_options=read_options,
+                                               convert_options=convert_options)
+                return self._scan_dataset(address, file_format=file_format, columns=columns, filter=filter,
+                                          stream=stream, batch_size=batch_size)
+            if stream:
+                return csv.open_csv(address, parse_options=parse_options, read_options=read_options,
+                                    convert_options=convert_options)
+            return csv.read_csv(address, parse_options=parse_options, read_options=read_options,
+                                convert_options=convert_options)
+        # arrow ipc/feather
+        if file_type.lower() in ['arrow', 'feather', 'ipc']:
+            if columns is not None or filter is not None:
+                return self._scan_dataset(address, file_format=ds.IpcFileFormat(), columns=columns, filter=filter,
+                                          stream=stream, batch_size=batch_size)
+            return self._read_ipc(address, stream=stream)
         raise LookupError('The source format {} is not currently supported'.format(file_type))
 
+    def _load_files(self, paths: list, file_type: str, columns: list=None, filter: Any=None, stream: bool=None,
+                    batch_size: int=None, max_workers: int=None, ignore_errors: bool=None, options: dict=None,
+                    **load_params) -> [pa.Table, pa.RecordBatchReader]:
+        """ loads multiple files concurrently, concatenating them with their schemas unified. Errors are
+        collected per file and raised together once all files have been tried, unless ignore_errors is True.
+        """
+        if len(paths) == 0:
+            raise FileNotFoundError(f"No files were found matching '{self.connector_contract.address}'")
+        options = options if isinstance(options, dict) else {}
+        self._load_errors = {}
+        if isinstance(stream, bool) and stream:
+            file_format = self._file_format(file_type=file_type, **options)
+            dataset = ds.dataset(paths, format=file_format)
+            schema = pa.unify_schemas([fragment.physical_schema for fragment in dataset.get_fragments()],
+                                      promote_options='permissive')
+            dataset = ds.dataset(paths, schema=schema, format=file_format)
+            return self._scan_dataset(dataset, file_format=file_format, columns=columns, filter=filter,
+                                      stream=stream, batch_size=batch_size)
+        tables = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self._load_source, path, file_type=file_type, columns=columns, filter=filter,
+                                       options=options, **load_params): path for path in paths}
+            for future in as_completed(futures):
+                try:
+                    tables[futures[future]] = future.result()
+                except Exception as e:
+                    self._load_errors[futures[future]] = f"{type(e).__name__}: {e}"
+        if len(self._load_errors) > 0 and (not ignore_errors or len(tables) == 0):
+            errors = '\n\t'.join([f"{k}: {v}" for k, v in self._load_errors.items()])
+            raise IOError(f"{len(self._load_errors)} of {len(paths)} files failed to load:\n\t{errors}")
+        return pa.concat_tables([tables[path] for path in paths if path in tables], promote_options='permissive')
+
+    @staticmethod
+    def _expand_paths(address: str) -> [list, None]:
+        """ returns the sorted files matching a glob pattern, or the files of a directory without sub-directories,
+        ignoring hidden and underscore prefixed files. Returns None if the address is neither. An existing file is
+        taken as is, even if its name has glob characters in it.
+        """
+        if os.path.isfile(address):
+            return None
+        if re.search(r'[*?\[]', address):
+            return sorted([path for path in glob.glob(address, recursive=True) if os.path.isfile(path)])
+        if os.path.isdir(address):
+            entries = [os.path.join(address, name) for name in sorted(os.listdir(address))
+                       if not name.startswith(('.', '_'))]
+            if all(os.path.isfile(entry) for entry in entries):
+                return entries
+        return None
+
     def exists(self) -> bool:
         """ Returns True is the file exists """
         if not isinstance(self.connector_contract, ConnectorContract):
             raise ValueError("The Connector Contract has not been set")
         _cc = self.connector_contract
         if _cc.schema.startswith('http'):
-            r = requests.get(_cc.address)
-            if r.status_code == 200:
+            status_code, _ = self.http_head(_cc.address)
+            if status_code in (200, 206):
                 return True
         if os.path.exists(_cc.address):
             return True
+        if not _cc.schema.startswith('http') and self._expand_paths(_cc.address):
+            return True
         return False
 
     def has_changed(self) -> bool:
-        """ returns the status of the change_flag indicating if the file has changed since last load or reset"""
-        if not self.exists():
+        """ returns the status of the change_flag indicating if the file has changed since last load or reset.
+
+        By default a local file has changed when its modified time has. With the ConnectorContract kwarg
+        'fingerprint' set True, the state is a digest of the file content, or for parquet of its footer metadata,
+        so a file rewritten or copied with the same bytes is not seen as changed. Digests are cached against the
+        file modified time and size so unchanged files are not re-read.
+        """
+        state = self.source_state()
+        if state is None:
             return False
         # maintain the change flag
-        _cc = self.connector_contract
-        if _cc.schema.startswith('http') or _cc.schema.startswith('git'):
-            if not isinstance(self.connector_contract, ConnectorContract):
-                raise ValueError("The Pandas Connector Contract has not been set")
-            module_name = 'requests'
-            _address = _cc.address.replace("git://", "https://")
-            if HandlerFactory.check_module(module_name=module_name):
-                module = HandlerFactory.get_module(module_name=module_name)
-                state = module.head(_address).headers.get('last-modified', 0)
-            else:
-                raise ModuleNotFoundError(f"The required module {module_name} has not been installed. Please pip "
-                                          f"install the appropriate package in order to complete this action")
-        else:
-            state = os.stat(_cc.address).st_mtime_ns
         if state != self._file_state:
             self._changed_flag = True
             self._file_state = state
         return self._changed_flag
 
+    def source_state(self) -> Any:
+        """ returns the state of the source used by has_changed, or None if it doesn't exist """
+        if not self.exists():
+            return None
+        _cc = self.connector_contract
+        fingerprint = str(_cc.kwargs.get('fingerprint', False)).lower() == 'true'
+        _state = self._fingerprint if fingerprint else lambda x: os.stat(x).st_mtime_ns
+        if _cc.schema.startswith('http') or _cc.schema.startswith('git'):
+            _address = _cc.address.replace("git://", "https://")
+            _, headers = self.http_head(_address)
+            return headers.get('etag', 0), headers.get('last-modified', 0)
+        if os.path.isdir(_cc.address):
+            paths = sorted(os.path.join(root, f) for root, _, files in os.walk(_cc.address) for f in files)
+            if fingerprint:
+                return tuple((os.path.relpath(path, _cc.address), _state(path)) for path in paths)
+            # a partition can be replaced without touching the root directory
+            return max([_state(path) for path in paths] + [os.stat(_cc.address).st_mtime_ns])
+        if not os.path.exists(_cc.address):
+            # glob pattern
+            paths = self._expand_paths(_cc.address)
+            if fingerprint:
+                return tuple((path, _state(path)) for path in paths)
+            return len(paths), max([_state(path) for path in paths])
+        return _state(_cc.address)
+
+    @classmethod
+    def _fingerprint(cls, path: str) -> str:
+        """ returns a digest of the file content, or for parquet its footer metadata which holds the row group
+        sizes, offsets and statistics. The digest is cached against the file modified time and size, keeping at
+        most FINGERPRINT_CACHE_SIZE files.
+
+        :param path: the local file path
+        :return: the hex digest
+        """
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        with cls._memo_lock:
+            cached = cls._fingerprints.get(key)
+            if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size):
+                cls._fingerprints.move_to_end(key)
+                return cached[1]
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            footer = None
+            if stat.st_size > 12:
+                # parquet ends with the footer length and the magic bytes
+                f.seek(-8, os.SEEK_END)
+                tail = f.read(8)
+                length = int.from_bytes(tail[:4], 'little')
+                if tail[4:] == b'PAR1' and length + 8 <= stat.st_size:
+                    f.seek(-(length + 8), os.SEEK_END)
+                    footer = f.read(length)
+            if footer is not None:
+                digest.update(footer)
+            else:
+                f.seek(0)
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        with cls._memo_lock:
+            cls._fingerprints[key] = ((stat.st_mtime_ns, stat.st_size), digest.hexdigest())
+            cls._fingerprints.move_to_end(key)
+            while len(cls._fingerprints) > cls.FINGERPRINT_CACHE_SIZE:
+                cls._fingerprints.popitem(last=False)
+        return digest.hexdigest()
+
     def reset_changed(self, changed: bool = False):
         """ manual reset to say the file has been seen. This is automatically called if the file is loaded"""
         changed = changed if isinstance(changed, bool) else False
         self._changed_flag = changed
 
+    """
+        ASYNCIO blocking I/O is run on a module wide pool of ASYNC_WORKERS threads, sized for many concurrent
+        connector operations, while metadata checks that only stat a local file or hit the HEAD cache run inline
+    """
+    async def aexists(self) -> bool:
+        if self._is_inline():
+            return self.exists()
+        return await self._run_in_executor(self.exists, executor=self.async_pool())
+
+    async def ahas_changed(self) -> bool:
+        if self._is_inline() and str(self.connector_contract.kwargs.get('fingerprint', False)).lower() != 'true':
+            return self.has_changed()
+        return await self._run_in_executor(self.has_changed, executor=self.async_pool())
+
+    async def aload_canonical(self, stream: bool=None, batch_size: int=None, columns: list=None, filter: Any=None,
+                              **kwargs) -> [pa.Table, pa.RecordBatchReader]:
+        return await self._run_in_executor(self.load_canonical, stream=stream, batch_size=batch_size,
+                                           columns=columns, filter=filter, executor=self.async_pool(), **kwargs)
+
+    @classmethod
+    def async_pool(cls) -> ThreadPoolExecutor:
+        """ returns the module wide thread pool the asyncio methods run blocking I/O on """
+        if cls._async_pool is None:
+            with cls._http_lock:
+                if BaseSourceHandler._async_pool is None:
+                    BaseSourceHandler._async_pool = ThreadPoolExecutor(max_workers=cls.ASYNC_WORKERS,
+                                                                       thread_name_prefix='hadron_io')
+        return BaseSourceHandler._async_pool
+
+    def _is_inline(self) -> bool:
+        """ True if exists and has_changed will not block on the network """
+        if not isinstance(self.connector_contract, ConnectorContract):
+            return True
+        _cc = self.connector_contract
+        if _cc.schema.startswith('http') or _cc.schema.startswith('git'):
+            cached = self._http_head_cache.get(_cc.address.replace("git://", "https://"))
+            return cached is not None and time.monotonic() - cached[0] < self.HTTP_HEAD_TTL
+        return True
+
+    @classmethod
+    def http_session(cls) -> requests.Session:
+        """ returns the module wide http session, pooling keep-alive connections across handler instances """
+        if cls._http_session is None:
+            with cls._http_lock:
+                if BaseSourceHandler._http_session is None:
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=cls.HTTP_POOL_SIZE,
+                                                            pool_maxsize=cls.HTTP_POOL_SIZE, max_retries=3)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    BaseSourceHandler._http_session = session
+        return BaseSourceHandler._http_session
+
+    @classmethod
+    def http_head(cls, address: str, ttl: float=None) -> tuple:
+        """ returns the status code and headers of a HEAD request on the address. Results are cached for a short
+        time to live so repeated existence and change checks do not go back to the server, keeping at most
+        HTTP_HEAD_CACHE_SIZE addresses. Servers that do not support HEAD are probed with a single byte range
+        request.
+
+        :param address: the http(s) address
+        :param ttl: (optional) the seconds a cached result is valid for. Default HTTP_HEAD_TTL
+        :return: a tuple of the status code and headers
+        """
+        ttl = ttl if isinstance(ttl, (int, float)) else cls.HTTP_HEAD_TTL
+        now = time.monotonic()
+        with cls._memo_lock:
+            cached = cls._http_head_cache.get(address)
+            if cached is not None and now - cached[0] < ttl:
+                cls._http_head_cache.move_to_end(address)
+                return cached[1], cached[2]
+        session = cls.http_session()
+        r = session.head(address, allow_redirects=True, timeout=cls.HTTP_TIMEOUT)
+        if r.status_code in (405, 501):
+            with session.get(address, headers={'Range': 'bytes=0-0'}, stream=True, timeout=cls.HTTP_TIMEOUT) as r:
+                pass
+        with cls._memo_lock:
+            # expired entries are purged and the least recently used removed beyond the maximum size
+            for key in [k for k, v in cls._http_head_cache.items() if now - v[0] >= max(ttl, cls.HTTP_HEAD_TTL)]:
+                del cls._http_head_cache[key]
+            cls._http_head_cache[address] = (now, r.status_code, r.headers)
+            cls._http_head_cache.move_to_end(address)
+            while len(cls._http_head_cache) > cls.HTTP_HEAD_CACHE_SIZE:
+                cls._http_head_cache.popitem(last=False)
+        return r.status_code, r.headers
+
+    @classmethod
+    def http_head_clear(cls, address: str=None):
+        """ removes the address, or all addresses if None, from the HEAD request cache """
+        with cls._memo_lock:
+            if isinstance(address, str):
+                cls._http_head_cache.pop(address, None)
+            else:
+                cls._http_head_cache.clear()
+
+    @classmethod
+    def http_cache(cls) -> HttpCache:
+        """ returns the module wide on disk cache of http(s) sources """
+        if cls._http_cache is None:
+            with cls._http_lock:
+                if BaseSourceHandler._http_cache is None:
+                    BaseSourceHandler._http_cache = HttpCache()
+        return BaseSourceHandler._http_cache
+
+    @classmethod
+    def _open_remote(cls, address: str, seekable: bool=None) -> Any:
+        """ opens a streamed http response. If seekable, the body is spooled to a temporary file, in memory up to
+        HTTP_SPOOL_SIZE then on disk, so formats needing random access never hold the body twice in memory.
+        """
+        response = cls.http_session().get(address, stream=True, timeout=cls.HTTP_TIMEOUT)
+        response.raise_for_status()
+        if not (isinstance(seekable, bool) and seekable):
+            response.raw.decode_content = True
+            return response.raw
+        spool = tempfile.SpooledTemporaryFile(max_size=cls.HTTP_SPOOL_SIZE)
+        with response:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                spool.write(chunk)
+        spool.seek(0)
+        return spool
+
+    @staticmethod
+    def _stream_parquet(source: [str, Any], batch_size: int=None, **kwargs) -> pa.RecordBatchReader:
+        """ returns a RecordBatchReader over the parquet source, reading one batch at a time """
+        batch_size = batch_size if isinstance(batch_size, int) and batch_size > 0 else 65536
+        parquet_file = pq.ParquetFile(source)
+        batches = parquet_file.iter_batches(batch_size=batch_size, **kwargs)
+        return pa.RecordBatchReader.from_batches(parquet_file.schema_arrow, batches)
+
+    @staticmethod
+    def _read_ipc(source: [str, Any], stream: bool=None) -> [pa.Table, pa.RecordBatchReader]:
+        """ reads an Arrow IPC file. Local files are memory mapped so the returned table references the mapped
+        pages rather than copying them, costing almost no resident memory until the data is touched.
+        """
+        if isinstance(source, str):
+            source = pa.memory_map(source, 'r')
+        reader = pa.ipc.open_file(source)
+        if isinstance(stream, bool) and stream:
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            return pa.RecordBatchReader.from_batches(reader.schema, batches)
+        return reader.read_all()
+
+    @staticmethod
+    def _file_format(file_type: str, parse_options: dict=None, read_options: dict=None,
+                     convert_options: dict=None) -> ds.FileFormat:
+        """ returns the pyarrow dataset file format for the file type """
+        if file_type.lower() in ['parquet', 'pqt', 'pq']:
+            return ds.ParquetFileFormat()
+        if file_type.lower() in ['csv', 'gz', 'bz2']:
+            parse_options = parse_options if isinstance(parse_options, dict) else {}
+            read_options = read_options if isinstance(read_options, dict) else {}
+            convert_options = convert_options if isinstance(convert_options, dict) else {}
+            parse_options = BaseSourceHandler.parse_options(**parse_options.get('parse_options', {}))
+            read_options = BaseSourceHandler.read_options(**read_options.get('read_options', {}))
+            convert_options = BaseSourceHandler.convert_options(**convert_options.get('convert_options', {}))
+            return ds.CsvFileFormat(parse_options=parse_options, read_options=read_options,
+                                    convert_options=convert_options)
+        if file_type.lower() in ['arrow', 'feather', 'ipc']:
+            return ds.IpcFileFormat()
+        raise LookupError('The source format {} is not currently supported'.format(file_type))
+
+    @staticmethod
+    def _scan_dataset(source: [str, Any, ds.Dataset], file_format: ds.FileFormat, columns: list=None,
+                      filter: Any=None, stream: bool=None, batch_size: int=None,
+                      partitioning: str=None) -> [pa.Table, pa.RecordBatchReader]:
+        """ scans the source as a pyarrow dataset pushing the column projection and filter down to the reader.
+        With hive partitioning a filter on the partition columns prunes whole partition directories.
+        """
+        if isinstance(source, ds.Dataset):
+            dataset = source
+        elif not isinstance(source, str):
+            if isinstance(file_format, ds.CsvFileFormat):
+                # the csv reader closes the file once the schema is inspected
+                source = pa.py_buffer(source.read())
+            fragment = file_format.make_fragment(source)
+            dataset = ds.FileSystemDataset([fragment], fragment.physical_schema, file_format)
+        elif isinstance(file_format, ds.IpcFileFormat):
+            # memory map local ipc files so only the projected buffers are paged in
+            dataset = ds.dataset(os.path.abspath(source), format=file_format, partitioning=partitioning,
+                                 filesystem=fs.LocalFileSystem(use_mmap=True))
+        else:
+            dataset = ds.dataset(source, format=file_format, partitioning=partitioning)
+        scan_params = {'columns': columns, 'filter': BaseSourceHandler.filter_expression(filter)}
+        if isinstance(batch_size, int) and batch_size > 0:
+            scan_params['batch_size'] = batch_size
+        scanner = dataset.scanner(**scan_params)
+        if isinstance(stream, bool) and stream:
+            return scanner.to_reader()
+        return scanner.to_table()
+
+    @staticmethod
+    def filter_expression(filter: Any) -> [pc.Expression, None]:
+        """ converts a filter into a pyarrow.compute.Expression. The filter can be an Expression or a
+        DNF (Disjunctive Normal Form) list of tuples, as used by parquet filters, e.g. [('num', '>', 0)]
+        or [[('cat', '=', 'M')], [('cat', '=', 'F')]] which can be stored as part of a Connector Contract.
+        """
+        if filter is None or isinstance(filter, pc.Expression):
+            return filter
+        if isinstance(filter, (list, tuple)):
+            return pq.filters_to_expression(list(filter))
+        raise TypeError(f"The filter must be a pyarrow.compute.Expression or DNF list of tuples, {type(filter)} given")
+
     @staticmethod
     def read_options(**kwargs) -> csv.ReadOptions:
         if kwargs is None or not kwargs:
@@ -126,6 +659,22 @@ class BaseSourceHandler(AbstractSourceHandler):
             return None
         return csv.ParseOptions(**kwargs)
 
+    @staticmethod
+    def _column_types_options(options: dict, column_types: dict=None) -> dict:
+        """ adds the column types to the csv convert options so known columns skip type inference """
+        if not isinstance(column_types, dict) or len(column_types) == 0:
+            return options
+        convert_options = dict(options.get('convert_options') or {})
+        convert_options['convert_options'] = {**convert_options.get('convert_options', {}), 'column_types': {
+            k: Commons.type_from_str(v) if isinstance(v, str) else v for k, v in column_types.items()}}
+        return {**options, 'convert_options': convert_options}
+
+    @staticmethod
+    def convert_options(**kwargs) -> csv.ConvertOptions:
+        if kwargs is None or not kwargs:
+            return None
+        return csv.ConvertOptions(**kwargs)
+
 
 class BasePersistHandler(BaseSourceHandler, AbstractPersistHandler):
     """ Base PyArrow read/write Persist Handler. """
@@ -142,11 +691,16 @@ class BasePersistHandler(BaseSourceHandler, AbstractPersistHandler):
         return self.backup_canonical(uri=_uri, canonical=canonical, **kwargs)
 
     def backup_canonical(self, canonical: pa.Table, uri: str, **kwargs) -> bool:
-        """ creates a backup of the canonical to an alternative URI
+        """ creates a backup of the canonical to an alternative URI. Local files are written to a temporary file
+        and renamed into place so a failed write never leaves a truncated canonical at the URI.
 
         Extra Parameters in the ConnectorContract kwargs:
             - file_type: (optional) the type of the source file. if not set, inferred from the file extension
             - write_params (optional) a dictionary of additional write parameters directly passed to 'write_' methods
+            - partition_cols (optional) a list of column names to hive partition the canonical by, persisting it as
+                    a directory dataset. Only the partitions present in the canonical are replaced.
+            - existing_data_behavior (optional) with partition_cols, one of 'delete_matching' (default),
+                    'overwrite_or_ignore' or 'error'
         """
         if not isinstance(self.connector_contract, ConnectorContract):
             return False
@@ -154,31 +708,37 @@ class BasePersistHandler(BaseSourceHandler, AbstractPersistHandler):
         _address = _cc.parse_address(uri=uri)
         persist_params = kwargs if isinstance(kwargs, dict) else _cc.kwargs
         persist_params.update(_cc.parse_query(uri=uri))
-        _, _, _ext = _address.rpartition('.')
+        _ext = os.path.splitext(_address)[1].lstrip('.')
         if not self.connector_contract.schema.startswith('http'):
             _path, _ = os.path.split(_address)
             if len(_path) > 0 and not os.path.exists(_path):
                 os.makedirs(_path)
         file_type = persist_params.pop('file_type', _ext if len(_ext) > 0 else 'parquet')
         write_params = persist_params.pop('write_params', {})
-        # parquet
-        if file_type.lower() in ['pq', 'pqt', 'parquet']:
-            pq.write_table(canonical, _address, **write_params)
-            return True
-        # csv
-        if file_type.lower() in ['csv', 'gz', 'bz2']:
-            for n in canonical.column_names:
-                c = canonical.column(n).combine_chunks()
-                if pa.types.is_dictionary(c.type):
-                    dc = c.dictionary_decode()
-                    canonical = Commons.table_append(canonical, pa.table([dc], names=[n]))
-                if pa.types.is_nested(c.type):
-                    sc = pa.Array.from_pandas(pa.Array.to_pandas(c).astype(str))
-                    canonical = Commons.table_append(canonical, pa.table([sc], names=[n]))
-            csv.write_csv(canonical, _address, **write_params)
+        partition_cols = persist_params.pop('partition_cols', _cc.kwargs.get('partition_cols', None))
+        if isinstance(partition_cols, (str, list)) and len(partition_cols) > 0:
+            existing_data_behavior = persist_params.pop('existing_data_behavior',
+                                                        _cc.kwargs.get('existing_data_behavior', 'delete_matching'))
+            return self._write_dataset(canonical, base_dir=_address, file_type=file_type,
+                                       partition_cols=Commons.list_formatter(partition_cols),
+                                       existing_data_behavior=existing_data_behavior, **write_params)
+        file_type = file_type.lower()
+        if file_type not in ['pq', 'pqt', 'parquet', 'csv', 'gz', 'bz2', 'arrow', 'feather', 'ipc']:
+            raise LookupError('The file format {} is not currently supported for write'.format(file_type))
+        if self.connector_contract.schema.startswith('http'):
+            self._write_file(canonical, _address, file_type=file_type, **write_params)
             return True
-        # not found
-        raise LookupError('The file format {} is not currently supported for write'.format(file_type))
+        # written to a temporary file in the same directory and renamed so the target is never left truncated
+        _path, _name = os.path.split(_address)
+        _tmp = os.path.join(_path, f".{_name}.{uuid.uuid4().hex}.tmp")
+        try:
+            self._write_file(canonical, _tmp, file_type=file_type, **write_params)
+            os.replace(_tmp, _address)
+        except BaseException:
+            if os.path.exists(_tmp):
+                os.remove(_tmp)
+            raise
+        return True
 
     def remove_canonical(self) -> bool:
         if not isinstance(self.connector_contract, ConnectorContract):
@@ -186,7 +746,138 @@ class BasePersistHandler(BaseSourceHandler, AbstractPersistHandler):
         _cc = self.connector_contract
         if self.connector_contract.schema.startswith('http'):
             raise NotImplemented("Remove Canonical does not support {} schema based URIs".format(_cc.schema))
+        if os.path.isdir(_cc.address):
+            shutil.rmtree(_cc.address)
+            return True
         if os.path.exists(_cc.address):
             os.remove(_cc.address)
             return True
         return False
+
+    async def apersist_canonical(self, canonical: pa.Table, **kwargs) -> bool:
+        return await self._run_in_executor(self.persist_canonical, canonical, executor=self.async_pool(), **kwargs)
+
+    @staticmethod
+    def _write_file(canonical: pa.Table, sink: [str, pa.NativeFile], file_type: str, **write_params):
+        """ writes the canonical to a single file, given as a path or an open output stream, of the file type """
+        # parquet
+        if file_type in ['pq', 'pqt', 'parquet']:
+            pq.write_table(canonical, sink, **write_params)
+        # csv
+        elif file_type in ['csv', 'gz', 'bz2']:
+            BasePersistHandler._write_csv(canonical, sink, **write_params)
+        # arrow ipc/feather
+        elif file_type in ['arrow', 'feather', 'ipc']:
+            # uncompressed by default so the file can be memory mapped zero-copy on load
+            options = pa.ipc.IpcWriteOptions(**write_params) if write_params else None
+            canonical = canonical.unify_dictionaries()
+            if not isinstance(sink, str):
+                with pa.ipc.new_file(sink, canonical.schema, options=options) as writer:
+                    writer.write_table(canonical)
+                return
+            with pa.OSFile(sink, 'wb') as f:
+                with pa.ipc.new_file(f, canonical.schema, options=options) as writer:
+                    writer.write_table(canonical)
+
+    @staticmethod
+    def _write_csv(canonical: pa.Table, sink: Any, **write_params):
+        """ streams the canonical to csv batch by batch. Dictionary columns are decoded and nested columns are
+        formatted as strings with vectorised compute kernels so no column is converted through pandas.
+
+        :param canonical: the table to write
+        :param sink: the file path or writable file object
+        :param write_params: (optional) passed to the pyarrow CSVWriter, for example write_options
+        """
+        schema = pa.schema([pa.field(f.name, BasePersistHandler._csv_type(f.type)) for f in canonical.schema])
+        with csv.CSVWriter(sink, schema, **write_params) as writer:
+            for batch in canonical.to_batches():
+                columns = [BasePersistHandler._csv_array(c) for c in batch.columns]
+                writer.write_batch(pa.record_batch(columns, schema=schema))
+
+    @staticmethod
+    def _csv_type(data_type: pa.DataType) -> pa.DataType:
+        """ the type a column is written to csv as """
+        if pa.types.is_dictionary(data_type):
+            return BasePersistHandler._csv_type(data_type.value_type)
+        if pa.types.is_nested(data_type):
+            return pa.string()
+        return data_type
+
+    @staticmethod
+    def _csv_array(arr: pa.Array) -> pa.Array:
+        """ decodes a dictionary array and formats a nested array as strings, other arrays are returned as is """
+        if pa.types.is_dictionary(arr.type):
+            return BasePersistHandler._csv_array(arr.dictionary_decode())
+        if pa.types.is_nested(arr.type):
+            return BasePersistHandler._nested_to_string(arr)
+        return arr
+
+    @staticmethod
+    def _nested_to_string(arr: pa.Array, quote: bool=False) -> pa.Array:
+        """ vectorised JSON like formatting of an array as strings. Nulls are preserved at the top level and written
+        as 'null' within a nested value.
+
+        :param arr: the array to format
+        :param quote: (optional) if string values should be quoted, as they are when nested
+        :return: a string array
+        """
+        if pa.types.is_dictionary(arr.type):
+            arr = arr.dictionary_decode()
+        if isinstance(arr, pa.ChunkedArray):
+            arr = arr.combine_chunks()
+        data_type = arr.type
+        if pa.types.is_fixed_size_list(data_type):
+            arr = arr.cast(pa.list_(data_type.value_field))
+            data_type = arr.type
+        if pa.types.is_map(data_type):
+            # the values of a map are its key and item struct
+            keys = BasePersistHandler._nested_to_string(arr.values.field(0), quote=True).fill_null('null')
+            items = BasePersistHandler._nested_to_string(arr.values.field(1), quote=True).fill_null('null')
+            values = pc.binary_join_element_wise(keys, items, ': ')
+            joined = pc.binary_join(pa.ListArray.from_arrays(arr.offsets, values), ', ')
+            formatted = pc.binary_join_element_wise('{', joined, '}', '')
+            return pc.if_else(arr.is_valid(), formatted, pa.scalar(None, pa.string()))
+        if pa.types.is_list(data_type) or pa.types.is_large_list(data_type):
+            # the offsets index the whole values buffer so this holds for sliced arrays
+            values = BasePersistHandler._nested_to_string(arr.values, quote=True).fill_null('null')
+            list_class = pa.LargeListArray if pa.types.is_large_list(data_type) else pa.ListArray
+            joined = pc.binary_join(list_class.from_arrays(arr.offsets, values), ', ')
+            formatted = pc.binary_join_element_wise('[', joined, ']', '')
+            return pc.if_else(arr.is_valid(), formatted, pa.scalar(None, pa.string()))
+        if pa.types.is_struct(data_type):
+            parts = []
+            for i in range(data_type.num_fields):
+                name = data_type.field(i).name
+                child = BasePersistHandler._nested_to_string(pc.struct_field(arr, [i]), quote=True).fill_null('null')
+                parts.append(pc.binary_join_element_wise(f'"{name}": ', child, ''))
+            if len(parts) == 0:
+                joined = pa.array([''] * len(arr), pa.string())
+            else:
+                joined = pc.binary_join_element_wise(*parts, ', ')
+            formatted = pc.binary_join_element_wise('{', joined, '}', '')
+            return pc.if_else(arr.is_valid(), formatted, pa.scalar(None, pa.string()))
+        if pa.types.is_string(data_type) or pa.types.is_large_string(data_type):
+            return pc.binary_join_element_wise('"', arr.cast(pa.string()), '"', '') if quote else arr
+        return arr.cast(pa.string())
+
+    @staticmethod
+    def _write_dataset(canonical: pa.Table, base_dir: str, file_type: str, partition_cols: list,
+                       existing_data_behavior: str=None, **write_params) -> bool:
+        """ writes the canonical as a hive partitioned directory dataset. By default, existing files in the
+        partitions being written are deleted so a single partition can be replaced without rewriting the others.
+        """
+        if file_type.lower() in ['pq', 'pqt', 'parquet']:
+            file_format = ds.ParquetFileFormat()
+        elif file_type.lower() in ['arrow', 'feather', 'ipc']:
+            file_format = ds.IpcFileFormat()
+        elif file_type.lower() in ['csv']:
+            file_format = ds.CsvFileFormat()
+        else:
+            raise LookupError('The file format {} is not currently supported for partitioned write'.format(file_type))
+        file_options = file_format.make_write_options(**write_params)
+        existing_data_behavior = existing_data_behavior if isinstance(existing_data_behavior, str) \
+            else 'delete_matching'
+        ds.write_dataset(canonical, base_dir=base_dir, format=file_format, file_options=file_options,
+                         partitioning=partition_cols, partitioning_flavor='hive',
+                         existing_data_behavior=existing_data_behavior)
+        return True
@@ -15,9 +15,19 @@ You will find a copy of this licenseIn the root directory of the project
 or you can visit <https://www.gnu.org/licenses/> For further information.
 """
 
+import os
+import ctypes
+import json
+import struct
+import tempfile
 import threading
+import uuid
+from contextlib import contextmanager
+from multiprocessing import shared_memory, resource_tracker
 import pyarrow as pa
-from typing import Dict
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from typing import Dict, Any
 
 from ds_core.properties.decorator_patterns import singleton
 from ds_core.handlers.abstract_handlers import AbstractSourceHandler, AbstractPersistHandler
@@ -62,13 +72,15 @@ class EventManager(object):
 
     def to_pydict(self):
         rtn_dict = {}
-        for event, tbl in self.__event_catalog.items():
+        for event in self.event_names():
+            tbl = self.get(event)
             rtn_dict[event] = {} if tbl is None else tbl.to_pydict()
         return rtn_dict
 
     def __repr__(self):
         rtn_str = ""
-        for event, tbl in self.__event_catalog.items():
+        for event in self.event_names():
+            tbl = self.get(event)
             if tbl is None:
                 rtn_str += f"\nEvent: {event} (0,0)\n\t-Empty-,"
             else:
@@ -78,7 +90,8 @@ class EventManager(object):
 
     def __str__(self):
         rtn_str = "EventBooks: ["
-        for event, tbl in self.__event_catalog.items():
+        for event in self.event_names():
+            tbl = self.get(event)
             if tbl is None:
                 rtn_str += f"\n\t{event}: ^(0, 0)> -Empty-,"
             else:
@@ -86,10 +99,181 @@ class EventManager(object):
         return rtn_str + '\n]'
 
 
+class SharedEventManager(EventManager):
+    """ An EventManager shared between processes. Each event is written once as an Arrow IPC stream into its own
+    multiprocessing.shared_memory segment and a small catalog segment maps event names to segments. Processes
+    map the segment and read the table zero-copy, without pickling or files.
+
+    Segments are named from the namespace, default 'hadron' or the environment variable HADRON_EVENT_NAMESPACE,
+    and outlive the process that wrote them until the event is deleted or the manager reset. Writes to the
+    catalog are serialised across processes with a file lock in the temp directory.
+    """
+
+    CATALOG_SIZE = 1024 * 1024
+
+    def __init__(self, namespace: str=None):
+        self._namespace = namespace if isinstance(namespace, str) else os.environ.get('HADRON_EVENT_NAMESPACE',
+                                                                                     'hadron')
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{self._namespace}_events.lock")
+        self._thread_lock = threading.Lock()
+        # the last mapped table of each event name by segment
+        self._attached = {}
+        with self._catalog_lock():
+            try:
+                self._catalog = self._shared_memory(f"{self._namespace}_events")
+            except FileNotFoundError:
+                self._catalog = self._shared_memory(f"{self._namespace}_events", size=self.CATALOG_SIZE)
+                self._catalog.buf[:8] = struct.pack('<Q', 0)
+
+    @property
+    def namespace(self) -> str:
+        return self._namespace
+
+    def event_names(self) -> list:
+        return list(self._catalog_snapshot().keys())
+
+    def is_event(self, name: str):
+        return name in self._catalog_snapshot()
+
+    def get(self, name: str) -> pa.Table:
+        entry = self._catalog_snapshot().get(name)
+        if entry is None or entry['segment'] is None:
+            return None
+        with self._thread_lock:
+            attached = self._attached.get(name)
+            if attached is not None and attached[0] == entry['segment']:
+                return attached[1]
+            shm = self._shared_memory(entry['segment'])
+            # the buffer owns the mapping so the segment stays mapped for as long as the table is referenced
+            view = ctypes.c_char.from_buffer(shm.buf)
+            address = ctypes.addressof(view)
+            del view
+            tbl = pa.ipc.open_stream(pa.foreign_buffer(address, entry['size'], base=shm)).read_all()
+            self._attached[name] = (entry['segment'], tbl)
+        return tbl
+
+    def set(self, name: str, event: pa.Table):
+        if self.is_event(name):
+            raise ValueError(f"The event name '{name}' already exists in the event catalog and does not need to be added")
+        self.update(name, event)
+
+    def update(self, name: str, event: pa.Table):
+        entry = {'segment': None, 'size': 0}
+        if event is not None:
+            sink = pa.MockOutputStream()
+            with pa.ipc.new_stream(sink, event.schema) as writer:
+                writer.write_table(event)
+            shm = self._shared_memory(f"{self._namespace}_{uuid.uuid4().hex[:16]}", size=sink.size())
+            buffer = pa.py_buffer(shm.buf)
+            with pa.ipc.new_stream(pa.FixedSizeBufferWriter(buffer), event.schema) as writer:
+                writer.write_table(event)
+            entry = {'segment': shm.name, 'size': sink.size()}
+            # the segment can only be closed once the exported buffer is released
+            del writer, buffer
+            shm.close()
+        with self._catalog_lock():
+            catalog = self._read_catalog()
+            previous = catalog.get(name)
+            catalog[name] = entry
+            self._write_catalog(catalog)
+        if previous is not None:
+            self._unlink(previous['segment'])
+
+    def delete(self, name: str):
+        with self._catalog_lock():
+            catalog = self._read_catalog()
+            entry = catalog.pop(name)
+            self._write_catalog(catalog)
+        self._unlink(entry['segment'])
+
+    def reset(self):
+        with self._catalog_lock():
+            catalog = self._read_catalog()
+            self._write_catalog({})
+        for entry in catalog.values():
+            self._unlink(entry['segment'])
+        return self
+
+    def unlink(self):
+        """ resets the event books and removes the catalog segment from the system """
+        self.reset()
+        self._unlink(self._catalog.name)
+
+    def _catalog_snapshot(self) -> dict:
+        """ reads the catalog under a shared lock so a concurrent write is never seen part written """
+        with self._catalog_lock(shared=True):
+            return self._read_catalog()
+
+    def _read_catalog(self) -> dict:
+        size = struct.unpack('<Q', self._catalog.buf[:8])[0]
+        if size == 0:
+            return {}
+        return json.loads(bytes(self._catalog.buf[8:8 + size]))
+
+    def _write_catalog(self, catalog: dict):
+        data = json.dumps(catalog).encode()
+        if len(data) + 8 > self.CATALOG_SIZE:
+            raise ValueError(f"The event catalog exceeds the catalog size of {self.CATALOG_SIZE} bytes")
+        self._catalog.buf[8:8 + len(data)] = data
+        self._catalog.buf[:8] = struct.pack('<Q', len(data))
+
+    @contextmanager
+    def _catalog_lock(self, shared: bool=None):
+        """ a lock across threads and processes, the file lock is a no-op where fcntl is not available
+
+        :param shared: (optional) if True takes a shared file lock for reading. Default False
+        """
+        shared = shared if isinstance(shared, bool) else False
+        with self._thread_lock:
+            try:
+                import fcntl
+            except ImportError:
+                yield
+                return
+            with open(self._lock_path, 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _unlink(self, segment: [str, None]):
+        if segment is None:
+            return
+        try:
+            shm = self._shared_memory(segment)
+        except FileNotFoundError:
+            return
+        if not hasattr(shm, '_track'):
+            # before python 3.13 unlink also unregisters the segment from the resource tracker
+            resource_tracker.register(shm._name, 'shared_memory')
+        shm.unlink()
+        shm.close()
+
+    @staticmethod
+    def _shared_memory(name: str, size: int=None) -> shared_memory.SharedMemory:
+        """ opens or, with a size, creates a segment that is not unlinked by the resource tracker at process exit """
+        create = isinstance(size, int)
+        try:
+            return shared_memory.SharedMemory(name=name, create=create, size=size or 0, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name, create=create, size=size or 0)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+            return shm
+
+
 class EventSourceHandler(AbstractSourceHandler):
-    """ PyArrow read only Source Handler. """
+    """ PyArrow read only Source Handler. Events are held in process unless the ConnectorContract kwarg 'shared'
+    or the environment variable HADRON_EVENT_SHARED is True, when they are held in shared memory and can be
+    loaded by other processes. As the handler is a singleton, an event name once given as shared stays shared
+    for the process rather than the manager following the last contract.
+    """
 
     _event_manager = EventManager()
+    _shared_event_manager = None
+    _shared_lock = threading.Lock()
+    # the event names given as shared by a connector contract
+    _shared_events = set()
 
     @singleton
     def __new__(cls, connector_contract: ConnectorContract):
@@ -99,12 +283,28 @@ class EventSourceHandler(AbstractSourceHandler):
         """ initialise the Handler passing the connector_contract dictionary """
         super().__init__(connector_contract)
         self._event_name = connector_contract.netloc
+        if str(connector_contract.kwargs.get('shared', False)).lower() in ['true', '1']:
+            with EventSourceHandler._shared_lock:
+                EventSourceHandler._shared_events.add(self._event_name)
         self._file_state = 0
         self._changed_flag = True
 
     @property
     def event_manager(self):
-        return self._event_manager
+        """ the shared event manager if the event is shared, else the in process event manager """
+        if self._event_name in EventSourceHandler._shared_events or \
+                str(os.environ.get('HADRON_EVENT_SHARED', False)).lower() in ['true', '1']:
+            return self.shared_event_manager()
+        return EventSourceHandler._event_manager
+
+    @classmethod
+    def shared_event_manager(cls) -> SharedEventManager:
+        """ the process wide SharedEventManager, created on first use """
+        if EventSourceHandler._shared_event_manager is None:
+            with cls._shared_lock:
+                if EventSourceHandler._shared_event_manager is None:
+                    EventSourceHandler._shared_event_manager = SharedEventManager()
+        return EventSourceHandler._shared_event_manager
 
     @property
     def event_name(self):
@@ -114,30 +314,51 @@ class EventSourceHandler(AbstractSourceHandler):
         """ The source types supported with this module"""
         return ['EventBookController']
 
-    def load_canonical(self, drop:bool=None, **kwargs) -> pa.Table:
+    def load_canonical(self, drop:bool=None, stream: bool=None, columns: list=None, filter: Any=None,
+                       **kwargs) -> [pa.Table, pa.RecordBatchReader]:
         """ returns the canonical dataset based on the connector contract. """
         drop = drop if isinstance(drop, bool) else False
+        stream = stream if isinstance(stream, bool) else False
         self.reset_changed()
-        if self._event_manager.is_event(self._event_name):
-            rtn_tbl = self._event_manager.get(self._event_name)
+        if self.event_manager.is_event(self._event_name):
+            rtn_tbl = self.event_manager.get(self._event_name)
             if isinstance(drop, bool) and drop:
-                self._event_manager.delete(self._event_name)
+                self.event_manager.delete(self._event_name)
+            if isinstance(columns, list) or filter is not None:
+                if isinstance(filter, (list, tuple)):
+                    filter = pq.filters_to_expression(list(filter))
+                rtn_tbl = ds.dataset(rtn_tbl).to_table(columns=columns, filter=filter)
+            if stream:
+                return pa.RecordBatchReader.from_batches(rtn_tbl.schema, rtn_tbl.to_batches())
             return rtn_tbl
         raise ValueError(f"The event '{self._event_name}' does not exist")
 
     def exists(self) -> bool:
         """ Returns True is the file exists """
-        return self._event_manager.is_event(self._event_name)
+        return self.event_manager.is_event(self._event_name)
 
     def has_changed(self) -> bool:
         """ returns the status of the change_flag indicating if the file has changed since last load or reset"""
-        return self.has_changed()
+        return self._changed_flag
 
     def reset_changed(self, changed: bool=None):
         """ manual reset to say the file has been seen. This is automatically called if the file is loaded"""
         changed = changed if isinstance(changed, bool) else False
         self._changed_flag = changed
 
+    """
+        ASYNCIO events are held in memory so are called directly on the event loop without an executor
+    """
+    async def aexists(self) -> bool:
+        return self.exists()
+
+    async def ahas_changed(self) -> bool:
+        return self.has_changed()
+
+    async def aload_canonical(self, drop: bool=None, stream: bool=None, columns: list=None, filter: Any=None,
+                              **kwargs) -> [pa.Table, pa.RecordBatchReader]:
+        return self.load_canonical(drop=drop, stream=stream, columns=columns, filter=filter, **kwargs)
+
 
 class EventPersistHandler(EventSourceHandler, AbstractPersistHandler):
     """ Event read/write Persist Handler. """
@@ -154,10 +375,13 @@ class EventPersistHandler(EventSourceHandler, AbstractPersistHandler):
         _schema, _book_name, _ = ConnectorContract.parse_address_elements(uri=uri)
         if _schema == 'event':
             self.reset_changed(True)
-            return self._event_manager.update(_book_name, canonical)
+            return self.event_manager.update(_book_name, canonical)
         raise LookupError(f'The schema must be event, {_schema} given')
 
     def remove_canonical(self) -> bool:
         if not isinstance(self.connector_contract, ConnectorContract):
             return False
-        return self._event_manager.delete(self._event_name)
+        return self.event_manager.delete(self._event_name)
+
+    async def apersist_canonical(self, canonical: pa.Table, **kwargs) -> bool:
+        return self.persist_canonical(canonical, **kwargs)
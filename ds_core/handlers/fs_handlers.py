@@ -0,0 +1,280 @@
+"""
+Copyright (C) 2024  Gigas64
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You will find a copy of this licenseIn the root directory of the project
+or you can visit <https://www.gnu.org/licenses/> For further information.
+"""
+
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as fs
+from typing import Any
+from ds_core.components.core_commons import CoreCommons as Commons
+from ds_core.handlers.abstract_handlers import AbstractSourceHandler, AbstractPersistHandler
+from ds_core.handlers.abstract_handlers import ConnectorContract
+from ds_core.handlers.base_handlers import BaseSourceHandler, BasePersistHandler
+
+
+class FsSourceHandler(AbstractSourceHandler):
+    """ PyArrow FileSystem read only Source Handler. Sources are read through a pyarrow.fs.FileSystem chosen by the
+    URI scheme, a local path or 'file' using the LocalFileSystem, 's3' the S3FileSystem, which also serves S3
+    compatible stores such as MinIO, and any other scheme pyarrow can resolve from the URI.
+
+    Extra Parameters in the ConnectorContract kwargs:
+        - fs_options: (optional) a dictionary of parameters passed to the filesystem, for example with S3
+                access_key, secret_key, region, endpoint_override and scheme
+        - base_dir: (optional) roots the handler in a SubTreeFileSystem of base_dir, the URI path, without any
+                S3 bucket, then being relative to it. For S3 the base_dir starts with the bucket, for example
+                's3://data/sub/file.parquet' with base_dir 'data/root' is 'data/root/sub/file.parquet'
+    """
+
+    # concurrent range reads and buffered writes
+    READ_WORKERS = 8
+    WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+    _filesystems: dict = {}
+    _fs_lock = threading.Lock()
+
+    def __init__(self, connector_contract: ConnectorContract):
+        """ initialise the Handler passing the connector_contract dictionary """
+        super().__init__(connector_contract)
+        self._file_state = 0
+        self._changed_flag = True
+
+    def supported_types(self) -> list:
+        """ The source types supported with this module"""
+        return ['parquet', 'csv', 'arrow', 'feather', 'ipc']
+
+    @property
+    def filesystem(self) -> fs.FileSystem:
+        """ the filesystem of the connector contract """
+        return self._resolve()[0]
+
+    @property
+    def path(self) -> str:
+        """ the path of the connector contract within its filesystem """
+        return self._resolve()[1]
+
+    def load_canonical(self, stream: bool=None, batch_size: int=None, columns: list=None, filter: Any=None,
+                       **kwargs) -> [pa.Table, pa.RecordBatchReader]:
+        """ returns the canonical dataset based on the connector contract. A file or directory, including hive
+        partitioned directories, is scanned as a pyarrow dataset. Parquet column chunks are pre-buffered so the
+        ranges needed are coalesced and fetched concurrently, which on object stores turns many small reads into
+        a few parallel range requests.
+
+        :param stream: (optional) if True returns a pa.RecordBatchReader rather than a pa.Table. Default False
+        :param batch_size: (optional) the maximum number of rows per batch
+        :param columns: (optional) a list of column names to project
+        :param filter: (optional) a pyarrow.compute.Expression or DNF list of tuples e.g. [('num', '>', 0)]
+        :param kwargs: additional load parameters
+        """
+        if not isinstance(self.connector_contract, ConnectorContract):
+            raise ValueError("The Connector Contract was not been set at initialisation or is corrupted")
+        _cc = self.connector_contract
+        load_params = kwargs
+        load_params.update(_cc.kwargs)  # Update with any kwargs in the Connector Contract
+        load_params.update(_cc.query)  # Update kwargs with those in the uri query
+        columns = columns if isinstance(columns, list) else load_params.pop('columns', None)
+        filter = filter if filter is not None else load_params.pop('filter', None)
+        stream = stream if isinstance(stream, bool) else False
+        filesystem, path = self._resolve()
+        info = filesystem.get_file_info(path)
+        _ext = os.path.splitext(path)[1].lstrip('.')
+        if len(_ext) == 0:
+            _ext = 'parquet' if info.type == fs.FileType.Directory else 'csv'
+        file_type = load_params.pop('file_type', _ext).lower()
+        options = {key: load_params.get(key) for key in ['parse_options', 'read_options', 'convert_options']}
+        options = BaseSourceHandler._column_types_options(options, load_params.pop('column_types', None))
+        file_format = BaseSourceHandler._file_format(file_type, **options)
+        if isinstance(file_format, ds.ParquetFileFormat):
+            file_format = ds.ParquetFileFormat(default_fragment_scan_options=ds.ParquetFragmentScanOptions(
+                pre_buffer=True))
+        partitioning = 'hive' if info.type == fs.FileType.Directory else None
+        self.reset_changed()
+        dataset = ds.dataset(path, format=file_format, filesystem=filesystem, partitioning=partitioning)
+        scan_params = {'batch_size': batch_size} if isinstance(batch_size, int) else {}
+        scanner = dataset.scanner(columns=columns, filter=BaseSourceHandler.filter_expression(filter),
+                                  **scan_params)
+        if stream:
+            return scanner.to_reader()
+        return scanner.to_table()
+
+    def read_ranges(self, ranges: list, max_workers: int=None) -> list:
+        """ reads byte ranges of the file concurrently through a single random access file
+
+        :param ranges: a list of (offset, length) tuples
+        :param max_workers: (optional) the number of concurrent reads. Default READ_WORKERS
+        :return: a list of bytes in the order of the ranges
+        """
+        max_workers = max_workers if isinstance(max_workers, int) else self.READ_WORKERS
+        filesystem, path = self._resolve()
+        with filesystem.open_input_file(path) as f:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                return list(executor.map(lambda r: f.read_at(r[1], r[0]), ranges))
+
+    def exists(self) -> bool:
+        """ Returns True is the file exists """
+        if not isinstance(self.connector_contract, ConnectorContract):
+            raise ValueError("The Connector Contract has not been set")
+        filesystem, path = self._resolve()
+        return filesystem.get_file_info(path).type != fs.FileType.NotFound
+
+    def has_changed(self) -> bool:
+        """ returns the status of the change_flag indicating if the file has changed since last load or reset"""
+        state = self.source_state()
+        if state is None:
+            return False
+        if state != self._file_state:
+            self._changed_flag = True
+            self._file_state = state
+        return self._changed_flag
+
+    def source_state(self) -> Any:
+        """ returns the size and modified time of the file, or of each file of a directory, or None if the
+        source doesn't exist """
+        filesystem, path = self._resolve()
+        info = filesystem.get_file_info(path)
+        if info.type == fs.FileType.NotFound:
+            return None
+        if info.type == fs.FileType.Directory:
+            infos = filesystem.get_file_info(fs.FileSelector(path, recursive=True))
+            return tuple(sorted((i.path, i.size, i.mtime_ns) for i in infos if i.type == fs.FileType.File))
+        return info.size, info.mtime_ns
+
+    def reset_changed(self, changed: bool = False):
+        """ manual reset to say the file has been seen. This is automatically called if the file is loaded"""
+        changed = changed if isinstance(changed, bool) else False
+        self._changed_flag = changed
+
+    def _resolve(self, uri: str=None) -> (fs.FileSystem, str):
+        """ returns the filesystem and path of the uri, or the connector contract uri if None """
+        _cc = self.connector_contract
+        uri = uri if isinstance(uri, str) else _cc.uri
+        schema, netloc, path = ConnectorContract.parse_address_elements(uri=uri)
+        schema = schema.lower()
+        fs_options = _cc.kwargs.get('fs_options', {})
+        fs_options = fs_options if isinstance(fs_options, dict) else {}
+        base_dir = _cc.kwargs.get('base_dir', None)
+        key = (schema, netloc if schema not in ['', 'file', 's3', 's3a'] else '',
+               repr(sorted(fs_options.items())), base_dir)
+        entry = self._filesystems.get(key)
+        if entry is None:
+            with self._fs_lock:
+                entry = FsSourceHandler._filesystems.get(key)
+                if entry is None:
+                    # the prefix of the path in the filesystem, such as the bucket of an object store
+                    prefix = ''
+                    if schema in ['', 'file']:
+                        filesystem = fs.LocalFileSystem(**fs_options)
+                    elif schema in ['s3', 's3a']:
+                        filesystem = fs.S3FileSystem(**fs_options)
+                    else:
+                        filesystem, _path = fs.FileSystem.from_uri(ConnectorContract.parse_address(uri))
+                        _relative = path.lstrip('/')
+                        if _path.endswith(_relative):
+                            prefix = _path[:len(_path) - len(_relative)]
+                    if isinstance(base_dir, str):
+                        if schema in ['', 'file']:
+                            base_dir = os.path.abspath(base_dir)
+                        filesystem = fs.SubTreeFileSystem(base_dir, filesystem)
+                    entry = (filesystem, prefix)
+                    FsSourceHandler._filesystems[key] = entry
+        filesystem, prefix = entry
+        if isinstance(base_dir, str):
+            return filesystem, path.lstrip('/')
+        if schema in ['', 'file']:
+            return filesystem, os.path.abspath(path)
+        if schema in ['s3', 's3a']:
+            return filesystem, f"{netloc}{path}"
+        return filesystem, f"{prefix}{path.lstrip('/')}"
+
+
+class FsPersistHandler(FsSourceHandler, AbstractPersistHandler):
+    """ PyArrow FileSystem read/write Persist Handler. Files are written through buffered output streams, on S3
+    these are multipart uploads whose parts are sent in the background while the next is written. Local files
+    are written to a temporary file and moved into place, object stores only publishing an object once its upload
+    completes.
+    """
+
+    def persist_canonical(self, canonical: pa.Table, **kwargs) -> bool:
+        """ persists the canonical dataset """
+        if not isinstance(self.connector_contract, ConnectorContract):
+            return False
+        _uri = self.connector_contract.uri
+        return self.backup_canonical(uri=_uri, canonical=canonical, **kwargs)
+
+    def backup_canonical(self, canonical: pa.Table, uri: str, **kwargs) -> bool:
+        """ creates a backup of the canonical to an alternative URI
+
+        Extra Parameters in the ConnectorContract kwargs:
+            - file_type: (optional) the type of the source file. if not set, inferred from the file extension
+            - write_params (optional) a dictionary of additional write parameters directly passed to 'write_' methods
+            - partition_cols (optional) a list of column names to hive partition the canonical by
+            - existing_data_behavior (optional) with partition_cols, one of 'delete_matching' (default),
+                    'overwrite_or_ignore' or 'error'
+        """
+        if not isinstance(self.connector_contract, ConnectorContract):
+            return False
+        _cc = self.connector_contract
+        persist_params = kwargs if isinstance(kwargs, dict) else _cc.kwargs
+        persist_params.update(_cc.parse_query(uri=uri))
+        filesystem, path = self._resolve(uri)
+        _ext = os.path.splitext(path)[1].lstrip('.')
+        file_type = persist_params.pop('file_type', _ext if len(_ext) > 0 else 'parquet').lower()
+        write_params = persist_params.pop('write_params', {})
+        partition_cols = persist_params.pop('partition_cols', _cc.kwargs.get('partition_cols', None))
+        if isinstance(partition_cols, (str, list)) and len(partition_cols) > 0:
+            file_format = BaseSourceHandler._file_format(file_type)
+            file_options = file_format.make_write_options(**write_params)
+            existing_data_behavior = persist_params.pop('existing_data_behavior', 'delete_matching')
+            ds.write_dataset(canonical, base_dir=path, format=file_format, file_options=file_options,
+                             filesystem=filesystem, partitioning=Commons.list_formatter(partition_cols),
+                             partitioning_flavor='hive', existing_data_behavior=existing_data_behavior,
+                             basename_template=f"part-{uuid.uuid4().hex}-{{i}}.{file_type}")
+            return True
+        if file_type not in ['pq', 'pqt', 'parquet', 'csv', 'gz', 'bz2', 'arrow', 'feather', 'ipc']:
+            raise LookupError('The file format {} is not currently supported for write'.format(file_type))
+        _parent = os.path.dirname(path)
+        if len(_parent) > 0:
+            filesystem.create_dir(_parent, recursive=True)
+        elif isinstance(filesystem, fs.SubTreeFileSystem):
+            filesystem.base_fs.create_dir(filesystem.base_path, recursive=True)
+        _local = isinstance(filesystem, fs.LocalFileSystem) or (
+                isinstance(filesystem, fs.SubTreeFileSystem) and isinstance(filesystem.base_fs, fs.LocalFileSystem))
+        _target = os.path.join(_parent, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp") if _local else path
+        try:
+            with filesystem.open_output_stream(_target, buffer_size=self.WRITE_BUFFER_SIZE) as sink:
+                BasePersistHandler._write_file(canonical, sink, file_type=file_type, **write_params)
+            if _local:
+                filesystem.move(_target, path)
+        except BaseException:
+            if _local and filesystem.get_file_info(_target).type != fs.FileType.NotFound:
+                filesystem.delete_file(_target)
+            raise
+        return True
+
+    def remove_canonical(self) -> bool:
+        if not isinstance(self.connector_contract, ConnectorContract):
+            return False
+        filesystem, path = self._resolve()
+        info = filesystem.get_file_info(path)
+        if info.type == fs.FileType.Directory:
+            filesystem.delete_dir(path)
+            return True
+        if info.type == fs.FileType.File:
+            filesystem.delete_file(path)
+            return True
+        return False
@@ -0,0 +1,456 @@
+"""
+Copyright (C) 2024  Gigas64
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You will find a copy of this licenseIn the root directory of the project
+or you can visit <https://www.gnu.org/licenses/> For further information.
+"""
+
+import os
+import queue
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+import pyarrow as pa
+import pyarrow.compute as pc
+from typing import Any
+from ds_core.components.core_commons import CoreCommons as Commons
+from ds_core.handlers.abstract_handlers import AbstractSourceHandler, AbstractPersistHandler
+from ds_core.handlers.abstract_handlers import ConnectorContract
+from ds_core.handlers.base_handlers import BaseSourceHandler, BasePersistHandler
+
+
+class SqliteConnectionPool(object):
+    """ A per process pool of sqlite connections to one database. Connections are created on demand up to the
+    pool size and returned to the pool on release. A pool is not shared with a forked child, which creates its
+    own. File databases are put in write-ahead log mode so readers do not block the writer.
+    """
+
+    def __init__(self, database: str, size: int=None, timeout: float=None):
+        self._database = database
+        self._size = size if isinstance(size, int) else 8
+        self._timeout = timeout if isinstance(timeout, (int, float)) else 30.0
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        # an in memory database lives only while a connection to it is open
+        self._keep_alive = self._connect() if self.is_memory else None
+
+    @property
+    def database(self) -> str:
+        return self._database
+
+    @property
+    def is_memory(self) -> bool:
+        return 'mode=memory' in self._database
+
+    @property
+    def pid(self) -> int:
+        return self._pid
+
+    @contextmanager
+    def connection(self) -> sqlite3.Connection:
+        """ a context manager lending a pooled connection, blocking while all connections are in use """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self._size:
+                self._created += 1
+                return self._connect()
+        return self._idle.get(timeout=self._timeout)
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        """ closes the idle connections """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        if self._keep_alive is not None:
+            self._keep_alive.close()
+            self._keep_alive = None
+        self._created = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._database, timeout=self._timeout, check_same_thread=False, uri=True,
+                               isolation_level=None)
+        if not self.is_memory:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+
+class SqliteSourceHandler(AbstractSourceHandler):
+    """ SQLite read only Source Handler. The URI is the database path, 'sqlite:///abs/path.db' or
+    'sqlite://relative/path.db', or 'sqlite://memory' for a process wide in memory database, with the table given
+    as a query parameter or kwarg, e.g. 'sqlite://working/stage.db?table=customers'.
+
+    Extra Parameters in the ConnectorContract kwargs:
+        - table: the name of the table
+        - query: (optional) a select statement used in place of the table on load
+        - params: (optional) the parameters of the query
+        - pool_size: (optional) the maximum connections in the process pool for the database. Default 8
+    """
+
+    BATCH_SIZE = 65536
+    _pools: dict = {}
+    _pool_lock = threading.Lock()
+
+    def __init__(self, connector_contract: ConnectorContract):
+        """ initialise the Handler passing the connector_contract dictionary """
+        super().__init__(connector_contract)
+        self._file_state = 0
+        self._changed_flag = True
+
+    def supported_types(self) -> list:
+        """ The source types supported with this module"""
+        return ['sqlite']
+
+    @property
+    def database(self) -> str:
+        """ the sqlite database of the connector contract """
+        _cc = self.connector_contract
+        _, netloc, path = ConnectorContract.parse_address_elements(uri=_cc.uri)
+        database = f"{netloc}{path}"
+        if database in ['memory', ':memory:']:
+            return 'file:hadron_memory?mode=memory&cache=shared'
+        return f"file:{os.path.abspath(database)}"
+
+    @property
+    def table(self) -> str:
+        """ the table name of the connector contract """
+        _cc = self.connector_contract
+        table = {**_cc.query, **_cc.kwargs}.get('table', None)
+        if not isinstance(table, str) or len(table) == 0:
+            raise ValueError("The Connector Contract must give the 'table' as a kwarg or uri query parameter")
+        return table
+
+    def pool(self) -> SqliteConnectionPool:
+        """ returns the process pool of connections to the database """
+        database = self.database
+        pool = self._pools.get(database)
+        if pool is None or pool.pid != os.getpid():
+            with self._pool_lock:
+                pool = SqliteSourceHandler._pools.get(database)
+                if pool is None or pool.pid != os.getpid():
+                    pool_size = self.connector_contract.kwargs.get('pool_size', None)
+                    pool = SqliteConnectionPool(database, size=pool_size)
+                    SqliteSourceHandler._pools[database] = pool
+        return pool
+
+    def load_canonical(self, stream: bool=None, batch_size: int=None, columns: list=None, filter: Any=None,
+                       query: str=None, params: Any=None, **kwargs) -> [pa.Table, pa.RecordBatchReader]:
+        """ returns the canonical of the table or query. Rows are fetched batch_size at a time and transposed into
+        typed Arrow arrays so only one batch of rows is held in Python at once. Columns are typed from the declared
+        column types of the table, otherwise inferred from the first batch, or can be given as 'column_types'.
+
+        :param stream: (optional) if True returns a pa.RecordBatchReader rather than a pa.Table. Default False
+        :param batch_size: (optional) the number of rows fetched per batch. Default BATCH_SIZE
+        :param columns: (optional) a list of column names to select
+        :param filter: (optional) a DNF list of tuples, e.g. [('id', '=', 7)], pushed down as a WHERE clause, or a
+                    pyarrow.compute.Expression applied to each batch
+        :param query: (optional) a select statement used in place of the table
+        :param params: (optional) the parameters of the query
+        :param kwargs: additional load parameters
+        """
+        if not isinstance(self.connector_contract, ConnectorContract):
+            raise ValueError("The Connector Contract was not been set at initialisation or is corrupted")
+        _cc = self.connector_contract
+        load_params = {**_cc.query, **_cc.kwargs, **kwargs}
+        stream = stream if isinstance(stream, bool) else False
+        batch_size = batch_size if isinstance(batch_size, int) else self.BATCH_SIZE
+        columns = columns if isinstance(columns, list) else load_params.get('columns', None)
+        filter = filter if filter is not None else load_params.get('filter', None)
+        query = query if isinstance(query, str) else load_params.get('query', None)
+        params = params if params is not None else load_params.get('params', ())
+        column_types = load_params.get('column_types', {})
+        column_types = {k: Commons.type_from_str(v) if isinstance(v, str) else v for k, v in column_types.items()}
+        expression = None
+        if isinstance(query, str):
+            sql = f"SELECT {self._select_list(columns)} FROM ({query})"
+            declared = {}
+        else:
+            sql = f"SELECT {self._select_list(columns)} FROM {self._quote(self.table)}"
+            declared = self._declared_types(self.table)
+        if isinstance(filter, (list, tuple)) and len(filter) > 0:
+            where, where_params = self._where_clause(filter)
+            sql = f"{sql} WHERE {where}"
+            params = tuple(params) + tuple(where_params)
+        elif filter is not None:
+            expression = BaseSourceHandler.filter_expression(filter)
+        self.reset_changed()
+        reader = self._select(sql, params, batch_size=batch_size, declared=declared, column_types=column_types)
+        if expression is not None:
+            batches = (b for batch in reader for b in pa.Table.from_batches([batch]).filter(expression).to_batches())
+            reader = pa.RecordBatchReader.from_batches(reader.schema, batches)
+        if stream:
+            return reader
+        return reader.read_all()
+
+    def exists(self) -> bool:
+        """ Returns True is the table exists """
+        if not isinstance(self.connector_contract, ConnectorContract):
+            raise ValueError("The Connector Contract has not been set")
+        if not self.pool().is_memory and not os.path.exists(self.database[5:]):
+            return False
+        with self.pool().connection() as conn:
+            row = conn.execute("SELECT count(*) FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?",
+                               (self.table,)).fetchone()
+        return row[0] > 0
+
+    def has_changed(self) -> bool:
+        """ returns the status of the change_flag indicating if the table has changed since last load or reset.
+        The state is the modified time and size of the database and its write-ahead log, so any write to the
+        database is seen as a change. An in memory database is always seen as changed. """
+        if self.pool().is_memory:
+            return self.exists()
+        state = self.source_state()
+        if state is None:
+            return False
+        if state != self._file_state:
+            self._changed_flag = True
+            self._file_state = state
+        return self._changed_flag
+
+    def source_state(self) -> Any:
+        """ returns the modified time and size of the database and its write-ahead log, or None if the table
+        doesn't exist or the database is in memory """
+        if self.pool().is_memory or not self.exists():
+            return None
+        path = self.database[5:]
+        return tuple((os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in [path, f"{path}-wal"]
+                     if os.path.exists(p))
+
+    def reset_changed(self, changed: bool = False):
+        """ manual reset to say the file has been seen. This is automatically called if the file is loaded"""
+        changed = changed if isinstance(changed, bool) else False
+        self._changed_flag = changed
+
+    def _select(self, sql: str, params: Any, batch_size: int, declared: dict,
+                column_types: dict) -> pa.RecordBatchReader:
+        """ runs the select on a pooled connection returning a reader of its record batches """
+        pool = self.pool()
+        conn = pool.acquire()
+        try:
+            cursor = conn.execute(sql, params)
+            names = [d[0] for d in cursor.description]
+            rows = cursor.fetchmany(batch_size)
+        except BaseException:
+            pool.release(conn)
+            raise
+        types = {n: column_types.get(n, self._arrow_type(declared.get(n, ''))) for n in names}
+        first = self._to_batch(names, rows, types)
+        schema = first.schema
+
+        def _batches():
+            try:
+                yield first
+                while True:
+                    _rows = cursor.fetchmany(batch_size)
+                    if len(_rows) == 0:
+                        break
+                    batch = self._to_batch(names, _rows, types)
+                    yield batch if batch.schema.equals(schema) else batch.cast(schema)
+            finally:
+                cursor.close()
+                pool.release(conn)
+        return pa.RecordBatchReader.from_batches(schema, _batches())
+
+    @staticmethod
+    def _to_batch(names: list, rows: list, types: dict) -> pa.RecordBatch:
+        """ transposes the rows into typed column arrays. Dates and timestamps are stored as ISO strings and
+        booleans as integers """
+        columns = list(zip(*rows)) if len(rows) > 0 else [[] for _ in names]
+        arrays = []
+        for name, values in zip(names, columns):
+            _type = types.get(name)
+            if _type is None:
+                arrays.append(pa.array(values))
+            elif pa.types.is_timestamp(_type) or pa.types.is_date(_type) or pa.types.is_time(_type):
+                arrays.append(pc.cast(pa.array(values, pa.string()), _type))
+            elif pa.types.is_boolean(_type):
+                arrays.append(pc.cast(pa.array(values, pa.int64()), _type))
+            else:
+                arrays.append(pa.array(values, _type))
+        return pa.RecordBatch.from_arrays(arrays, names=names)
+
+    def _declared_types(self, table: str) -> dict:
+        """ the declared column types of the table """
+        with self.pool().connection() as conn:
+            return {row[1]: row[2] for row in conn.execute(f"PRAGMA table_info({self._quote(table)})")}
+
+    @staticmethod
+    def _arrow_type(declared: str) -> [pa.DataType, None]:
+        """ the Arrow type of a declared sqlite column type, or None to infer it """
+        declared = declared.upper()
+        match = re.fullmatch(r'TIMESTAMP(TZ)?(?:\((\d)\))?', declared)
+        if match:
+            unit = {'0': 's', '3': 'ms', '6': 'us', '9': 'ns'}.get(match.group(2), 'us')
+            return pa.timestamp(unit, tz='UTC' if match.group(1) else None)
+        if declared == 'BOOLEAN':
+            return pa.bool_()
+        if declared in ['DATE']:
+            return pa.date32()
+        if declared in ['INTEGER', 'BIGINT', 'INT']:
+            return pa.int64()
+        if declared in ['DOUBLE', 'REAL', 'FLOAT']:
+            return pa.float64()
+        if declared in ['TEXT', 'VARCHAR']:
+            return pa.string()
+        if declared == 'BLOB':
+            return pa.binary()
+        return None
+
+    @staticmethod
+    def _select_list(columns: list=None) -> str:
+        if not isinstance(columns, list) or len(columns) == 0:
+            return '*'
+        return ', '.join(SqliteSourceHandler._quote(c) for c in columns)
+
+    @staticmethod
+    def _where_clause(filter: list) -> (str, list):
+        """ converts a DNF filter into a parameterised WHERE clause """
+        operators = {'=': '=', '==': '=', '!=': '!=', '<': '<', '>': '>', '<=': '<=', '>=': '>=',
+                     'in': 'IN', 'not in': 'NOT IN'}
+        if not isinstance(filter[0], (list, tuple)) or isinstance(filter[0][0], str):
+            filter = [filter]
+        params = []
+        disjunction = []
+        for conjunction in filter:
+            terms = []
+            for name, op, value in conjunction:
+                op = op.lower()
+                if op not in operators:
+                    raise ValueError(f"The filter operator '{op}' is not supported")
+                if op in ['in', 'not in']:
+                    values = list(value)
+                    terms.append(f"{SqliteSourceHandler._quote(name)} {operators[op]} "
+                                 f"({', '.join(['?'] * len(values))})")
+                    params += values
+                else:
+                    terms.append(f"{SqliteSourceHandler._quote(name)} {operators[op]} ?")
+                    params.append(value)
+            disjunction.append(f"({' AND '.join(terms)})")
+        return ' OR '.join(disjunction), params
+
+    @staticmethod
+    def _quote(name: str) -> str:
+        return '"{}"'.format(name.replace('"', '""'))
+
+
+class SqlitePersistHandler(SqliteSourceHandler, AbstractPersistHandler):
+    """ SQLite read/write Persist Handler. """
+
+    def persist_canonical(self, canonical: pa.Table, **kwargs) -> bool:
+        """ persists the canonical dataset """
+        if not isinstance(self.connector_contract, ConnectorContract):
+            return False
+        _uri = self.connector_contract.uri
+        return self.backup_canonical(uri=_uri, canonical=canonical, **kwargs)
+
+    def backup_canonical(self, canonical: pa.Table, uri: str, **kwargs) -> bool:
+        """ creates a backup of the canonical to an alternative URI. The rows are inserted record batch by record
+        batch with executemany inside a single transaction, so readers see either the old or the new table.
+
+        Extra Parameters in the ConnectorContract kwargs:
+            - table: the name of the table, can also be a uri query parameter
+            - if_exists: (optional) 'replace' (default) drops an existing table, 'append' inserts into it
+            - batch_size: (optional) the rows per executemany. Default BATCH_SIZE
+        """
+        if not isinstance(self.connector_contract, ConnectorContract):
+            return False
+        _cc = self.connector_contract
+        persist_params = {**_cc.kwargs, **_cc.parse_query(uri=uri), **kwargs}
+        handler = self if uri == _cc.uri else SqlitePersistHandler(ConnectorContract(
+            uri=uri, module_name=_cc.module_name, handler=_cc.handler, **_cc.kwargs))
+        table = self._quote(persist_params['table'] if 'table' in persist_params else handler.table)
+        if_exists = persist_params.get('if_exists', 'replace')
+        batch_size = persist_params.get('batch_size', self.BATCH_SIZE)
+        if if_exists not in ['replace', 'append']:
+            raise ValueError(f"The if_exists '{if_exists}' must be 'replace' or 'append'")
+        definition = ', '.join(f"{self._quote(f.name)} {self._declared_type(f.type)}" for f in canonical.schema)
+        insert = f"INSERT INTO {table} VALUES ({', '.join(['?'] * canonical.num_columns)})"
+        with handler.pool().connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if if_exists == 'replace':
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definition})")
+                for batch in canonical.to_batches(max_chunksize=batch_size):
+                    columns = [self._to_sqlite(c).to_pylist() for c in batch.columns]
+                    conn.executemany(insert, zip(*columns))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return True
+
+    def remove_canonical(self) -> bool:
+        if not isinstance(self.connector_contract, ConnectorContract):
+            return False
+        if not self.exists():
+            return False
+        with self.pool().connection() as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {self._quote(self.table)}")
+        return True
+
+    @staticmethod
+    def _declared_type(data_type: pa.DataType) -> str:
+        """ the declared sqlite column type of an Arrow type, read back by _arrow_type. The timestamp precision is
+        kept as the type argument and timezone aware timestamps are stored in UTC """
+        if pa.types.is_dictionary(data_type):
+            return SqlitePersistHandler._declared_type(data_type.value_type)
+        if pa.types.is_boolean(data_type):
+            return 'BOOLEAN'
+        if pa.types.is_integer(data_type):
+            return 'BIGINT'
+        if pa.types.is_floating(data_type) or pa.types.is_decimal(data_type):
+            return 'DOUBLE'
+        if pa.types.is_timestamp(data_type):
+            precision = {'s': 0, 'ms': 3, 'us': 6, 'ns': 9}[data_type.unit]
+            return f"TIMESTAMPTZ({precision})" if data_type.tz else f"TIMESTAMP({precision})"
+        if pa.types.is_date(data_type):
+            return 'DATE'
+        if pa.types.is_binary(data_type) or pa.types.is_large_binary(data_type):
+            return 'BLOB'
+        return 'TEXT'
+
+    @staticmethod
+    def _to_sqlite(arr: pa.Array) -> pa.Array:
+        """ converts an array to the values sqlite stores, temporal values as ISO strings and nested as text """
+        if pa.types.is_dictionary(arr.type):
+            arr = arr.dictionary_decode()
+        if pa.types.is_timestamp(arr.type) and arr.type.tz is not None:
+            return arr.cast(pa.timestamp(arr.type.unit, tz='UTC')).cast(pa.string())
+        if pa.types.is_timestamp(arr.type) or pa.types.is_date(arr.type) or pa.types.is_time(arr.type):
+            return arr.cast(pa.string())
+        if pa.types.is_decimal(arr.type):
+            return arr.cast(pa.float64())
+        if pa.types.is_nested(arr.type):
+            return BasePersistHandler._nested_to_string(arr)
+        return arr
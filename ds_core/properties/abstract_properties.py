@@ -15,9 +15,15 @@ You will find a copy of this licenseIn the root directory of the project
 or you can visit <https://www.gnu.org/licenses/> For further information.
 """
 
+import atexit
+import copy
 import os
 import re
+import threading
+import time
+import weakref
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Any
 
@@ -26,7 +32,7 @@ from ds_core.components.core_commons import CoreCommons
 from ds_core.handlers.event_handlers import EventPersistHandler
 from ds_core.properties.property_manager import PropertyManager
 from ds_core.handlers.abstract_handlers import AbstractSourceHandler, AbstractPersistHandler
-from ds_core.handlers.abstract_handlers import HandlerFactory, ConnectorContract
+from ds_core.handlers.abstract_handlers import HandlerFactory, HandlerRegistry, HandlerPool, ConnectorContract
 
 
 class AbstractProperty(object):
@@ -130,6 +136,98 @@ class AbstractProperty(object):
         return _method.fget()
 
 
+class ContractWriter(object):
+    """ A process wide background writer for property managers in write-behind mode. A persist request is
+    scheduled to be written once the debounce window has passed, and further requests for the same property
+    manager within the window are coalesced into that one write of its latest properties. Pending writes are
+    flushed on an explicit flush() and at interpreter exit.
+    """
+
+    _pending: dict = {}
+    _errors: dict = {}
+    _thread = None
+    _condition = threading.Condition()
+    # serialises writes with property manager transactions, see AbstractPropertyManager._transaction_lock
+    _write_lock = threading.RLock()
+
+    @classmethod
+    def submit(cls, property_manager: Any, debounce: float, only_branch: bool=True, force: bool=False):
+        """ schedules a write of the property manager properties
+
+        :param property_manager: the AbstractPropertyManager to persist
+        :param debounce: the seconds to wait, coalescing further requests, before writing
+        :param only_branch: (optional) passed to persist_properties
+        :param force: (optional) passed to persist_properties
+        """
+        with cls._condition:
+            entry = cls._pending.get(id(property_manager))
+            if entry is None:
+                entry = {'pm': property_manager, 'due': time.monotonic() + debounce, 'only_branch': only_branch,
+                         'force': force}
+                ContractWriter._pending[id(property_manager)] = entry
+            else:
+                entry['only_branch'] = entry['only_branch'] and only_branch
+                entry['force'] = entry['force'] or force
+            if cls._thread is None or not cls._thread.is_alive():
+                ContractWriter._thread = threading.Thread(target=cls._run, name='hadron-contract-writer',
+                                                          daemon=True)
+                ContractWriter._thread.start()
+            cls._condition.notify()
+
+    @classmethod
+    def flush(cls, property_manager: Any=None):
+        """ writes pending requests now and waits for any write in progress. Raises the first error of a
+        background write since the last flush
+
+        :param property_manager: (optional) only flush this property manager. Default all
+        """
+        with cls._write_lock:
+            with cls._condition:
+                keys = list(cls._pending.keys()) if property_manager is None else [id(property_manager)]
+                entries = [cls._pending.pop(k) for k in keys if k in cls._pending]
+            for entry in entries:
+                cls._write(entry)
+        with cls._condition:
+            keys = list(cls._errors.keys()) if property_manager is None else [id(property_manager)]
+            errors = [cls._errors.pop(k) for k in keys if k in cls._errors]
+        if len(errors) > 0:
+            raise errors[0]
+
+    @classmethod
+    def pending(cls) -> int:
+        """ the number of property managers with a pending write """
+        return len(cls._pending)
+
+    @classmethod
+    def _run(cls):
+        while True:
+            with cls._condition:
+                while True:
+                    now = time.monotonic()
+                    due = [k for k, e in cls._pending.items() if e['due'] <= now]
+                    if len(due) > 0:
+                        break
+                    timeout = min([e['due'] for e in cls._pending.values()], default=now + 60.0) - now
+                    cls._condition.wait(timeout=timeout)
+            # waits for any transaction so a partly built contract is not written
+            with cls._write_lock:
+                with cls._condition:
+                    entries = [cls._pending.pop(k) for k in due if k in cls._pending]
+                for entry in entries:
+                    try:
+                        cls._write(entry)
+                    except Exception as e:
+                        with cls._condition:
+                            ContractWriter._errors.setdefault(id(entry['pm']), e)
+
+    @staticmethod
+    def _write(entry: dict):
+        entry['pm']._persist_properties(only_branch=entry['only_branch'], force=entry['force'])
+
+
+atexit.register(ContractWriter.flush)
+
+
 class AbstractPropertyManager(ABC):
     """ Abstract AI Single Task Application Component (AI-STAC) class that creates a super class for all properties
     managers
@@ -177,6 +275,8 @@ class AbstractPropertyManager(ABC):
     _knowledge_catalog: list
     _connection_handler: dict
     _keys: AbstractProperty
+    # transactions are serialised across threads and with background contract writes
+    _transaction_lock = ContractWriter._write_lock
 
     @abstractmethod
     def __init__(self, task_name: str, root_keys: list, knowledge_keys: list, creator: str):
@@ -207,9 +307,16 @@ class AbstractPropertyManager(ABC):
         root_keys += ['description', 'version', 'status', 'connectors', 'intent', 'snapshot', 'run_book',
                       {'meta': ['module', 'class']}, {self._KNOWLEDGE_ROOT: self._knowledge_catalog}]
         self._keys = AbstractProperty(root_keys, manager=self.manager_name(), contract=self._task_name)
+        self._connection_handler = {}
+        # the pooled handlers are released when the manager is collected
+        weakref.finalize(self, AbstractPropertyManager._release_handlers, self._connection_handler)
+        # the property connector uri the branch was last persisted to
+        self._persisted_uri = None
+        self._transaction = None
+        _write_behind = os.environ.get('HADRON_PM_WRITE_BEHIND', None)
+        self._write_behind = float(_write_behind) if _write_behind else None
         if not self.is_key(self.KEY.contract_key):
             self.reset_all()
-        self._connection_handler = {}
         self._create_abstract_properties()
         self._restricted_key = []
         for key in self.KEY.keys():
@@ -246,13 +353,14 @@ class AbstractPropertyManager(ABC):
 
         :param connector_contract: a Connector Contract for the properties persistence
         """
+        self.flush()
         self.remove(self.join(self.KEY.connectors_key, self.CONNECTOR_PM_CONTRACT))
-        if self._connection_handler.get(self.CONNECTOR_PM_CONTRACT) is not None:
-            self._connection_handler.pop(self.CONNECTOR_PM_CONTRACT)
+        self.remove_connector_handler(self.CONNECTOR_PM_CONTRACT)
         self.set_connector_contract(connector_name=self.CONNECTOR_PM_CONTRACT, connector_contract=connector_contract)
         return
 
-    def persist_properties(self, connector_contract: ConnectorContract=None, only_branch: bool=None):
+    def persist_properties(self, connector_contract: ConnectorContract=None, only_branch: bool=None,
+                           force: bool=None):
         """ persists properties to the set contract connector.
 
         :param connector_contract: an alternative connector contract to write the properties to.
@@ -262,8 +370,25 @@ class AbstractPropertyManager(ABC):
                             properties manager and contract only
                 True: only loads properties from this branch of the properties tree
                 False: loads all content from root
+        :param force: (optional) if True writes the properties even if unchanged since they were last persisted.
+                    By default the write to the property connector is skipped when the branch has not changed
         """
         only_branch = only_branch if isinstance(only_branch, bool) else True
+        force = force if isinstance(force, bool) else False
+        if self._transaction is not None and connector_contract is None:
+            # deferred to the end of the transaction
+            pending = self._transaction['persist'] or {'only_branch': True, 'force': False}
+            self._transaction['persist'] = {'only_branch': pending['only_branch'] and only_branch,
+                                            'force': pending['force'] or force}
+            return
+        if self._write_behind is not None and connector_contract is None:
+            ContractWriter.submit(self, debounce=self._write_behind, only_branch=only_branch, force=force)
+            return
+        self._persist_properties(connector_contract=connector_contract, only_branch=only_branch, force=force)
+
+    def _persist_properties(self, connector_contract: ConnectorContract=None, only_branch: bool=True,
+                            force: bool=False):
+        """ writes the properties, see persist_properties """
         if only_branch:
             _key = self.join(self.manager_name(),
                              self._task_name) if isinstance(self._task_name, str) else self.manager_name()
@@ -278,7 +403,62 @@ class AbstractPropertyManager(ABC):
                 connector_handler = HandlerFactory.instantiate(connector_contract)
         else:
             connector_handler = self.get_connector_handler(connector_name=self.CONNECTOR_PM_CONTRACT)
-        self._base_pm.dump(handler=connector_handler, key=_key)
+            _uri = connector_handler.connector_contract.uri
+            if not force and _uri == self._persisted_uri and not self._base_pm.is_dirty(_key):
+                return
+            self._base_pm.dump(handler=connector_handler, key=_key)
+            self._persisted_uri = _uri
+            return
+        # the changes are tracked against the property connector so are left for its next persist
+        self._base_pm.dump(handler=connector_handler, key=_key, clear_dirty=False)
+
+    def set_write_behind(self, debounce: float=None):
+        """ sets write-behind mode, where persist_properties returns at once and the properties are written by a
+        background thread once the debounce window has passed, coalescing all requests within the window. Pending
+        writes are written on flush(), before the properties are loaded and at interpreter exit.
+
+        :param debounce: the debounce window in seconds, or None to write synchronously. The default is the
+                    environment variable HADRON_PM_WRITE_BEHIND or None
+        """
+        if debounce is None:
+            self.flush()
+        self._write_behind = float(debounce) if isinstance(debounce, (int, float)) else None
+
+    def flush(self):
+        """ writes any pending write-behind persist of the properties and waits for it to complete """
+        ContractWriter.flush(self)
+
+    @contextmanager
+    def transaction(self):
+        """ a context manager grouping property changes into one unit. Calls to persist_properties within the
+        transaction are deferred and the properties persisted once on exit. If an exception is raised the contract
+        branch is rolled back to its state at the start and nothing is persisted. Transactions are serialised
+        across threads and a nested transaction joins the outer one.
+
+        Example:
+            with pm.transaction():
+                pm.set_connector_contract(...)
+                pm.set_intent(...)
+        """
+        with self._transaction_lock:
+            if self._transaction is not None:
+                yield self
+                return
+            self._transaction = {'snapshot': copy.deepcopy(self.get(self.KEY.contract_key)), 'persist': None}
+            try:
+                yield self
+            except BaseException:
+                snapshot = self._transaction['snapshot']
+                self._transaction = None
+                self._base_pm.remove(self.KEY.contract_key)
+                if snapshot is not None:
+                    self._base_pm.set(self.KEY.contract_key, snapshot)
+                self._release_connector_handlers()
+                raise
+            pending = self._transaction['persist']
+            self._transaction = None
+            if pending is not None:
+                self.persist_properties(**pending)
 
     def load_properties(self, replace=False) -> bool:
         """ loads the properties from the contract connector
@@ -286,6 +466,7 @@ class AbstractPropertyManager(ABC):
         :param replace: replaces everything that is currently in memory with the new properties
         :return: true if loaded successfully
         """
+        self.flush()
         connector_handler = self.get_connector_handler(connector_name=self.CONNECTOR_PM_CONTRACT)
         # only replace this contract not all things in the PM
         if replace:
@@ -306,7 +487,7 @@ class AbstractPropertyManager(ABC):
         if property_connector is not None:
             self.set(self.join(self.KEY.connectors_key, self.CONNECTOR_PM_CONTRACT), property_connector)
             self.set_connector_version(connector_name=self.CONNECTOR_PM_CONTRACT, version=self.version)
-        self._connection_handler = {}
+        self._release_connector_handlers()
         return
 
     @property
@@ -375,7 +556,7 @@ class AbstractPropertyManager(ABC):
     def set_version(self, version: str):
         """ Sets the version of the contract"""
         self.set(self.KEY.version_key, version)
-        self._connection_handler = {}
+        self._release_connector_handlers()
         for connector_name in self.connector_contract_list:
             self.set_connector_version(connector_name=connector_name, version=self.version)
         return
@@ -756,12 +937,17 @@ class AbstractPropertyManager(ABC):
         if str(_path).startswith('${'):
             _path = ConnectorContract.parse_environ(_path)
         _schema, _, _ = ConnectorContract.parse_address_elements(uri=_path)
-        for _package in ['ds_core', self.get_pkg_root()]:
-            _module_name = f'{_package}.handlers.{_schema.lower()}_handlers'
-            _handler = f'{_schema.title()}PersistHandler'
-            if HandlerFactory.check_handler(_module_name, _handler):
-                self.set(self.join(_connector_key, 'raw_module_name'), _module_name)
-                self.set(self.join(_connector_key, 'raw_handler'), _handler)
+        _registered = HandlerRegistry.lookup(_schema)
+        if _registered is not None:
+            self.set(self.join(_connector_key, 'raw_module_name'), _registered[0])
+            self.set(self.join(_connector_key, 'raw_handler'), _registered[2])
+        else:
+            for _package in ['ds_core', self.get_pkg_root()]:
+                _module_name = f'{_package}.handlers.{_schema.lower()}_handlers'
+                _handler = f'{_schema.title()}PersistHandler'
+                if HandlerFactory.check_handler(_module_name, _handler):
+                    self.set(self.join(_connector_key, 'raw_module_name'), _module_name)
+                    self.set(self.join(_connector_key, 'raw_handler'), _handler)
         return ConnectorContract(uri=self.get(self.join(_connector_key, 'raw_uri')),
                                  module_name=self.get(self.join(_connector_key, 'raw_module_name')),
                                  handler=self.get(self.join(_connector_key, 'raw_handler')),
@@ -868,7 +1054,8 @@ class AbstractPropertyManager(ABC):
             if connector_contract.schema == 'event':
                 self._connection_handler[connector_name] = EventPersistHandler(connector_contract)
             else:
-                self._connection_handler[connector_name] = HandlerFactory.instantiate(connector_contract)
+                # shared with other property managers with the same connector contract
+                self._connection_handler[connector_name] = HandlerPool.acquire(connector_contract)
         return self._connection_handler.get(connector_name)
 
     def remove_connector_contract(self, connector_name: str):
@@ -877,16 +1064,27 @@ class AbstractPropertyManager(ABC):
             raise ValueError("The connector contract name '{}' is a reserved name for the "
                              "PropertyManager connector and can not be removed".format(self.CONNECTOR_PM_CONTRACT))
         self.remove(self.join(self.KEY.connectors_key, connector_name))
-        if self._connection_handler.get(connector_name) is not None:
-            self._connection_handler.pop(connector_name)
+        self.remove_connector_handler(connector_name)
         return
 
     def remove_connector_handler(self, connector_name: str):
         """removes the connector handler instance"""
         if self._connection_handler.get(connector_name) is not None:
-            self._connection_handler.pop(connector_name)
+            HandlerPool.release(self._connection_handler.pop(connector_name))
         return
 
+    def _release_connector_handlers(self):
+        """removes all connector handler instances, releasing them to the handler pool"""
+        self._release_handlers(self._connection_handler)
+
+    @staticmethod
+    def _release_handlers(connection_handler: dict):
+        """releases the handlers to the handler pool and empties the dictionary. Kept clear of the manager so it
+        can be called once the manager is collected"""
+        for handler in list(connection_handler.values()):
+            HandlerPool.release(handler)
+        connection_handler.clear()
+
     def has_connector(self, connector_name: str) -> bool:
         """Test if the contract has intent"""
         if self.get(self.join(self.KEY.connectors_key, connector_name)) is None:
@@ -1,4 +1,4 @@
-import ast
+import os
 import threading
 import uuid
 from datetime import datetime
@@ -24,6 +24,7 @@ or you can visit <https://www.gnu.org/licenses/> For further information.
 import ds_core
 from ds_core.handlers.abstract_handlers import AbstractPersistHandler
 from ds_core.properties.decorator_patterns import singleton
+from ds_core.properties.property_serialisers import PropertySerialiser
 
 class PropertyManager(object):
     """
@@ -43,6 +44,18 @@ class PropertyManager(object):
 
     __properties = dict({})
     __lock = threading.Lock()
+    # the keys set or removed since the branch holding them was last dumped
+    __dirty = set()
+    __dirty_lock = threading.Lock()
+    # held by set and remove while they change the properties and by dump while it serialises them
+    __mutation_lock = threading.RLock()
+    # a flat index of dotted key to its parent branch and leaf, filled on lookup and invalidated by set and
+    # remove. The children of each dotted key in the index let its descendants be invalidated without a scan
+    _MISSING = object()
+    __index = {}
+    __index_children = {}
+    __index_generation = 0
+    __index_lock = threading.Lock()
 
     @singleton
     def __new__(cls):
@@ -60,17 +73,7 @@ class PropertyManager(object):
         """
         if key is None or not key:
             return False
-        find_dict = cls.__properties
-        is_path, _, is_key = key.rpartition('.')
-        if is_path:
-            for part in is_path.split('.'):
-                if isinstance(find_dict, dict):
-                    find_dict = find_dict.get(part, {})
-                else:
-                    break
-        if is_key in find_dict:
-            return True
-        return False
+        return cls._find(key) is not cls._MISSING
 
     @classmethod
     def get(cls, key: Any, default: Any=None) -> [object, str, dict, tuple, list, int, float]:
@@ -88,16 +91,10 @@ class PropertyManager(object):
         """
         if key is None or not key:
             return default
-        rtn_val = cls.__properties
-        for part in key.split('.'):
-            if isinstance(rtn_val, dict):
-                rtn_val = rtn_val.get(part)
-                if rtn_val is None:
-                    return default
-            else:
-                return default
-        with cls.__lock:
-            return rtn_val
+        rtn_val = cls._find(key)
+        if rtn_val is cls._MISSING or rtn_val is None:
+            return default
+        return rtn_val
 
     @classmethod
     def get_all(cls) -> dict:
@@ -118,41 +115,49 @@ class PropertyManager(object):
         """
         if key is None or not key or not isinstance(key, str):
             raise ValueError("The key must be a valid str")
-        keys = key.split('.')
-        _prop_branch = cls.__properties
-        _last_key = None
-        _last_prop_branch = None
-        # from base of the key work up to find where the section doesn't exist
-        for _, k in list(enumerate(keys)):
-            if k not in _prop_branch:
-                break
-            _last_prop_branch = _prop_branch
-            _last_key = k
-            _prop_branch = _prop_branch[k]
-        tmp_dict = {}
-        # now from the top of the key work back, creating the sections tree
-        k = None
-        for _, k in reversed(list(enumerate(keys))):
-            if isinstance(value, dict):
-                tmp_dict = {k: value}
-            else:
-                tmp_dict[k] = value
-            if k is _last_key:
-                break
-            value = tmp_dict
-        if not isinstance(value, dict):
-            if isinstance(_last_prop_branch[k], list):
-                if isinstance(value, list):
-                    _last_prop_branch[k] += value
+        # serialised with a dump taking the properties
+        with cls.__mutation_lock:
+            # an unchanged value is left clean, lists are appended to so always change
+            _existing = cls._find(key)
+            if not isinstance(_existing, list) and type(_existing) is type(value) and _existing == value:
+                return
+            keys = key.split('.')
+            _prop_branch = cls.__properties
+            _last_key = None
+            _last_prop_branch = None
+            # from base of the key work up to find where the section doesn't exist
+            for _, k in list(enumerate(keys)):
+                if k not in _prop_branch:
+                    break
+                _last_prop_branch = _prop_branch
+                _last_key = k
+                _prop_branch = _prop_branch[k]
+            tmp_dict = {}
+            # now from the top of the key work back, creating the sections tree
+            k = None
+            for _, k in reversed(list(enumerate(keys))):
+                if isinstance(value, dict):
+                    tmp_dict = {k: value}
+                else:
+                    tmp_dict[k] = value
+                if k is _last_key:
+                    break
+                value = tmp_dict
+            if not isinstance(value, dict):
+                if isinstance(_last_prop_branch[k], list):
+                    if isinstance(value, list):
+                        _last_prop_branch[k] += value
+                    else:
+                        _last_prop_branch[k].append(value)
                 else:
-                    _last_prop_branch[k].append(value)
+                    _last_prop_branch[k] = value
+            elif _last_prop_branch is None:
+                _prop_branch.update(value)
             else:
-                _last_prop_branch[k] = value
-            return
-        if _last_prop_branch is None:
-            _prop_branch.update(value)
-        else:
-            cls._add_value(k, value, _last_prop_branch)
+                cls._add_value(k, value, _last_prop_branch)
+            cls._index_invalidate(key)
+        # marked once changed, so a dump either holds the change or leaves it dirty
+        cls._mark_dirty(key)
         return
 
     @classmethod
@@ -166,20 +171,35 @@ class PropertyManager(object):
             True if the key was removed
             False if the key was not found
         """
-        del_dict = cls.__properties
-        del_path, _, del_key = key.rpartition('.')
-        if del_path:
-            for part in del_path.split('.'):
-                if isinstance(del_dict, dict):
-                    del_dict = del_dict.get(part)
-                else:
-                    return False
-        if del_dict is None or del_key not in del_dict:
-            return False
-        with cls.__lock:
-            _ = del_dict.pop(del_key, None)
+        with cls.__mutation_lock:
+            del_dict = cls.__properties
+            del_path, _, del_key = key.rpartition('.')
+            if del_path:
+                for part in del_path.split('.'):
+                    if isinstance(del_dict, dict):
+                        del_dict = del_dict.get(part)
+                    else:
+                        return False
+            if del_dict is None or del_key not in del_dict:
+                return False
+            with cls.__lock:
+                _ = del_dict.pop(del_key, None)
+        cls._index_invalidate(key)
+        cls._mark_dirty(key)
         return True
 
+    @classmethod
+    def is_dirty(cls, key: Any=None) -> bool:
+        """ identifies if the branch of the key has been set or removed since it was last dumped
+
+        :param key: (optional) the key of the branch. If None then any change in the properties
+        :return: True if a key in, above or below the branch has changed
+        """
+        with cls.__dirty_lock:
+            if key is None or not key:
+                return len(cls.__dirty) > 0
+            return any(d == key or d.startswith(f"{key}.") or key.startswith(f"{d}.") for d in cls.__dirty)
+
     @classmethod
     def load(cls, handler: AbstractPersistHandler, key: str=None, replace: bool=False,
              ignore_key_error: bool=None) -> bool:
@@ -196,11 +216,12 @@ class PropertyManager(object):
             raise ValueError("The handler must be a concrete implementation of AbstractPersistHandler")
         # if not _path.exists() or not _path.is_file():
         tbl = handler.load_canonical()
-        a_data = tbl['properties'].combine_chunks().to_pylist()[0]
-        cfg_dict = ast.literal_eval(a_data.decode('utf8'))
+        # the format is detected from the data, earlier contracts are the literal repr of the properties
+        cfg_dict = PropertySerialiser.loads(tbl['properties'].combine_chunks()[0].as_buffer())
         if replace:
             with cls.__lock:
                 cls.__properties.clear()
+            cls._index_invalidate()
         # Don't copy over the file meta data
         _ = cfg_dict.pop('config_meta', None)
         if isinstance(key, str):
@@ -215,6 +236,8 @@ class PropertyManager(object):
             cls.set(key, subset)
         elif replace:
             cls.__properties = cfg_dict
+            # the properties are those last dumped
+            cls._clear_dirty()
         else:
             for _key, _value in cfg_dict.items():
                 # only replace sections that have changed
@@ -222,7 +245,7 @@ class PropertyManager(object):
         return True
 
     @classmethod
-    def dump(cls, handler: AbstractPersistHandler, key: Any=None):
+    def dump(cls, handler: AbstractPersistHandler, key: Any=None, format_name: str=None, clear_dirty: bool=None):
         """ Dumps the current in-memory configuration to a persistence store.
         Note that this replaces existing content if the file exists. This is particularly
         important is only persisting a single root key.
@@ -232,7 +255,12 @@ class PropertyManager(object):
 
         :param handler: the handler to persist the configuration.
         :param key: An optional root key subset of the configuration values.
+        :param format_name: (optional) the serialisation format, 'literal', 'json' or 'binary'. Default is the
+                    environment variable HADRON_PM_FORMAT or 'literal'
+        :param clear_dirty: (optional) if the changes are cleared once dumped. Default is True, set to False when
+                    dumping to a store other than the one the changes are tracked against, such as a backup
         """
+        clear_dirty = clear_dirty if isinstance(clear_dirty, bool) else True
         if handler is None or not isinstance(handler, AbstractPersistHandler):
             raise ValueError("The handler must be a concrete implementation of AbstractPersistHandler")
         _time = str(datetime.now())
@@ -241,30 +269,45 @@ class PropertyManager(object):
             cls.set('config_meta.create', _time)
         cls.set('config_meta.modify', _time)
         cls.set('config_meta.release', ds_core.__version__)
-        # check we want to persist
-        if key is None:
-            with cls.__lock:
-                data = cls.__properties.copy()
-        else:
-            if not cls.is_key(key):
-                raise KeyError("The base key {} does not exist".format(key))
-            # from base of the key work up
-            keys = key.split('.')
-            _pointer = {}
-            data = _pointer
-            while len(keys) > 0:
-                _k = keys.pop(0)
-                _pointer[_k] = {}
-                _pointer = _pointer[_k]
-            _value = cls.get(key)
-            if isinstance(_value, str):
-                __pointer = _value
+        # cleared before the data is taken so a change made while persisting stays dirty
+        cleared = cls._clear_dirty(key) if clear_dirty else set()
+        try:
+            cls._dump(handler, key=key, format_name=format_name)
+        except BaseException:
+            if clear_dirty:
+                with cls.__dirty_lock:
+                    cls.__dirty.update(cleared)
+            raise
+        return
+
+    @classmethod
+    def _dump(cls, handler: AbstractPersistHandler, key: Any=None, format_name: str=None):
+        """ serialises the properties, or the branch of the key, and persists them with the handler """
+        format_name = format_name if isinstance(format_name, str) else os.environ.get('HADRON_PM_FORMAT')
+        # the properties can't change while they are taken and serialised, the persist is outside the lock
+        with cls.__mutation_lock:
+            if key is None:
+                with cls.__lock:
+                    data = cls.__properties.copy()
             else:
-                _pointer.update(cls.get(key))
-            data['config_meta'] = cls.get('config_meta')
+                if not cls.is_key(key):
+                    raise KeyError("The base key {} does not exist".format(key))
+                # from base of the key work up
+                keys = key.split('.')
+                _pointer = {}
+                data = _pointer
+                while len(keys) > 0:
+                    _k = keys.pop(0)
+                    _pointer[_k] = {}
+                    _pointer = _pointer[_k]
+                _value = cls.get(key)
+                if isinstance(_value, str):
+                    __pointer = _value
+                else:
+                    _pointer.update(cls.get(key))
+                data['config_meta'] = cls.get('config_meta')
 
-        # now build the canonical
-        enc = str(data).encode('utf8')
+            enc = PropertySerialiser.dumps(data, format_name=format_name)
         t_data = pa.table([pa.array([enc])], names=['properties'])
         handler.persist_canonical(t_data)
         return
@@ -284,6 +327,100 @@ class PropertyManager(object):
     def _remove_all(cls):
         with cls.__lock:
             cls.__properties.clear()
+        cls._index_invalidate()
+        cls._clear_dirty()
+
+    @classmethod
+    def _find(cls, key: str) -> Any:
+        """ returns the node of the dotted key, or _MISSING, using the flat index of the key to its parent
+        branch. Looking the leaf up in the parent keeps the index true to values changed in place. A key
+        without a parent branch isn't indexed as a set of any key on its path may create the branch.
+        """
+        entry = cls.__index.get(key)
+        if entry is None:
+            generation = cls.__index_generation
+            entry = cls._walk(key)
+            with cls.__index_lock:
+                # a set or remove during the walk may have made the entry stale
+                if entry[0] is not None and generation == cls.__index_generation:
+                    cls.__index[key] = entry
+                    parts = key.split('.')
+                    for i in range(1, len(parts)):
+                        cls.__index_children.setdefault('.'.join(parts[:i]), set()).add('.'.join(parts[:i + 1]))
+        parent, leaf = entry
+        if parent is None:
+            return cls._MISSING
+        return parent.get(leaf, cls._MISSING)
+
+    @classmethod
+    def _walk(cls, key: str) -> tuple:
+        """ returns the parent branch and leaf of the dotted key, walking the tree from the root. The parent
+        is None if the branch doesn't exist.
+        """
+        parent = cls.__properties
+        path, _, leaf = key.rpartition('.')
+        if path:
+            for part in path.split('.'):
+                parent = parent.get(part)
+                if not isinstance(parent, dict):
+                    return None, leaf
+        return parent, leaf
+
+    @classmethod
+    def _index_invalidate(cls, key: str=None):
+        """ removes the key, its ancestors and its descendants from the index, or everything if None """
+        with cls.__index_lock:
+            PropertyManager.__index_generation += 1
+            if key is None:
+                cls.__index.clear()
+                cls.__index_children.clear()
+                return
+            parts = key.split('.')
+            for i in range(1, len(parts)):
+                cls.__index.pop('.'.join(parts[:i]), None)
+            stack = [key]
+            while stack:
+                _key = stack.pop()
+                cls.__index.pop(_key, None)
+                stack.extend(cls.__index_children.pop(_key, ()))
+
+    @classmethod
+    def _mark_dirty(cls, key: str):
+        with cls.__dirty_lock:
+            # a changed branch already covers its sub-keys
+            parts = key.split('.')
+            for i in range(1, len(parts)):
+                if '.'.join(parts[:i]) in cls.__dirty:
+                    return
+            cls.__dirty.add(key)
+
+    @classmethod
+    def _clear_dirty(cls, key: str=None) -> set:
+        """ clears the changes in the branch of the key, or all changes if None, returning the changes before
+        the clear. A change above the branch may also have touched its sibling branches, so it is pushed down
+        onto those siblings """
+        with cls.__dirty_lock:
+            previous = set(cls.__dirty)
+            if key is None:
+                cls.__dirty.clear()
+                return previous
+            dirty = {d for d in cls.__dirty if not (d == key or d.startswith(f"{key}."))}
+            parts = key.split('.')
+            for i in range(1, len(parts)):
+                ancestor = '.'.join(parts[:i])
+                if ancestor not in dirty:
+                    continue
+                dirty.discard(ancestor)
+                node = cls.__properties
+                for depth, part in enumerate(parts[:-1]):
+                    node = node.get(part) if isinstance(node, dict) else None
+                    if not isinstance(node, dict):
+                        break
+                    if depth + 1 >= i:
+                        path = '.'.join(parts[:depth + 1])
+                        dirty.update(f"{path}.{k}" for k in node.keys() if k != parts[depth + 1])
+            cls.__dirty = dirty
+            return previous
 
     @classmethod
     def _add_value(cls, key, value, root):
@@ -0,0 +1,156 @@
+"""
+Copyright (C) 2024  Gigas64
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You will find a copy of this licenseIn the root directory of the project
+or you can visit <https://www.gnu.org/licenses/> For further information.
+"""
+
+import ast
+import json
+import marshal
+import threading
+from abc import ABC, abstractmethod
+
+
+class AbstractPropertySerialiser(ABC):
+    """ Serialises the property tree to and from bytes. A serialiser has a unique format NAME and a VERSION that
+    is written in the header of its output and passed back to loads, so a format can change without breaking
+    contracts written by an earlier version.
+    """
+
+    NAME: str = None
+    VERSION: int = 1
+
+    @abstractmethod
+    def dumps(self, data: dict) -> bytes:
+        """ serialises the property tree """
+
+    @abstractmethod
+    def loads(self, data: [bytes, memoryview], version: int) -> dict:
+        """ deserialises a property tree written with the given format version """
+
+
+class LiteralPropertySerialiser(AbstractPropertySerialiser):
+    """ The original Python literal repr format, read with ast.literal_eval. It has no header """
+
+    NAME = 'literal'
+
+    def dumps(self, data: dict) -> bytes:
+        return str(data).encode('utf8')
+
+    def loads(self, data: [bytes, memoryview], version: int) -> dict:
+        return ast.literal_eval(bytes(data).decode('utf8'))
+
+
+class JsonPropertySerialiser(AbstractPropertySerialiser):
+    """ A JSON format, readable by other languages. Tuples are loaded back as lists """
+
+    NAME = 'json'
+
+    def dumps(self, data: dict) -> bytes:
+        return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf8')
+
+    def loads(self, data: [bytes, memoryview], version: int) -> dict:
+        return json.loads(bytes(data))
+
+
+class BinaryPropertySerialiser(AbstractPropertySerialiser):
+    """ A compact binary format using marshal, which round trips exactly the literal types of the repr format,
+    including tuples, sets and bytes. Python doesn't promise a stable marshal format between interpreter versions
+    and marshal isn't safe against untrusted data, so it is an opt-in for contracts written and read by the same
+    trusted deployment.
+    """
+
+    NAME = 'binary'
+    MARSHAL_VERSION = 4
+
+    def dumps(self, data: dict) -> bytes:
+        return marshal.dumps(data, self.MARSHAL_VERSION)
+
+    def loads(self, data: [bytes, memoryview], version: int) -> dict:
+        return marshal.loads(data)
+
+
+class PropertySerialiser(object):
+    """ The registry of property serialisers. Output is prefixed with a header of the MAGIC bytes, the format
+    name and its version so loads can detect the format. Data without the header is read as the literal repr
+    format of earlier releases, which is also the default format so earlier releases can read the contracts.
+    """
+
+    MAGIC = b'\x00HPM'
+    DEFAULT_FORMAT = 'literal'
+
+    _serialisers: dict = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def register(cls, serialiser: AbstractPropertySerialiser):
+        """ registers a serialiser by its NAME, replacing any existing serialiser of that name
+
+        :param serialiser: an instance of a concrete AbstractPropertySerialiser
+        """
+        if not isinstance(serialiser, AbstractPropertySerialiser):
+            raise TypeError("The serialiser must be a concrete implementation of AbstractPropertySerialiser")
+        if not isinstance(serialiser.NAME, str) or not 0 < len(serialiser.NAME.encode('ascii')) < 256:
+            raise ValueError("The serialiser NAME must be an ascii string of 1 to 255 characters")
+        with cls._lock:
+            PropertySerialiser._serialisers[serialiser.NAME] = serialiser
+
+    @classmethod
+    def formats(cls) -> list:
+        """ returns the registered format names """
+        return list(cls._serialisers.keys())
+
+    @classmethod
+    def get(cls, name: str) -> AbstractPropertySerialiser:
+        if name not in cls._serialisers:
+            raise LookupError(f"The property format '{name}' is not registered, options are {cls.formats()}")
+        return cls._serialisers[name]
+
+    @classmethod
+    def dumps(cls, data: dict, format_name: str=None) -> bytes:
+        """ serialises the property tree with a header identifying the format. The literal format is written
+        without a header, as earlier releases expect.
+
+        :param data: the property tree
+        :param format_name: (optional) the registered format name. Default DEFAULT_FORMAT
+        :return: the serialised bytes
+        """
+        format_name = format_name if isinstance(format_name, str) else cls.DEFAULT_FORMAT
+        serialiser = cls.get(format_name)
+        if format_name == LiteralPropertySerialiser.NAME:
+            return serialiser.dumps(data)
+        name = serialiser.NAME.encode('ascii')
+        header = cls.MAGIC + bytes([len(name)]) + name + serialiser.VERSION.to_bytes(2, 'little')
+        return header + serialiser.dumps(data)
+
+    @classmethod
+    def loads(cls, data: [bytes, memoryview]) -> dict:
+        """ deserialises the property tree, detecting the format from the header
+
+        :param data: the serialised bytes
+        :return: the property tree
+        """
+        data = memoryview(data)
+        if bytes(data[:len(cls.MAGIC)]) != cls.MAGIC:
+            return cls.get(LiteralPropertySerialiser.NAME).loads(data, version=1)
+        offset = len(cls.MAGIC)
+        size = data[offset]
+        name = bytes(data[offset + 1:offset + 1 + size]).decode('ascii')
+        offset += 1 + size
+        version = int.from_bytes(data[offset:offset + 2], 'little')
+        return cls.get(name).loads(data[offset + 2:], version=version)
+
+
+for _serialiser in [LiteralPropertySerialiser(), JsonPropertySerialiser(), BinaryPropertySerialiser()]:
+    PropertySerialiser.register(_serialiser)
@@ -1,13 +1,21 @@
 import unittest
+import asyncio
 import os
 import shutil
+import threading
+import time
 from datetime import datetime
 from pprint import pprint
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import Future
+from unittest import mock
 
-from ds_core.components.abstract_component import AbstractComponent
+from ds_core.components.abstract_component import AbstractComponent, CanonicalCache
 from ds_core.handlers.abstract_handlers import ConnectorContract
+from ds_core.handlers.base_handlers import BasePersistHandler
 from ds_core.properties.abstract_properties import AbstractPropertyManager
 from test.intent.pyarrow_intent_model import PyarrowIntentModel
 from ds_core.properties.property_manager import PropertyManager
@@ -22,6 +30,10 @@ class ControlPropertyManager(AbstractPropertyManager):
         creator = creator if isinstance(creator, str) else 'Control'
         super().__init__(task_name=task_name, root_keys=root_keys, knowledge_keys=knowledge_keys, creator=creator)
 
+    @staticmethod
+    def get_pkg_root():
+        return 'test'
+
 
 class ControlComponent(AbstractComponent):
 
@@ -37,6 +49,10 @@ class ControlComponent(AbstractComponent):
                          template_source_handler=template_source_handler,
                          template_persist_handler=template_persist_handler, align_connectors=align_connectors)
 
+    @staticmethod
+    def get_pkg_root():
+        return 'test'
+
     @classmethod
     def from_uri(cls, task_name: str, uri_pm_path: str, creator: str, uri_pm_repo: str=None, pm_file_type: str=None,
                  pm_module: str=None, pm_handler: str=None, pm_kwargs: dict=None, default_save=None,
@@ -452,6 +468,185 @@ class AbstractComponentTest(unittest.TestCase):
         manager.add_run_book_level(book_name='Default', run_level='One')
         self.assertEqual(['Two', 'Three', 'One'], manager.pm.get_run_book('Default'))
 
+    def test_persist_asynchronous(self):
+        manager = ControlComponent.from_env('task', has_contract=False)
+        manager.add_connector_uri(connector_name='persist', uri='work/async.parquet')
+        tbl = pa.table({'id': list(range(10))})
+        futures = [manager.persist_canonical('persist', tbl.slice(0, n), asynchronous=True) for n in range(1, 11)]
+        self.assertTrue(all(isinstance(f, Future) for f in futures))
+        manager.flush()
+        self.assertTrue(all(f.done() for f in futures))
+        # persists to the same connector are written in order
+        self.assertEqual(10, manager.load_canonical('persist').num_rows)
+        self.assertEqual(['async.parquet'], os.listdir('work'))
+        # errors surface at the barrier
+        manager.persist_canonical('persist', tbl, asynchronous=True, file_type='unknown')
+        with self.assertRaises(LookupError):
+            manager.flush()
+        manager.flush()
+
+    def test_flush_barrier(self):
+        manager = ControlComponent.from_env('task', has_contract=False)
+        manager.add_connector_uri(connector_name='slow', uri='work/slow.parquet')
+        manager.add_connector_uri(connector_name='fail', uri='work/fail.parquet')
+        tbl = pa.table({'id': list(range(10))})
+        release = threading.Event()
+        persist = BasePersistHandler.persist_canonical
+
+        def slow_persist(handler, canonical, **kwargs):
+            if handler.connector_contract.uri.endswith('slow.parquet'):
+                release.wait(5)
+            return persist(handler, canonical, **kwargs)
+
+        with mock.patch.object(BasePersistHandler, 'persist_canonical', slow_persist):
+            slow = manager.persist_canonical('slow', tbl, asynchronous=True)
+            manager.persist_canonical('fail', tbl, asynchronous=True, file_type='unknown')
+            threading.Timer(0.2, release.set).start()
+            # the failure is raised only once every persist has completed
+            with self.assertRaises(LookupError):
+                manager.flush()
+            self.assertTrue(slow.done())
+        self.assertTrue(os.path.exists('work/slow.parquet'))
+
+    def test_asyncio(self):
+        manager = ControlComponent.from_env('task', has_contract=False)
+        tbl = pa.table({'id': list(range(10))})
+        for i in range(20):
+            manager.add_connector_uri(connector_name=f'persist_{i}', uri=f'work/async_{i}.parquet')
+
+        async def run():
+            await asyncio.gather(*[manager.apersist_canonical(f'persist_{i}', tbl) for i in range(20)])
+            self.assertTrue(all(await asyncio.gather(*[manager.aexists(f'persist_{i}') for i in range(20)])))
+            self.assertTrue(await manager.ahas_changed('persist_0'))
+            return await asyncio.gather(*[manager.aload_canonical(f'persist_{i}', columns=['id']) for i in range(20)])
+        self.assertEqual([tbl] * 20, asyncio.run(run()))
+        # the source checks are run off the event loop
+        threads = []
+        source_state = BasePersistHandler.source_state
+
+        def record_thread(handler):
+            threads.append(threading.current_thread())
+            return source_state(handler)
+
+        async def run_checks():
+            with mock.patch.object(BasePersistHandler, 'source_state', record_thread):
+                first = await manager.aload_canonical('persist_0', cache=True)
+                self.assertIs(first, await manager.aload_canonical('persist_0', cache=True))
+                self.assertEqual({}, await manager.aload_canonical('persist_0', has_changed=True, return_empty=True))
+        asyncio.run(run_checks())
+        self.assertGreater(len(threads), 0)
+        self.assertNotIn(threading.main_thread(), threads)
+        manager.canonical_cache().clear()
+
+    def test_canonical_cache(self):
+        manager = ControlComponent.from_env('task', has_contract=False)
+        manager.add_connector_uri(connector_name='persist', uri='work/cached.parquet')
+        cache = manager.canonical_cache()
+        cache.clear()
+        tbl = pa.table({'id': list(range(10))})
+        manager.persist_canonical('persist', tbl)
+        first = manager.load_canonical('persist', cache=True)
+        self.assertIs(first, manager.load_canonical('persist', cache=True))
+        self.assertEqual({'hits': 1, 'misses': 1}, {k: cache.stats()[k] for k in ['hits', 'misses']})
+        self.assertEqual(first.nbytes, cache.nbytes)
+        # load arguments are part of the key
+        self.assertEqual(['id'], manager.load_canonical('persist', cache=True, columns=['id']).column_names)
+        self.assertEqual(2, cache.misses)
+        # invalidated by a change to the source
+        pq.write_table(tbl.slice(5), 'work/cached.parquet')
+        stat = os.stat('work/cached.parquet')
+        os.utime('work/cached.parquet', (stat.st_atime + 10, stat.st_mtime + 10))
+        self.assertEqual(5, manager.load_canonical('persist', cache=True).num_rows)
+        self.assertEqual(3, cache.misses)
+        # invalidated by a persist
+        manager.persist_canonical('persist', tbl)
+        self.assertEqual(10, manager.load_canonical('persist', cache=True).num_rows)
+        self.assertEqual(4, cache.misses)
+        # a change seen by another load is not lost to the cached entries
+        manager.load_canonical('persist', cache=True, columns=['id'])
+        pq.write_table(tbl.slice(4), 'work/cached.parquet')
+        stat = os.stat('work/cached.parquet')
+        os.utime('work/cached.parquet', (stat.st_atime + 20, stat.st_mtime + 20))
+        manager.load_canonical('persist', has_changed=True)
+        self.assertEqual(6, manager.load_canonical('persist', cache=True).num_rows)
+        self.assertEqual(6, manager.load_canonical('persist', cache=True, columns=['id']).num_rows)
+        # size bounded
+        small = CanonicalCache(max_bytes=tbl.nbytes * 2)
+        handler = manager.pm.get_connector_handler('persist')
+        for i in range(3):
+            small.put(('cc', i), handler, tbl, handler.source_state())
+        self.assertEqual(tbl.nbytes * 2, small.nbytes)
+        self.assertIsNone(small.get(('cc', 0)))
+        self.assertIs(tbl, small.get(('cc', 2)))
+        cache.clear()
+
+    def test_canonical_cache_slow_source(self):
+        cache = CanonicalCache()
+        tbl = pa.table({'id': list(range(10))})
+        started, release = threading.Event(), threading.Event()
+        slow = mock.Mock()
+        slow.source_state.side_effect = lambda: (started.set(), release.wait(5), 'state')[2]
+        fast = mock.Mock()
+        fast.source_state.return_value = 'state'
+        cache.put(('slow',), slow, tbl, 'state')
+        cache.put(('fast',), fast, tbl, 'state')
+        result = {}
+        thread = threading.Thread(target=lambda: result.update(slow=cache.get(('slow',))))
+        thread.start()
+        self.assertTrue(started.wait(5))
+        # a lookup isn't held up by another source's state
+        start = time.monotonic()
+        self.assertIs(tbl, cache.get(('fast',)))
+        self.assertLess(time.monotonic() - start, 1)
+        release.set()
+        thread.join(5)
+        self.assertIs(tbl, result['slow'])
+        self.assertEqual(2, cache.hits)
+
+    def test_reuse_schema(self):
+        manager = ControlComponent.from_env('task', has_contract=False)
+        os.makedirs('work', exist_ok=True)
+        with open('work/types.csv', 'w') as f:
+            f.write('id,code\n1,007\n2,010\n')
+        manager.add_connector_uri(connector_name='source', uri='work/types.csv', reuse_schema=True)
+        tbl = manager.load_canonical('source')
+        self.assertEqual({'id': 'int64', 'code': 'int64'}, manager.pm.get_canonical_schema('source'))
+        # a resolved schema replaces the inferred one
+        manager.pm.set_canonical_schema('source', {'id': 'int32', 'code': 'string'})
+        tbl = manager.load_canonical('source')
+        self.assertEqual(pa.schema([('id', pa.int32()), ('code', pa.string())]), tbl.schema)
+        self.assertEqual(['007', '010'], tbl.column('code').to_pylist())
+        # a source that no longer converts is re-inferred
+        with open('work/types.csv', 'w') as f:
+            f.write('id,code\n1.5,007\n')
+        tbl = manager.load_canonical('source')
+        self.assertEqual(pa.float64(), tbl.schema.field('id').type)
+        self.assertEqual({'id': 'double', 'code': 'int64'}, manager.pm.get_canonical_schema('source'))
+        # nested types are left to the source
+        nested = pa.table({'id': [1, 2], 'tags': [[1], [2, 3]], 'info': [{'a': 1}, {'a': 2}]})
+        pq.write_table(nested, 'work/nested.parquet')
+        manager.add_connector_uri(connector_name='nested', uri='work/nested.parquet', reuse_schema=True)
+        self.assertEqual(nested, manager.load_canonical('nested'))
+        self.assertEqual({'id': 'int64'}, manager.pm.get_canonical_schema('nested'))
+        self.assertEqual(nested, manager.load_canonical('nested'))
+        # a recorded schema that can't be read is dropped
+        manager.pm.set_canonical_schema('nested', {'tags': 'list<element: int64>'})
+        self.assertEqual(nested, manager.load_canonical('nested'))
+        self.assertEqual({'id': 'int64'}, manager.pm.get_canonical_schema('nested'))
+
+    def test_pm_batch(self):
+        manager = ControlComponent.from_env('task', has_contract=False)
+        with manager.pm_batch():
+            manager.add_connector_uri(connector_name='source', uri='work/source.csv')
+            manager.add_connector_uri(connector_name='persist', uri='work/persist.parquet')
+        self.assertTrue(manager.pm.has_connector('source'))
+        with self.assertRaises(KeyError):
+            with manager.pm_batch():
+                manager.add_connector_uri(connector_name='other', uri='work/other.csv')
+                raise KeyError('rollback')
+        self.assertFalse(manager.pm.has_connector('other'))
+        self.assertTrue(manager.pm.has_connector('persist'))
+
     def test_template_aligned(self):
         os.environ['HADRON_DEFAULT_PATH'] = 'data/store'
         os.environ['HADRON_OTHER_FILE'] = 'data/store/my_other.csv'
@@ -0,0 +1,405 @@
+import unittest
+import asyncio
+import os
+import shutil
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from unittest import mock
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from ds_core.handlers.abstract_handlers import ConnectorContract
+from ds_core.handlers.base_handlers import BaseSourceHandler, BasePersistHandler, HttpCache
+
+
+class BaseHandlersTest(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs('working', exist_ok=True)
+
+    def tearDown(self):
+        try:
+            shutil.rmtree('working')
+        except OSError:
+            pass
+
+    def test_runs(self):
+        """Basic smoke test"""
+        cc = ConnectorContract('working/example.parquet', 'ds_core.handlers.base_handlers', 'BasePersistHandler')
+        BasePersistHandler(cc)
+
+    def test_persist_load(self):
+        tbl = get_table()
+        for file_type in ['parquet', 'csv', 'arrow', 'feather', 'ipc']:
+            cc = ConnectorContract(f'working/example.{file_type}', 'module_name', 'handler')
+            handler = BasePersistHandler(cc)
+            handler.persist_canonical(tbl)
+            self.assertTrue(handler.exists())
+            result = BaseSourceHandler(cc).load_canonical()
+            self.assertEqual(tbl.shape, result.shape)
+            self.assertTrue(handler.remove_canonical())
+            self.assertFalse(handler.exists())
+
+    def test_stream(self):
+        tbl = get_table()
+        for file_type in ['parquet', 'csv', 'arrow']:
+            cc = ConnectorContract(f'working/example.{file_type}', 'module_name', 'handler')
+            BasePersistHandler(cc).persist_canonical(tbl)
+            reader = BaseSourceHandler(cc).load_canonical(stream=True, batch_size=3)
+            self.assertIsInstance(reader, pa.RecordBatchReader)
+            batches = list(reader)
+            self.assertEqual(7, sum(b.num_rows for b in batches))
+            self.assertEqual(tbl.column_names, batches[0].schema.names)
+        # parquet honours the batch size
+        cc = ConnectorContract('working/example.parquet', 'module_name', 'handler')
+        batches = list(BaseSourceHandler(cc).load_canonical(stream=True, batch_size=3))
+        self.assertEqual([3, 3, 1], [b.num_rows for b in batches])
+
+    def test_columns_filter(self):
+        tbl = get_table()
+        for file_type in ['parquet', 'csv', 'arrow']:
+            cc = ConnectorContract(f'working/example.{file_type}', 'module_name', 'handler')
+            BasePersistHandler(cc).persist_canonical(tbl)
+            handler = BaseSourceHandler(cc)
+            result = handler.load_canonical(columns=['int', 'text'])
+            self.assertEqual(['int', 'text'], result.column_names)
+            self.assertEqual(7, result.num_rows)
+            result = handler.load_canonical(columns=['int'], filter=[('int', '>', 4)])
+            self.assertEqual([5, 6, 7], result.column('int').to_pylist())
+            result = handler.load_canonical(filter=pc.field('int') <= 2)
+            self.assertEqual(tbl.column_names, result.column_names)
+            self.assertEqual(2, result.num_rows)
+            reader = handler.load_canonical(columns=['int'], filter=[('int', '>', 4)], stream=True)
+            self.assertEqual(3, reader.read_all().num_rows)
+        # from the connector contract kwargs
+        cc = ConnectorContract('working/example.parquet', 'module_name', 'handler', columns=['num'],
+                               filter=[[('int', '=', 1)], [('int', '=', 7)]])
+        result = BaseSourceHandler(cc).load_canonical()
+        self.assertEqual({'num': [1.0, -2.0]}, result.to_pydict())
+        # parquet row groups are skipped
+        cc = ConnectorContract('working/example.parquet', 'module_name', 'handler')
+        BasePersistHandler(cc).persist_canonical(tbl, write_params={'row_group_size': 2})
+        reader = BaseSourceHandler(cc).load_canonical(filter=[('int', '>=', 7)], stream=True)
+        self.assertEqual([1], [b.num_rows for b in reader if b.num_rows > 0])
+
+    def test_csv_nested(self):
+        tbl = pa.table({'list': pa.array([[1, 2], None, [3, None]]),
+                        'struct': pa.array([{'a': 1, 'b': 'x'}, None, {'a': None, 'b': 'y'}]),
+                        'map': pa.array([[('k', 1)], None, []], pa.map_(pa.string(), pa.int64())),
+                        'cat': pa.array(['M', None, 'F']).dictionary_encode()})
+        cc = ConnectorContract('working/nested.csv', 'module_name', 'handler')
+        BasePersistHandler(cc).persist_canonical(pa.concat_tables([tbl.slice(0, 1), tbl.slice(1)]))
+        result = BaseSourceHandler(cc).load_canonical()
+        # null strings are read back as empty
+        self.assertEqual(['[1, 2]', '', '[3, null]'], result.column('list').to_pylist())
+        self.assertEqual(['{"a": 1, "b": "x"}', '', '{"a": null, "b": "y"}'], result.column('struct').to_pylist())
+        self.assertEqual(['{"k": 1}', '', '{}'], result.column('map').to_pylist())
+        self.assertEqual(['M', '', 'F'], result.column('cat').to_pylist())
+
+    def test_column_types(self):
+        with open('working/types.csv', 'w') as f:
+            f.write('id,code,when,cat\n1,007,2023-01-02 04:49:06Z,M\n2,010,2023-01-03 00:00:00Z,F\n')
+        cc = ConnectorContract('working/types.csv', 'module_name', 'handler')
+        handler = BaseSourceHandler(cc)
+        self.assertEqual(pa.int64(), handler.load_canonical().schema.field('code').type)
+        column_types = {'id': 'int8', 'code': pa.string(), 'when': 'timestamp[ns, tz=UTC]',
+                        'cat': 'dictionary<values=string, indices=int32, ordered=0>'}
+        for kwargs in [{}, {'stream': True}, {'columns': ['code', 'cat']}]:
+            result = handler.load_canonical(column_types=column_types, **kwargs)
+            if isinstance(result, pa.RecordBatchReader):
+                result = result.read_all()
+            self.assertEqual(['007', '010'], result.column('code').to_pylist())
+            self.assertTrue(pa.types.is_dictionary(result.schema.field('cat').type))
+        result = handler.load_canonical(column_types=column_types)
+        self.assertEqual(pa.int8(), result.schema.field('id').type)
+        self.assertEqual(pa.timestamp('ns', tz='UTC'), result.schema.field('when').type)
+
+    def test_ipc_memory_map(self):
+        tbl = pa.table({'num': pa.array(range(1_000_000), pa.int64())})
+        cc = ConnectorContract('working/example.arrow', 'module_name', 'handler')
+        BasePersistHandler(cc).persist_canonical(tbl)
+        before = pa.total_allocated_bytes()
+        result = BaseSourceHandler(cc).load_canonical()
+        # the buffers reference the mapped file so nothing is allocated
+        self.assertLess(pa.total_allocated_bytes() - before, tbl.nbytes)
+        self.assertTrue(tbl.equals(result))
+        # dictionaries round trip
+        tbl = get_table()
+        BasePersistHandler(cc).persist_canonical(tbl)
+        self.assertTrue(tbl.equals(BaseSourceHandler(cc).load_canonical()))
+
+    def test_partitioned(self):
+        day1 = pa.table({'day': [1, 1, 1], 'region': ['N', 'S', 'E'], 'value': [1.0, 2.0, 3.0]})
+        day2 = pa.table({'day': [2, 2], 'region': ['N', 'S'], 'value': [4.0, 5.0]})
+        for file_type in ['parquet', 'arrow', 'csv']:
+            uri = f'working/sales_{file_type}'
+            cc = ConnectorContract(uri, 'module_name', 'handler', file_type=file_type, partition_cols=['day'])
+            handler = BasePersistHandler(cc)
+            handler.persist_canonical(day1, file_type=file_type)
+            handler.persist_canonical(day2, file_type=file_type)
+            self.assertTrue(os.path.isdir(os.path.join(uri, 'day=1')))
+            self.assertTrue(os.path.isdir(os.path.join(uri, 'day=2')))
+            result = handler.load_canonical().sort_by('value')
+            self.assertEqual(5, result.num_rows)
+            # replace only one partition
+            self.assertTrue(handler.has_changed())
+            handler.reset_changed()
+            handler.persist_canonical(pa.table({'day': [2], 'region': ['W'], 'value': [9.0]}), file_type=file_type)
+            self.assertTrue(handler.has_changed())
+            result = handler.load_canonical().sort_by('value')
+            self.assertEqual([1.0, 2.0, 3.0, 9.0], result.column('value').to_pylist())
+            # prune on read
+            result = handler.load_canonical(filter=[('day', '=', 1)], columns=['region'])
+            self.assertEqual(['E', 'N', 'S'], sorted(result.column('region').to_pylist()))
+            self.assertTrue(handler.remove_canonical())
+            self.assertFalse(handler.exists())
+        # the existing data behavior can be set in the contract
+        cc = ConnectorContract('working/sales_error', 'module_name', 'handler', partition_cols=['day'],
+                               existing_data_behavior='error')
+        handler = BasePersistHandler(cc)
+        handler.persist_canonical(day1)
+        with self.assertRaises(pa.ArrowInvalid):
+            handler.persist_canonical(day2)
+
+    def test_fingerprint(self):
+        tbl = get_table()
+        for file_type in ['parquet', 'csv']:
+            cc = ConnectorContract(f'working/example.{file_type}', 'module_name', 'handler', fingerprint=True)
+            BasePersistHandler(cc).persist_canonical(tbl)
+            handler = BaseSourceHandler(cc)
+            self.assertTrue(handler.has_changed())
+            self.assertEqual(7, handler.load_canonical().num_rows)
+            self.assertFalse(handler.has_changed())
+            # rewritten with the same content
+            BasePersistHandler(cc).persist_canonical(tbl)
+            stat = os.stat(cc.address)
+            os.utime(cc.address, (stat.st_atime + 10, stat.st_mtime + 10))
+            self.assertFalse(handler.has_changed())
+            # rewritten with different content
+            BasePersistHandler(cc).persist_canonical(tbl.slice(1))
+            self.assertTrue(handler.has_changed())
+        # a directory
+        cc = ConnectorContract('working', 'module_name', 'handler', fingerprint=True)
+        handler = BaseSourceHandler(cc)
+        self.assertTrue(handler.has_changed())
+        handler.reset_changed()
+        shutil.copy('working/example.csv', 'working/copy.csv')
+        self.assertTrue(handler.has_changed())
+        handler.reset_changed()
+        shutil.copy('working/example.csv', 'working/copy.csv')
+        self.assertFalse(handler.has_changed())
+
+    def test_fingerprint_bounded(self):
+        paths = []
+        for i in range(3):
+            paths.append(os.path.abspath(f'working/file_{i}.csv'))
+            with open(paths[-1], 'w') as f:
+                f.write(f'a\n{i}\n')
+        with mock.patch.object(BaseSourceHandler, 'FINGERPRINT_CACHE_SIZE', 2):
+            for path in paths:
+                BaseSourceHandler._fingerprint(path)
+            # the least recently used is removed
+            self.assertNotIn(paths[0], BaseSourceHandler._fingerprints)
+            self.assertIn(paths[2], BaseSourceHandler._fingerprints)
+            self.assertLessEqual(len(BaseSourceHandler._fingerprints), 2)
+
+    def test_asyncio(self):
+        tbl = get_table()
+        cc = ConnectorContract('working/example.parquet', 'module_name', 'handler')
+        in_handler = BasePersistHandler(cc)
+
+        async def run(handlers: list):
+            await in_handler.apersist_canonical(tbl)
+            self.assertTrue(all(await asyncio.gather(*[h.aexists() for h in handlers])))
+            self.assertTrue(all(await asyncio.gather(*[h.ahas_changed() for h in handlers])))
+            return await asyncio.gather(*[h.aload_canonical(columns=['int']) for h in handlers])
+        results = asyncio.run(run([BaseSourceHandler(cc) for _ in range(100)]))
+        self.assertEqual([tbl.select(['int'])] * 100, results)
+        # remote
+        with LocalServer('working') as server:
+            cc = ConnectorContract(f'{server.url}/example.parquet', 'module_name', 'handler')
+            handler = BaseSourceHandler(cc)
+            self.assertTrue(asyncio.run(handler.aexists()))
+            self.assertTrue(tbl.equals(asyncio.run(handler.aload_canonical())))
+
+    def test_multi_file(self):
+        os.makedirs('working/shards', exist_ok=True)
+        for i in range(6):
+            tbl = pa.table({'id': list(range(i * 10, i * 10 + 10)), 'value': [float(i)] * 10})
+            if i == 5:
+                # schema drift in a later shard
+                tbl = tbl.append_column('extra', pa.array(['x'] * 10))
+            cc = ConnectorContract(f'working/shards/part_{i}.csv', 'module_name', 'handler')
+            BasePersistHandler(cc).persist_canonical(tbl)
+        for uri in ['working/shards/*.csv', 'working/shards']:
+            cc = ConnectorContract(uri, 'module_name', 'handler', max_workers=3)
+            handler = BaseSourceHandler(cc)
+            self.assertTrue(handler.exists())
+            self.assertTrue(handler.has_changed())
+            result = handler.load_canonical()
+            self.assertEqual((60, 3), result.shape)
+            self.assertEqual(list(range(60)), result.column('id').to_pylist())
+            self.assertEqual(10, result.column('extra').null_count - 40)
+            result = handler.load_canonical(columns=['id'], filter=[('value', '>=', 4.0)])
+            self.assertEqual(20, result.num_rows)
+            reader = handler.load_canonical(stream=True)
+            self.assertEqual((60, 3), reader.read_all().shape)
+        # errors are collected not fail fast
+        with open('working/shards/part_3.csv', 'w') as f:
+            f.write('id,value\n1,2,3,4\n')
+        with open('working/shards/part_4.csv', 'w') as f:
+            f.write('id\n1,2\n')
+        handler = BaseSourceHandler(ConnectorContract('working/shards/*.csv', 'module_name', 'handler'))
+        with self.assertRaises(IOError) as context:
+            handler.load_canonical()
+        self.assertTrue("2 of 6 files failed to load" in str(context.exception))
+        self.assertEqual(['working/shards/part_3.csv', 'working/shards/part_4.csv'], sorted(handler.load_errors))
+        result = handler.load_canonical(ignore_errors=True)
+        self.assertEqual(40, result.num_rows)
+        self.assertEqual(2, len(handler.load_errors))
+        handler = BaseSourceHandler(ConnectorContract('working/shards/*.parquet', 'module_name', 'handler'))
+        self.assertFalse(handler.exists())
+
+    def test_glob_characters(self):
+        tbl = get_table()
+        # an existing file is read as is, not as a pattern
+        cc = ConnectorContract('working/report[2024].parquet', 'module_name', 'handler')
+        BasePersistHandler(cc).persist_canonical(tbl)
+        handler = BaseSourceHandler(cc)
+        self.assertTrue(handler.exists())
+        self.assertEqual(tbl.num_rows, handler.load_canonical().num_rows)
+
+    def test_http(self):
+        tbl = get_table()
+        for file_type in ['parquet', 'csv', 'arrow']:
+            BasePersistHandler(ConnectorContract(f'working/remote.{file_type}', 'module_name', 'handler')
+                               ).persist_canonical(tbl)
+        with LocalServer('working') as server:
+            for file_type in ['parquet', 'csv', 'arrow']:
+                cc = ConnectorContract(f'{server.url}/remote.{file_type}', 'module_name', 'handler')
+                handler = BaseSourceHandler(cc)
+                self.assertTrue(handler.exists())
+                self.assertTrue(handler.has_changed())
+                result = handler.load_canonical()
+                self.assertEqual(tbl.shape, result.shape)
+                result = handler.load_canonical(columns=['int'], filter=[('int', '>', 5)])
+                self.assertEqual([6, 7], result.column('int').to_pylist())
+                reader = handler.load_canonical(stream=True)
+                self.assertEqual(7, reader.read_all().num_rows)
+            cc = ConnectorContract(f'{server.url}/none.csv', 'module_name', 'handler')
+            self.assertFalse(BaseSourceHandler(cc).exists())
+            # existence and change checks are a single cached HEAD request
+            BaseSourceHandler.http_head_clear()
+            del server.commands[:]
+            cc = ConnectorContract(f'{server.url}/remote.parquet', 'module_name', 'handler')
+            handler = BaseSourceHandler(cc)
+            for _ in range(3):
+                self.assertTrue(handler.exists())
+                self.assertTrue(handler.has_changed())
+            self.assertEqual(['HEAD'], server.commands)
+            BaseSourceHandler.http_head_clear(cc.address)
+            self.assertTrue(handler.exists())
+            self.assertEqual(['HEAD', 'HEAD'], server.commands)
+            # bounded to the least recently used addresses, expired entries purged on insert
+            BaseSourceHandler.http_head_clear()
+            with mock.patch.object(BaseSourceHandler, 'HTTP_HEAD_CACHE_SIZE', 2):
+                for file_type in ['parquet', 'csv', 'arrow']:
+                    BaseSourceHandler.http_head(f'{server.url}/remote.{file_type}')
+                self.assertEqual([f'{server.url}/remote.csv', f'{server.url}/remote.arrow'],
+                                 list(BaseSourceHandler._http_head_cache.keys()))
+            with mock.patch.object(BaseSourceHandler, 'HTTP_HEAD_TTL', 0):
+                BaseSourceHandler.http_head(f'{server.url}/remote.parquet')
+                self.assertEqual([f'{server.url}/remote.parquet'], list(BaseSourceHandler._http_head_cache.keys()))
+            BaseSourceHandler.http_head_clear()
+        # connections are pooled and kept alive across handlers
+        self.assertLess(len(set(server.client_ports)), len(server.client_ports) / 2)
+
+    def test_http_cache(self):
+        tbl = get_table()
+        cc = ConnectorContract('working/remote.arrow', 'module_name', 'handler')
+        BasePersistHandler(cc).persist_canonical(tbl)
+        cache = HttpCache(path='working/cache')
+        BaseSourceHandler._http_cache = cache
+        try:
+            with LocalServer('working') as server:
+                cc = ConnectorContract(f'{server.url}/remote.arrow', 'module_name', 'handler', http_cache=True)
+                handler = BaseSourceHandler(cc)
+                self.assertTrue(tbl.equals(handler.load_canonical()))
+                self.assertEqual(200, server.status_codes[-1])
+                # unchanged so revalidated and read from disk
+                self.assertTrue(tbl.equals(handler.load_canonical()))
+                self.assertEqual(304, server.status_codes[-1])
+                # a changed source is downloaded again
+                BasePersistHandler(ConnectorContract('working/remote.arrow', 'module_name', 'handler')
+                                   ).persist_canonical(tbl.slice(0, 3))
+                stat = os.stat('working/remote.arrow')
+                os.utime('working/remote.arrow', (stat.st_atime + 10, stat.st_mtime + 10))
+                self.assertEqual(3, handler.load_canonical().num_rows)
+                self.assertEqual(200, server.status_codes[-1])
+        finally:
+            BaseSourceHandler._http_cache = None
+        self.assertEqual(2, len(os.listdir('working/cache')))
+
+    def test_http_cache_evict(self):
+        for i in range(3):
+            with open(f'working/file_{i}.csv', 'w') as f:
+                f.write('a' * 100)
+        cache = HttpCache(path='working/cache', max_size=250)
+        with LocalServer('working') as server:
+            paths = [cache.fetch(BaseSourceHandler.http_session(), f'{server.url}/file_{i}.csv') for i in range(3)]
+        # the least recently used is evicted
+        self.assertEqual([False, True, True], [os.path.exists(p) for p in paths])
+        cache.clear()
+        self.assertEqual([], os.listdir('working/cache'))
+
+
+class LocalServer(object):
+    """ a local keep-alive http file server recording the client port, command and status code of each request """
+
+    def __init__(self, directory: str):
+        client_ports = self.client_ports = []
+        status_codes = self.status_codes = []
+        commands = self.commands = []
+
+        class Handler(SimpleHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def handle_one_request(self):
+                client_ports.append(self.client_address[1])
+                super().handle_one_request()
+
+            def send_response(self, code, message=None):
+                status_codes.append(code)
+                commands.append(self.command)
+                super().send_response(code, message)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), partial(Handler, directory=directory))
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def get_table():
+    num = pa.array([1.0, None, 5.0, -0.46421, 3.5, 7.233, -2], pa.float64())
+    val = pa.array([1, 2, 3, 4, 5, 6, 7], pa.int64())
+    date = pc.strptime(["2023-01-02 04:49:06", "2023-01-02 04:57:12", None, None, "2023-01-02 05:23:50", None, None],
+                       format='%Y-%m-%d %H:%M:%S', unit='ns')
+    text = pa.array(["Blue", "Green", None, 'Red', 'Orange', 'Yellow', 'Pink'], pa.string())
+    binary = pa.array([True, True, None, False, False, True, False], pa.bool_())
+    cat = pa.array([None, 'M', 'F', 'M', 'F', 'M', 'M'], pa.string()).dictionary_encode()
+    return pa.table([num, val, date, text, binary, cat], names=['num', 'int', 'date', 'text', 'bool', 'cat'])
+
+
+if __name__ == '__main__':
+    unittest.main()
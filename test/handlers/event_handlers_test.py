@@ -1,4 +1,8 @@
 import unittest
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
 import os
 from pathlib import Path
 import shutil
@@ -10,6 +14,7 @@ import pyarrow.compute as pc
 
 from ds_core.handlers.abstract_handlers import ConnectorContract
 from ds_core.handlers.event_handlers import EventSourceHandler, EventPersistHandler, EventManager
+from ds_core.handlers.event_handlers import SharedEventManager
 from ds_core.properties.property_manager import PropertyManager
 from test.components.pyarrow_component import PyarrowComponent
 
@@ -115,6 +120,89 @@ class FeatureBuilderTest(unittest.TestCase):
         out_handler = EventSourceHandler(cc)
         result = out_handler.load_canonical()
         self.assertTrue(tbl.equals(result))
+        result = out_handler.load_canonical(columns=['int'], filter=[('int', '>', 5)])
+        self.assertEqual({'int': [6, 7]}, result.to_pydict())
+        reader = out_handler.load_canonical(stream=True)
+        self.assertTrue(tbl.equals(reader.read_all()))
+
+    def test_asyncio(self):
+        tbl = get_table()
+        cc = ConnectorContract('event://task/', 'module_name', 'handler')
+        in_handler = EventPersistHandler(cc)
+        out_handler = EventSourceHandler(cc)
+
+        async def run():
+            await in_handler.apersist_canonical(tbl)
+            self.assertTrue(await out_handler.aexists())
+            self.assertTrue(await out_handler.ahas_changed())
+            results = await asyncio.gather(*[out_handler.aload_canonical(columns=['int']) for _ in range(10)])
+            self.assertFalse(await out_handler.ahas_changed())
+            return results
+        results = asyncio.run(run())
+        self.assertEqual([tbl.select(['int'])] * 10, results)
+
+    def test_shared_event_manager(self):
+        tbl = get_table()
+        em = SharedEventManager(namespace='hadron_test').reset()
+        em.set('task', tbl)
+        em.set('empty', None)
+        self.assertEqual(['task', 'empty'], em.event_names())
+        self.assertTrue(tbl.equals(em.get('task')))
+        self.assertIsNone(em.get('empty'))
+        # another manager in the namespace sees the same catalog
+        other = SharedEventManager(namespace='hadron_test')
+        self.assertTrue(tbl.equals(other.get('task')))
+        sub_tbl = tbl.drop_columns(['num', 'cat'])
+        other.update('task', sub_tbl)
+        self.assertTrue(sub_tbl.equals(em.get('task')))
+        em.delete('task')
+        self.assertFalse(other.is_event('task'))
+        em.unlink()
+
+    def test_shared_connector_contract(self):
+        tbl = get_table()
+        cc = ConnectorContract('event://shared_task/', 'module_name', 'handler', shared=True)
+        handler = EventPersistHandler(cc)
+        self.assertIsInstance(handler.event_manager, SharedEventManager)
+        handler.event_manager.reset()
+        handler.persist_canonical(tbl)
+        # loaded in a spawned process from the shared memory segment
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(load_shared_event, 'event://shared_task/').result()
+        self.assertEqual(tbl.select(['int']).to_pydict(), result)
+        # a later contract of another event doesn't switch the shared event to the local manager
+        local = EventPersistHandler(ConnectorContract('event://local_task/', 'module_name', 'handler'))
+        self.assertNotIsInstance(local.event_manager, SharedEventManager)
+        handler = EventPersistHandler(cc)
+        self.assertIsInstance(handler.event_manager, SharedEventManager)
+        handler.event_manager.unlink()
+        EventSourceHandler._shared_events.discard('shared_task')
+
+    def test_shared_concurrent(self):
+        tbl = get_table()
+        em = SharedEventManager(namespace='hadron_test').reset()
+        other = SharedEventManager(namespace='hadron_test')
+        errors = []
+
+        def write():
+            for i in range(50):
+                em.update(f"event_{i % 5}", tbl.slice(0, i % 7 + 1))
+
+        def read():
+            try:
+                for _ in range(200):
+                    for name in other.event_names():
+                        other.is_event(name)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([], errors)
+        self.assertEqual(5, len(other.event_names()))
+        em.unlink()
 
     def test_raise(self):
         startTime = datetime.now()
@@ -123,6 +211,11 @@ class FeatureBuilderTest(unittest.TestCase):
         self.assertTrue("'NoEnvValueTest'" in str(context.exception))
         print(f"Duration - {str(datetime.now() - startTime)}")
 
+def load_shared_event(uri: str) -> dict:
+    cc = ConnectorContract(uri, 'module_name', 'handler', shared=True)
+    return EventSourceHandler(cc).load_canonical(columns=['int']).to_pydict()
+
+
 def get_table():
     num = pa.array([1.0, None, 5.0, -0.46421, 3.5, 7.233, -2], pa.float64())
     val = pa.array([1, 2, 3, 4, 5, 6, 7], pa.int64())
@@ -0,0 +1,131 @@
+import unittest
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.fs as fs
+
+from ds_core.handlers.abstract_handlers import ConnectorContract
+from ds_core.handlers.fs_handlers import FsSourceHandler, FsPersistHandler
+from test.handlers.base_handlers_test import get_table
+
+
+class FsHandlersTest(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs('working', exist_ok=True)
+
+    def tearDown(self):
+        try:
+            shutil.rmtree('working')
+        except OSError:
+            pass
+
+    def test_runs(self):
+        """Basic smoke test"""
+        cc = ConnectorContract('working/example.parquet', 'ds_core.handlers.fs_handlers', 'FsPersistHandler')
+        FsPersistHandler(cc)
+
+    def test_local(self):
+        tbl = get_table()
+        for uri in ['working/example', f"file://{os.path.abspath('working')}/example"]:
+            for file_type in ['parquet', 'csv', 'arrow']:
+                cc = ConnectorContract(f'{uri}.{file_type}', 'module_name', 'handler')
+                handler = FsPersistHandler(cc)
+                self.assertIsInstance(handler.filesystem, fs.LocalFileSystem)
+                self.assertFalse(handler.exists())
+                handler.persist_canonical(tbl)
+                self.assertTrue(handler.exists())
+                self.assertTrue(handler.has_changed())
+                result = FsSourceHandler(cc).load_canonical()
+                self.assertEqual(tbl.shape, result.shape)
+                result = handler.load_canonical(columns=['int'], filter=[('int', '>', 5)])
+                self.assertEqual([6, 7], result.column('int').to_pylist())
+                self.assertFalse(handler.has_changed())
+                reader = handler.load_canonical(stream=True, batch_size=3)
+                self.assertEqual(7, reader.read_all().num_rows)
+                self.assertTrue(handler.remove_canonical())
+                self.assertFalse(handler.exists())
+        # no temporary files are left behind
+        self.assertEqual([], os.listdir('working'))
+
+    def test_sub_tree(self):
+        tbl = get_table()
+        cc = ConnectorContract('sub/example.parquet', 'module_name', 'handler', base_dir='working/root')
+        handler = FsPersistHandler(cc)
+        self.assertIsInstance(handler.filesystem, fs.SubTreeFileSystem)
+        handler.persist_canonical(tbl)
+        self.assertTrue(os.path.exists('working/root/sub/example.parquet'))
+        self.assertTrue(tbl.equals(handler.load_canonical()))
+        # partitioned
+        cc = ConnectorContract('sales', 'module_name', 'handler', base_dir='working/root', partition_cols=['cat'])
+        handler = FsPersistHandler(cc)
+        handler.persist_canonical(tbl.select(['int', 'cat']).cast(pa.schema([('int', pa.int64()),
+                                                                             ('cat', pa.string())])))
+        self.assertTrue(os.path.isdir('working/root/sales/cat=M'))
+        result = handler.load_canonical(filter=[('cat', '=', 'M')])
+        self.assertEqual([2, 4, 6, 7], sorted(result.column('int').to_pylist()))
+
+    def test_resolve(self):
+        # the path of other filesystems keeps the bucket
+        handler = FsSourceHandler(ConnectorContract('gs://bucket/sub/example.parquet', 'module_name', 'handler'))
+        self.assertEqual('bucket/sub/example.parquet', handler.path)
+        handler = FsSourceHandler(ConnectorContract('mock:///sub/example.parquet', 'module_name', 'handler'))
+        self.assertEqual('sub/example.parquet', handler.path)
+        # reading a missing source doesn't create its directories
+        cc = ConnectorContract('example.parquet', 'module_name', 'handler', base_dir='working/missing')
+        self.assertFalse(FsSourceHandler(cc).exists())
+        self.assertFalse(os.path.exists('working/missing'))
+        FsPersistHandler(cc).persist_canonical(get_table())
+        self.assertTrue(os.path.exists('working/missing/example.parquet'))
+
+    def test_read_ranges(self):
+        data = bytes(range(256)) * 1024
+        with open('working/data.bin', 'wb') as f:
+            f.write(data)
+        handler = FsSourceHandler(ConnectorContract('working/data.bin', 'module_name', 'handler'))
+        ranges = [(i * 1000, 100) for i in range(200)]
+        buffers = handler.read_ranges(ranges, max_workers=4)
+        self.assertEqual([data[o:o + n] for o, n in ranges], buffers)
+
+    @unittest.skipUnless(os.environ.get('HADRON_TEST_S3_ENDPOINT'), 'requires an S3 compatible endpoint, e.g. MinIO')
+    def test_s3(self):
+        fs_options = {'endpoint_override': os.environ['HADRON_TEST_S3_ENDPOINT'], 'scheme': 'http',
+                      'access_key': os.environ.get('HADRON_TEST_S3_ACCESS_KEY', 'minioadmin'),
+                      'secret_key': os.environ.get('HADRON_TEST_S3_SECRET_KEY', 'minioadmin'),
+                      'region': 'us-east-1', 'allow_bucket_creation': True, 'allow_bucket_deletion': True}
+        fs.S3FileSystem(**fs_options).create_dir('hadron-test')
+        tbl = get_table()
+        for file_type in ['parquet', 'csv', 'arrow']:
+            cc = ConnectorContract(f's3://hadron-test/example.{file_type}', 'module_name', 'handler',
+                                   fs_options=fs_options)
+            handler = FsPersistHandler(cc)
+            self.assertIsInstance(handler.filesystem, fs.S3FileSystem)
+            handler.persist_canonical(tbl)
+            self.assertTrue(handler.exists())
+            self.assertEqual(tbl.shape, handler.load_canonical().shape)
+            result = handler.load_canonical(columns=['int'], filter=[('int', '>', 5)])
+            self.assertEqual([6, 7], result.column('int').to_pylist())
+            self.assertTrue(handler.remove_canonical())
+            self.assertFalse(handler.exists())
+        # a multipart upload read back with concurrent range reads
+        large = pa.table({'num': pa.array(range(4_000_000), pa.int64())})
+        cc = ConnectorContract('s3://hadron-test/large.arrow', 'module_name', 'handler', fs_options=fs_options)
+        handler = FsPersistHandler(cc)
+        handler.persist_canonical(large)
+        self.assertTrue(large.equals(handler.load_canonical()))
+        buffers = handler.read_ranges([(0, 6), (1024, 10)])
+        self.assertEqual(b'ARROW1', buffers[0])
+        # a sub tree of the bucket
+        cc = ConnectorContract('s3://hadron-test/sub/example.parquet', 'module_name', 'handler',
+                               fs_options=fs_options, base_dir='hadron-test/root')
+        handler = FsPersistHandler(cc)
+        handler.persist_canonical(tbl)
+        self.assertTrue(tbl.equals(handler.load_canonical()))
+        info = fs.S3FileSystem(**fs_options).get_file_info('hadron-test/root/sub/example.parquet')
+        self.assertEqual(fs.FileType.File, info.type)
+        fs.S3FileSystem(**fs_options).delete_dir('hadron-test')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
-from ds_core.handlers.abstract_handlers import HandlerFactory, ConnectorContract
+from ds_core.handlers.abstract_handlers import HandlerFactory, HandlerRegistry, HandlerPool, ConnectorContract
 import unittest
+import os
+import sys
+import tempfile
 
 
 class HandlerFactoryTest(unittest.TestCase):
@@ -49,6 +52,98 @@ class HandlerFactoryTest(unittest.TestCase):
         result = HandlerFactory.check_handler(module_name='ds_core.handlers.pyarrow_handlers', handler='None')
         self.assertFalse(result)
 
+    def test_resolution_cache(self):
+        HandlerFactory.invalidate()
+        handler = HandlerFactory.get_handler('ds_core.handlers.base_handlers', 'BasePersistHandler')
+        # the class is the one already imported, not a re-executed copy
+        from ds_core.handlers.base_handlers import BasePersistHandler
+        self.assertIs(BasePersistHandler, handler)
+        self.assertIn(('ds_core.handlers.base_handlers', 'BasePersistHandler'), HandlerFactory._handlers)
+        connector_contract = ConnectorContract(uri='example.csv', module_name='ds_core.handlers.base_handlers',
+                                               handler='BasePersistHandler')
+        self.assertIsInstance(HandlerFactory.instantiate(connector_contract), BasePersistHandler)
+        # misses are cached too
+        self.assertIsNone(HandlerFactory.get_handler('ds_core.handlers.none', 'NoneHandler'))
+        self.assertIn(('ds_core.handlers.none', 'NoneHandler'), HandlerFactory._handlers)
+        HandlerFactory.invalidate(module_name='ds_core.handlers.none')
+        self.assertNotIn(('ds_core.handlers.none', 'NoneHandler'), HandlerFactory._handlers)
+        self.assertIn(('ds_core.handlers.base_handlers', 'BasePersistHandler'), HandlerFactory._handlers)
+        HandlerFactory.invalidate()
+        self.assertEqual({}, HandlerFactory._handlers)
+        # a module with a missing dependency raises the import error, not a cached miss
+        with tempfile.TemporaryDirectory() as site:
+            with open(os.path.join(site, 'broken_handlers.py'), 'w') as f:
+                f.write('import hadron_missing_dependency\n')
+            sys.path.insert(0, site)
+            try:
+                for _ in range(2):
+                    with self.assertRaises(ModuleNotFoundError) as context:
+                        HandlerFactory.get_handler('broken_handlers', 'BrokenPersistHandler')
+                    self.assertEqual('hadron_missing_dependency', context.exception.name)
+                self.assertNotIn(('broken_handlers', 'BrokenPersistHandler'), HandlerFactory._handlers)
+            finally:
+                sys.path.remove(site)
+                HandlerFactory.invalidate()
+
+    def test_registry(self):
+        self.assertEqual(('ds_core.handlers.sqlite_handlers', 'SqliteSourceHandler', 'SqlitePersistHandler'),
+                         HandlerRegistry.lookup('SQLITE'))
+        self.assertIsNone(HandlerRegistry.lookup('none'))
+        # the built-in pyarrow.fs schemes
+        for scheme in ['file', 's3', 's3a']:
+            self.assertEqual(('ds_core.handlers.fs_handlers', 'FsSourceHandler', 'FsPersistHandler'),
+                             HandlerRegistry.lookup(scheme))
+        # registration is by name only, the module is not imported until used
+        HandlerRegistry.register('lazy', 'ds_core.handlers.lazy_handlers', 'LazyPersistHandler')
+        self.assertEqual(('ds_core.handlers.lazy_handlers', 'LazySourceHandler', 'LazyPersistHandler'),
+                         HandlerRegistry.lookup('lazy'))
+        self.assertIn('lazy', HandlerRegistry.schemes())
+        HandlerRegistry.unregister('lazy')
+        self.assertIsNone(HandlerRegistry.lookup('lazy'))
+        # a package installed with an entry point
+        with tempfile.TemporaryDirectory() as site:
+            dist_info = os.path.join(site, 'hadron_plugin-0.1.dist-info')
+            os.makedirs(dist_info)
+            with open(os.path.join(dist_info, 'METADATA'), 'w') as f:
+                f.write('Metadata-Version: 2.1\nName: hadron-plugin\nVersion: 0.1\n')
+            with open(os.path.join(dist_info, 'entry_points.txt'), 'w') as f:
+                f.write('[hadron.handlers]\nplugin = hadron_plugin.handlers:PluginPersistHandler\n')
+            sys.path.insert(0, site)
+            try:
+                HandlerRegistry.invalidate()
+                self.assertEqual(('hadron_plugin.handlers', 'PluginSourceHandler', 'PluginPersistHandler'),
+                                 HandlerRegistry.lookup('plugin'))
+            finally:
+                sys.path.remove(site)
+                HandlerRegistry.invalidate()
+        self.assertIsNone(HandlerRegistry.lookup('plugin'))
+
+    def test_handler_pool(self):
+        HandlerPool.clear()
+        module, handler = 'ds_core.handlers.base_handlers', 'BasePersistHandler'
+        handler1 = HandlerPool.acquire(ConnectorContract('FILE://Work/./data.csv?a=1&b=2', module, handler, sep=','))
+        # the normalised contract shares the handler
+        handler2 = HandlerPool.acquire(ConnectorContract('file://work/data.csv?b=2&a=1', module, handler, sep=','))
+        self.assertIs(handler1, handler2)
+        handler3 = HandlerPool.acquire(ConnectorContract('file://work/data.csv', module, handler, sep='|'))
+        self.assertIsNot(handler1, handler3)
+        self.assertEqual({'handlers': 2, 'in_use': 2, 'idle': 0}, HandlerPool.stats())
+        HandlerPool.release(handler1)
+        self.assertEqual({'handlers': 2, 'in_use': 2, 'idle': 0}, HandlerPool.stats())
+        HandlerPool.release(handler2)
+        self.assertEqual({'handlers': 2, 'in_use': 1, 'idle': 1}, HandlerPool.stats())
+        # idle handlers are evicted after the timeout
+        idle_timeout = HandlerPool.IDLE_TIMEOUT
+        HandlerPool.IDLE_TIMEOUT = 0
+        try:
+            HandlerPool.release(handler3)
+            self.assertEqual({'handlers': 0, 'in_use': 0, 'idle': 0}, HandlerPool.stats())
+        finally:
+            HandlerPool.IDLE_TIMEOUT = idle_timeout
+        self.assertIsNot(handler1, HandlerPool.acquire(ConnectorContract('file://work/data.csv?a=1&b=2', module,
+                                                                         handler, sep=',')))
+        HandlerPool.clear()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import os
+import shutil
+import threading
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from ds_core.handlers.abstract_handlers import ConnectorContract
+from ds_core.handlers.sqlite_handlers import SqliteSourceHandler, SqlitePersistHandler
+from test.handlers.base_handlers_test import get_table
+
+
+class SqliteHandlersTest(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs('working', exist_ok=True)
+
+    def tearDown(self):
+        for pool in SqliteSourceHandler._pools.values():
+            pool.close()
+        SqliteSourceHandler._pools.clear()
+        try:
+            shutil.rmtree('working')
+        except OSError:
+            pass
+
+    def test_runs(self):
+        """Basic smoke test"""
+        cc = ConnectorContract('sqlite://working/example.db?table=example', 'ds_core.handlers.sqlite_handlers',
+                               'SqlitePersistHandler')
+        SqlitePersistHandler(cc)
+
+    def test_persist_load(self):
+        tbl = get_table()
+        cc = ConnectorContract('sqlite://working/example.db?table=example', 'module_name', 'handler')
+        handler = SqlitePersistHandler(cc)
+        self.assertFalse(handler.exists())
+        handler.persist_canonical(tbl)
+        self.assertTrue(handler.exists())
+        self.assertTrue(handler.has_changed())
+        result = SqliteSourceHandler(cc).load_canonical()
+        self.assertEqual(tbl.column_names, result.column_names)
+        self.assertEqual(pa.timestamp('ns'), result.schema.field('date').type)
+        self.assertEqual(tbl.column('date').to_pylist(), result.column('date').to_pylist())
+        self.assertEqual(tbl.column('bool').to_pylist(), result.column('bool').to_pylist())
+        self.assertEqual(tbl.column('cat').to_pylist(), result.column('cat').to_pylist())
+        handler.load_canonical()
+        self.assertFalse(handler.has_changed())
+        # append and replace
+        handler.persist_canonical(tbl, if_exists='append')
+        self.assertTrue(handler.has_changed())
+        self.assertEqual(14, handler.load_canonical().num_rows)
+        handler.persist_canonical(tbl)
+        self.assertEqual(7, handler.load_canonical().num_rows)
+        self.assertTrue(handler.remove_canonical())
+        self.assertFalse(handler.exists())
+
+    def test_stream_filter(self):
+        tbl = pa.table({'id': pa.array(range(1000), pa.int64()), 'name': [f"n{i}" for i in range(1000)]})
+        cc = ConnectorContract('sqlite://working/example.db', 'module_name', 'handler', table='names')
+        handler = SqlitePersistHandler(cc)
+        handler.persist_canonical(tbl, batch_size=128)
+        reader = handler.load_canonical(stream=True, batch_size=100)
+        self.assertIsInstance(reader, pa.RecordBatchReader)
+        self.assertEqual(10, len(list(reader)))
+        # pushed down as a where clause
+        result = handler.load_canonical(columns=['name'], filter=[('id', '=', 7)])
+        self.assertEqual(['n7'], result.column('name').to_pylist())
+        result = handler.load_canonical(filter=[[('id', 'in', [1, 2])], [('name', '=', 'n900')]])
+        self.assertEqual([1, 2, 900], result.column('id').to_pylist())
+        # an expression is applied to each batch
+        result = handler.load_canonical(filter=pc.field('id') >= 995, batch_size=100)
+        self.assertEqual(5, result.num_rows)
+        # a query with parameters
+        result = handler.load_canonical(query="SELECT id FROM names WHERE id < ?", params=(3,))
+        self.assertEqual([0, 1, 2], result.column('id').to_pylist())
+
+    def test_table_kwarg(self):
+        tbl = pa.table({'id': pa.array(range(10), pa.int64())})
+        cc = ConnectorContract('sqlite://working/example.db', 'module_name', 'handler')
+        handler = SqlitePersistHandler(cc)
+        # the table can be given on persist when the contract has none
+        self.assertTrue(handler.persist_canonical(tbl, table='ids'))
+        result = handler.load_canonical(query="SELECT id FROM ids")
+        self.assertEqual(list(range(10)), result.column('id').to_pylist())
+
+    def test_pool(self):
+        tbl = pa.table({'id': pa.array(range(100), pa.int64())})
+        cc = ConnectorContract('sqlite://memory', 'module_name', 'handler', table='ids', pool_size=2)
+        handler = SqlitePersistHandler(cc)
+        handler.persist_canonical(tbl)
+        # the in memory database is shared by the connections of the pool
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(SqliteSourceHandler(cc).load_canonical().num_rows))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([100] * 8, results)
+        self.assertIs(handler.pool(), SqliteSourceHandler(cc).pool())
+        self.assertLessEqual(handler.pool()._created, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
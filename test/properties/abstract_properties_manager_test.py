@@ -1,12 +1,15 @@
+import gc
 import os
 import shutil
+import time
 import unittest
 from pprint import pprint
+from unittest import mock
 
 from ds_core.components.core_commons import CoreCommons
-from ds_core.handlers.abstract_handlers import ConnectorContract
+from ds_core.handlers.abstract_handlers import ConnectorContract, HandlerPool
 
-from ds_core.properties.abstract_properties import AbstractPropertyManager, AbstractProperty
+from ds_core.properties.abstract_properties import AbstractPropertyManager, AbstractProperty, ContractWriter
 from ds_core.properties.property_manager import PropertyManager
 
 
@@ -19,6 +22,10 @@ class ControlPropertyManager(AbstractPropertyManager):
         root_keys += ['cleaners']
         super().__init__(task_name, root_keys, knowledge_keys, creator)
 
+    @staticmethod
+    def get_pkg_root():
+        return 'test'
+
     @classmethod
     def manager_name(cls) -> str:
         return str(cls.__name__).lower().replace('propertymanager', '')
@@ -166,6 +173,155 @@ class AbstractPropertiesManagerTest(unittest.TestCase):
         self.assertEqual(self.connector.get_key_value('sep'), result.get_key_value('sep'))
         self.assertEqual(self.connector.get_key_value('encoding'), result.get_key_value('encoding'))
 
+    def test_handler_pool_release(self):
+        HandlerPool.clear()
+        for i in range(5):
+            dpm = ControlPropertyManager('test_abstract_properties')
+            cc = ConnectorContract(f'works/data_{i}.csv', module_name='ds_core.handlers.base_handlers',
+                                   handler='BasePersistHandler')
+            dpm.set_connector_contract(connector_name=f'source_{i}', connector_contract=cc)
+            dpm.get_connector_handler(f'source_{i}')
+        gc.collect()
+        # only the live manager holds its handler
+        self.assertEqual({'handlers': 5, 'in_use': 1, 'idle': 4}, HandlerPool.stats())
+        del dpm
+        gc.collect()
+        self.assertEqual({'handlers': 5, 'in_use': 0, 'idle': 5}, HandlerPool.stats())
+        HandlerPool.clear()
+
+    def test_persist_unchanged(self):
+        dpm = ControlPropertyManager('test_abstract_properties')
+        connector = ConnectorContract(uri='works/config_contract.parquet', module_name='ds_core.handlers.base_handlers',
+                                      handler='BasePersistHandler')
+        dpm.set_property_connector(connector)
+        dpm.persist_properties()
+        mtime = os.stat('works/config_contract.parquet').st_mtime_ns
+        # unchanged properties are not written again
+        dpm.persist_properties()
+        self.assertEqual(mtime, os.stat('works/config_contract.parquet').st_mtime_ns)
+        dpm.set_description('changed')
+        dpm.persist_properties()
+        self.assertNotEqual(mtime, os.stat('works/config_contract.parquet').st_mtime_ns)
+        mtime = os.stat('works/config_contract.parquet').st_mtime_ns
+        dpm.persist_properties(force=True)
+        self.assertNotEqual(mtime, os.stat('works/config_contract.parquet').st_mtime_ns)
+
+    def test_persist_unchanged_registered(self):
+        dpm = ControlPropertyManager('test_abstract_properties')
+        connector = ConnectorContract(uri='sqlite://works/config_contract.db?table=contract',
+                                      module_name='ds_core.handlers.sqlite_handlers', handler='SqlitePersistHandler')
+        dpm.set_property_connector(connector)
+        dpm.persist_properties()
+        # re-setting the same values leaves the branch clean
+        dpm.set_version(dpm.version)
+        dpm.get_connector_contract(dpm.CONNECTOR_PM_CONTRACT)
+        self.assertFalse(PropertyManager.is_dirty(dpm.KEY.contract_key))
+        handler = dpm.get_connector_handler(dpm.CONNECTOR_PM_CONTRACT)
+        with mock.patch.object(handler, 'persist_canonical') as persist:
+            for _ in range(3):
+                dpm.persist_properties()
+        persist.assert_not_called()
+
+    def test_persist_backup(self):
+        dpm = ControlPropertyManager('test_abstract_properties')
+        connector = ConnectorContract(uri='works/config_contract.parquet', module_name='ds_core.handlers.base_handlers',
+                                      handler='BasePersistHandler')
+        backup = ConnectorContract(uri='works/config_backup.parquet', module_name='ds_core.handlers.base_handlers',
+                                   handler='BasePersistHandler')
+        dpm.set_property_connector(connector)
+        dpm.persist_properties()
+        dpm.set_version('9.9.9')
+        # a backup leaves the change for the property connector
+        dpm.persist_properties(connector_contract=backup)
+        self.assertTrue(os.path.exists('works/config_backup.parquet'))
+        dpm.persist_properties()
+        PropertyManager._remove_all()
+        dpm = ControlPropertyManager('test_abstract_properties')
+        dpm.set_property_connector(connector)
+        dpm.load_properties()
+        self.assertEqual('9.9.9', dpm.version)
+
+    def test_transaction(self):
+        dpm = ControlPropertyManager('test_abstract_properties')
+        connector = ConnectorContract(uri='works/config_contract.parquet', module_name='ds_core.handlers.base_handlers',
+                                      handler='BasePersistHandler')
+        dpm.set_property_connector(connector)
+        with dpm.transaction():
+            dpm.set_description('first')
+            dpm.persist_properties()
+            dpm.set_status('batched')
+            dpm.persist_properties()
+            # persisted once on exit
+            self.assertFalse(os.path.exists('works/config_contract.parquet'))
+        self.assertTrue(os.path.exists('works/config_contract.parquet'))
+        self.assertEqual('batched', dpm.status)
+        # rolled back on an exception
+        with self.assertRaises(ValueError):
+            with dpm.transaction():
+                dpm.set_description('second')
+                dpm.set_connector_contract('raw_source', self.connector)
+                raise ValueError('rollback')
+        self.assertEqual('first', dpm.description)
+        self.assertFalse(dpm.has_connector('raw_source'))
+
+    def test_write_behind(self):
+        dpm = ControlPropertyManager('test_abstract_properties')
+        connector = ConnectorContract(uri='works/config_contract.parquet', module_name='ds_core.handlers.base_handlers',
+                                      handler='BasePersistHandler')
+        dpm.set_property_connector(connector)
+        dpm.set_write_behind(60)
+        for i in range(10):
+            dpm.set_description(f"description {i}")
+            dpm.persist_properties()
+        # coalesced into one pending write
+        self.assertFalse(os.path.exists('works/config_contract.parquet'))
+        self.assertEqual(1, ContractWriter.pending())
+        dpm.flush()
+        self.assertEqual(0, ContractWriter.pending())
+        PropertyManager._remove_all()
+        dpm = ControlPropertyManager('test_abstract_properties')
+        dpm.set_property_connector(connector)
+        dpm.load_properties()
+        self.assertEqual('description 9', dpm.description)
+        # written by the background thread once the window has passed
+        dpm.set_write_behind(0.05)
+        dpm.set_description('background')
+        dpm.persist_properties()
+        for _ in range(100):
+            if ContractWriter.pending() == 0:
+                break
+            time.sleep(0.05)
+        dpm.flush()
+        dpm.set_write_behind(None)
+        PropertyManager._remove_all()
+        dpm = ControlPropertyManager('test_abstract_properties')
+        dpm.set_property_connector(connector)
+        dpm.load_properties()
+        self.assertEqual('background', dpm.description)
+
+    def test_write_behind_concurrent(self):
+        connector = ConnectorContract(uri='works/config_contract.parquet', module_name='ds_core.handlers.base_handlers',
+                                      handler='BasePersistHandler')
+        for _ in range(3):
+            dpm = ControlPropertyManager('test_abstract_properties')
+            dpm.set_property_connector(connector)
+            dpm.set_write_behind(0.0)
+            # the background writer persists while the properties are changed
+            for i in range(200):
+                dpm.set_knowledge('schema', f"column_{i}", f"the column {i}")
+                dpm.persist_properties()
+            dpm.flush()
+            dpm.set_write_behind(None)
+            expected = dpm.get_knowledge('schema')
+            self.assertEqual(200, len(expected))
+            PropertyManager._remove_all()
+            dpm = ControlPropertyManager('test_abstract_properties')
+            dpm.set_property_connector(connector)
+            dpm.load_properties()
+            self.assertEqual(expected, dpm.get_knowledge('schema'))
+            dpm.reset_knowledge()
+            PropertyManager._remove_all()
+
     def test_set_version(self):
         dpm = ControlPropertyManager('test_abstract_properties')
         self.assertEqual('0.0.1', dpm.get(dpm.KEY.version_key))
@@ -0,0 +1,42 @@
+"""
+A microbenchmark of PropertyManager get and is_key on a deep contract, comparing the flat key index with
+walking the tree from the root. Run from the project root with:
+
+    python -m test.properties.property_manager_benchmark
+"""
+import timeit
+
+from ds_core.properties.property_manager import PropertyManager
+
+
+def build(depth: int=12, width: int=20) -> list:
+    """ builds a contract of the given depth with width leaves at each level and returns the leaf keys """
+    pm = PropertyManager()
+    keys = []
+    path = 'hadron'
+    for level in range(depth):
+        path = pm.join(path, f"level{level}")
+        for leaf in range(width):
+            key = pm.join(path, f"leaf{leaf}")
+            pm.set(key, leaf)
+            keys.append(key)
+    return keys
+
+
+def main(number: int=20):
+    pm = PropertyManager()
+    keys = build()
+    deep = keys[-20:]
+    walk = timeit.timeit(lambda: [pm._walk(k)[0].get(k.rpartition('.')[2]) for k in deep], number=number * 1000)
+    get = timeit.timeit(lambda: [pm.get(k) for k in deep], number=number * 1000)
+    is_key = timeit.timeit(lambda: [pm.is_key(k) for k in deep], number=number * 1000)
+    per_call = 1e9 / (number * 1000 * len(deep))
+    print(f"depth {deep[0].count('.')} keys, {len(keys)} leaves")
+    print(f"walk   {walk * per_call:8.1f} ns")
+    print(f"get    {get * per_call:8.1f} ns  {walk / get:.1f}x")
+    print(f"is_key {is_key * per_call:8.1f} ns  {walk / is_key:.1f}x")
+    pm._remove_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,12 @@
 import os
 import shutil
 import unittest
+from unittest import mock
 from pprint import pprint
 
 from ds_core.handlers.abstract_handlers import ConnectorContract, HandlerFactory
 from ds_core.properties.property_manager import PropertyManager
+from ds_core.properties.property_serialisers import PropertySerialiser
 
 
 class PropertyManagerTest(unittest.TestCase):
@@ -75,6 +77,86 @@ class PropertyManagerTest(unittest.TestCase):
         self.assertTrue(pm.is_key('KeyA'))
         self.assertEqual('ValueA', pm.get('KeyA'))
 
+    def test_dump_load_format(self):
+        connector_contract = ConnectorContract(uri='event://pm_story',
+                                               module_name='ds_core.handlers.event_handlers',
+                                               handler='EventPersistHandler')
+        handler = HandlerFactory.instantiate(connector_contract)
+        pm = PropertyManager()
+        pm.set('root.intent', {'level': {'params': {'num': 1.5, 'cols': ('a', 'b'), 'flag': None, 'raw': b'x'}}})
+        control = pm.get('root')
+        for format_name in ['binary', 'literal']:
+            pm.dump(handler, format_name=format_name)
+            pm.remove('root')
+            pm.load(handler)
+            self.assertEqual(control, pm.get('root'))
+        # json loads tuples back as lists
+        pm.set('root.intent.level.params.raw', 'x')
+        pm.dump(handler, format_name='json')
+        pm.load(handler, replace=True)
+        self.assertEqual(['a', 'b'], pm.get('root.intent.level.params.cols'))
+        # the format is taken from the header, and data without one is the literal repr of earlier releases
+        data = {'KeyA': ('ValueA', 1)}
+        self.assertEqual(data, PropertySerialiser.loads(str(data).encode('utf8')))
+        self.assertTrue(PropertySerialiser.dumps(data, format_name='binary').startswith(PropertySerialiser.MAGIC))
+        # the default is readable by earlier releases
+        self.assertEqual(str(data).encode('utf8'), PropertySerialiser.dumps(data))
+        with self.assertRaises(LookupError):
+            pm.dump(handler, format_name='none')
+
+    def test_dirty(self):
+        connector_contract = ConnectorContract(uri='event://pm_story',
+                                               module_name='ds_core.handlers.event_handlers',
+                                               handler='EventPersistHandler')
+        handler = HandlerFactory.instantiate(connector_contract)
+        pm = PropertyManager()
+        pm.set('root.task1.intent', {'level': 1})
+        pm.set('root.task2.intent', {'level': 2})
+        self.assertTrue(pm.is_dirty('root.task1'))
+        self.assertTrue(pm.is_dirty('root'))
+        self.assertTrue(pm.is_dirty('root.task1.intent.level'))
+        pm.dump(handler, key='root.task1')
+        self.assertFalse(pm.is_dirty('root.task1'))
+        self.assertTrue(pm.is_dirty('root.task2'))
+        pm.remove('root.task1.intent')
+        self.assertTrue(pm.is_dirty('root.task1'))
+        pm.dump(handler)
+        self.assertFalse(pm.is_dirty())
+        # a change above the branch is kept for its other branches
+        pm.set('root', {'task3': {}})
+        pm.dump(handler, key='root.task1')
+        self.assertFalse(pm.is_dirty('root.task1'))
+        self.assertTrue(pm.is_dirty('root.task3'))
+        self.assertTrue(pm.is_dirty('root'))
+        pm.load(handler, replace=True)
+        self.assertFalse(pm.is_dirty())
+
+    def test_dirty_during_dump(self):
+        connector_contract = ConnectorContract(uri='event://pm_story',
+                                               module_name='ds_core.handlers.event_handlers',
+                                               handler='EventPersistHandler')
+        handler = HandlerFactory.instantiate(connector_contract)
+        pm = PropertyManager()
+        pm.set('root.task1', 1)
+        persist = handler.persist_canonical
+
+        def persist_with_change(canonical, **kwargs):
+            pm.set('root.task2', 2)
+            return persist(canonical, **kwargs)
+
+        # a change made while persisting stays dirty
+        with mock.patch.object(handler, 'persist_canonical', side_effect=persist_with_change):
+            pm.dump(handler, key='root')
+        self.assertTrue(pm.is_dirty('root.task2'))
+        self.assertFalse(pm.is_dirty('root.task1'))
+        # the changes are kept should the persist fail
+        with mock.patch.object(handler, 'persist_canonical', side_effect=OSError('failed')):
+            with self.assertRaises(OSError):
+                pm.dump(handler, key='root')
+        self.assertTrue(pm.is_dirty('root.task2'))
+        pm.dump(handler, key='root')
+        self.assertFalse(pm.is_dirty('root'))
+
     def test_dump_load_key(self):
         connector_contract = ConnectorContract(uri='event://pm_story',
                                                module_name='ds_core.handlers.event_handlers',
@@ -190,6 +272,44 @@ class PropertyManagerTest(unittest.TestCase):
         self.assertEqual('01b2', pm.get('level0.level1.branch2'))
         self.assertEqual({'branch1': '01b1', 'branch2': '01b2'}, pm.get('level0.level1'))
 
+    def test_index(self):
+        connector_contract = ConnectorContract(uri='event://pm_story',
+                                               module_name='ds_core.handlers.event_handlers',
+                                               handler='EventPersistHandler')
+        handler = HandlerFactory.instantiate(connector_contract)
+        pm = PropertyManager()
+        pm.set('level0.level1.branch1', '01b1')
+        self.assertEqual('01b1', pm.get('level0.level1.branch1'))
+        self.assertFalse(pm.is_key('level0.level1.branch2'))
+        self.assertFalse(pm.is_key('level0.level1.branch1.leaf'))
+        # set and remove invalidate the key, its ancestors and its descendants
+        pm.set('level0.level1.branch2', '01b2')
+        self.assertEqual('01b2', pm.get('level0.level1.branch2'))
+        self.assertEqual({'branch1': '01b1', 'branch2': '01b2'}, pm.get('level0.level1'))
+        pm.set('level0', {'level1': {'branch1': '01b3'}})
+        self.assertEqual('01b3', pm.get('level0.level1.branch1'))
+        pm.remove('level0.level1')
+        self.assertFalse(pm.is_key('level0.level1.branch1'))
+        self.assertIsNone(pm.get('level0.level1.branch2'))
+        self.assertTrue(pm.is_key('level0'))
+        # a value changed in place is seen
+        pm.set('level0.level1.branch1', '01b1')
+        self.assertFalse(pm.is_key('level0.level1.branch2'))
+        pm.get('level0.level1')['branch2'] = '01b2'
+        self.assertEqual('01b2', pm.get('level0.level1.branch2'))
+        # a key set to None exists with the default value
+        pm.set('level0.none', None)
+        self.assertTrue(pm.is_key('level0.none'))
+        self.assertEqual('default', pm.get('level0.none', 'default'))
+        # load replaces the index
+        pm.dump(handler)
+        pm.set('level0.level1.branch1', 'changed')
+        self.assertEqual('changed', pm.get('level0.level1.branch1'))
+        pm.load(handler, replace=True)
+        self.assertEqual('01b1', pm.get('level0.level1.branch1'))
+        pm._remove_all()
+        self.assertFalse(pm.is_key('level0'))
+
     def test_replace_list(self):
         # Configuration
         pm = PropertyManager()